@@ -0,0 +1,151 @@
+"""
+An asyncio-based runner for validation tests, for file systems (eg, NFS or
+Lustre) where the latency of each file is high but the aggregate bandwidth is
+large.
+
+The event loop keeps a bounded number of files in flight; each file is read
+and hashed on a thread pool (`hashlib` releases the GIL while it digests large
+buffers). The number of files in flight can adapt to the observed throughput:
+it is increased while that increases the throughput, and cut back when the
+throughput falls.
+"""
+
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+# The number of files in flight when an adaptive run starts
+INITIAL_IN_FLIGHT = 4
+
+# The throughput is measured over windows of at least this many files (and at
+# least as many files as are in flight)
+MIN_WINDOW = 8
+
+# Relative changes in throughput smaller than this are treated as noise
+THROUGHPUT_TOLERANCE = 0.1
+
+# The factor by which the limit is cut when the throughput falls
+DECREASE_FACTOR = 0.75
+
+
+class AdaptiveLimit:
+    """
+    `AdaptiveLimit` holds the number of files that may be in flight, and
+    adjusts it to the observed throughput with an additive-increase /
+    multiplicative-decrease rule: after each window of completed files the
+    limit grows by one if the throughput has risen, and is cut by
+    `DECREASE_FACTOR` if the throughput has fallen (changes smaller than
+    `THROUGHPUT_TOLERANCE` leave the limit as it is).
+    """
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.previous_throughput = None
+        self._start_window(time.perf_counter())
+
+    def _start_window(self, now):
+        self._window_started = now
+        self._window_bytes = 0
+        self._window_files = 0
+
+    def record(self, bytes_read):
+        """
+        Record that a file has been read, and update the limit if this
+        completes a window.
+
+        :param bytes_read: The number of bytes read from the file.
+        """
+        self._window_bytes += bytes_read
+        self._window_files += 1
+        if self._window_files < max(self.limit, MIN_WINDOW):
+            return
+
+        now = time.perf_counter()
+        throughput = self._window_bytes / max(now - self._window_started, 1e-9)
+        previous = self.previous_throughput
+        if previous is not None and throughput < previous * (1 - THROUGHPUT_TOLERANCE):
+            self.limit = max(self.minimum, int(self.limit * DECREASE_FACTOR))
+        elif previous is None or throughput > previous * (1 + THROUGHPUT_TOLERANCE):
+            self.limit = min(self.maximum, self.limit + 1)
+        self.previous_throughput = throughput
+        self._start_window(now)
+
+
+def iter_group_results_async(
+    validate_group, validator_groups, max_in_flight=16, adaptive=True, instrument=False
+):
+    """
+    Apply each group of validators on a thread pool, with at most
+    `max_in_flight` groups running at once, yielding (index of the group, list
+    of results) as each group completes. Any groups that have not started when
+    the generator is closed are never started.
+
+    :param validate_group: A function that takes a group of validators and the
+    `instrument` flag, and returns a list of `ValidationResult`s.
+    :param validator_groups: A list of lists of Validator objects.
+    :param max_in_flight: The largest number of groups that may be running.
+    :param adaptive: Start with `INITIAL_IN_FLIGHT` groups in flight and adapt
+    this to the throughput (see `AdaptiveLimit`); otherwise keep
+    `max_in_flight` groups in flight.
+    :param instrument: Passed to `validate_group`.
+    """
+    initial = INITIAL_IN_FLIGHT if adaptive else max_in_flight
+    limit = AdaptiveLimit(initial, max_in_flight)
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max(max_in_flight, 1))
+
+    async def make_queue():
+        return asyncio.Queue()
+
+    async def dispatch(queue):
+        groups = enumerate(validator_groups)
+        running = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(running) < limit.limit:
+                    try:
+                        index, group = next(groups)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = loop.run_in_executor(
+                        executor, validate_group, group, instrument
+                    )
+                    running[future] = index
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    results = future.result()
+                    if adaptive:
+                        limit.record(sum(r.bytes_read or 0 for r in results))
+                    await queue.put((running.pop(future), results))
+        except Exception as error:
+            await queue.put(error)
+        await queue.put(None)
+
+    queue = loop.run_until_complete(make_queue())
+    dispatcher = loop.create_task(dispatch(queue))
+    try:
+        while True:
+            item = loop.run_until_complete(queue.get())
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        dispatcher.cancel()
+        try:
+            loop.run_until_complete(dispatcher)
+        except asyncio.CancelledError:
+            pass
+        executor.shutdown(wait=True)
+        loop.close()
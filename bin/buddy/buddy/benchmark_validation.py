@@ -0,0 +1,294 @@
+"""
+Benchmark the hashing and validation modes on synthetic files.
+
+Files of several sizes and comment layouts are generated, then each mode is
+timed on each file in a fresh child process, so that the peak resident memory
+(`ru_maxrss`) of each run can be recorded. The results are written as JSON, so
+that runs from different versions of the code can be compared.
+
+Eg, `python bin/buddy/buddy/benchmark_validation.py --sizes 1MB 1GB
+--modes md5 md5-comment --label my-branch --output benchmark.json`
+"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from buddy.validation_classes import (
+    HASH_CONSTRUCTORS,
+    Md5sumValidator,
+    get_chunk_digests,
+    get_digests,
+    get_md5sum,
+)
+from buddy.validation_workflow import ValidationWorkflow
+
+DEFAULT_SIZES = ["1MB", "100MB", "1GB", "10GB"]
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 10 ** 3, "MB": 10 ** 6, "GB": 10 ** 9}
+
+# The number of comment lines at the start of a file, and the fraction of the
+# remaining lines that are comments, for each layout
+COMMENT_LAYOUTS = {
+    "none": (0, 0.0),
+    "header": (100, 0.0),
+    "interleaved": (100, 0.1),
+}
+
+
+def _validate(path, **kwargs):
+    validator = Md5sumValidator(
+        test_name="benchmark", input_file=path, expected_md5sum="0" * 32
+    )
+    return ValidationWorkflow({"benchmark": validator}).run_validators(**kwargs)
+
+
+# Each mode: the kind of input file ("plain" or "gzip") and the function that
+# is timed on that file
+MODES = {
+    "md5+sha256": ("plain", lambda path: get_digests(path, ["md5", "sha256"])),
+    "md5-comment": ("plain", lambda path: get_md5sum(path, comment="#")),
+    "md5-gzip": ("gzip", lambda path: get_md5sum(path, compression="gzip")),
+    "md5-gzip-comment": (
+        "gzip",
+        lambda path: get_md5sum(path, comment="#", compression="gzip"),
+    ),
+    "chunks": ("plain", get_chunk_digests),
+    "workflow-full": ("plain", _validate),
+    "workflow-quick": ("plain", lambda path: _validate(path, level="quick")),
+    "workflow-async": (
+        "plain",
+        lambda path: _validate(path, runner="async", n_workers=4),
+    ),
+}
+for _algorithm in HASH_CONSTRUCTORS:
+    MODES[_algorithm] = (
+        "plain",
+        lambda path, algorithm=_algorithm: get_digests(path, [algorithm]),
+    )
+
+
+def parse_size(size):
+    """
+    Convert a size such as "100MB" (decimal units: B, KB, MB, GB) to bytes.
+    """
+    match = re.fullmatch(r"(\d+)\s*([KMG]?B?)", size.strip().upper())
+    if match is None:
+        raise ValueError("Can't parse the size `{}`".format(size))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def make_block(layout, block_size=1024 * 1024):
+    """
+    Make a block of tab-separated lines, some of which are comments (as set by
+    the `layout`; the header lines are not included). Files are made by
+    repeating this block.
+    """
+    _, fraction = COMMENT_LAYOUTS[layout]
+    comment_every = round(1 / fraction) if fraction else 0
+    lines = []
+    size = 0
+    index = 0
+    while size < block_size:
+        if comment_every and index % comment_every == 0:
+            line = "# comment line {}\n".format(index)
+        else:
+            line = "ENSG{:011d}\t{}\t{:.4f}\t{:.2f}\n".format(
+                index, index % 9973, index / 7.0, index / 3.0
+            )
+        lines.append(line)
+        size += len(line)
+        index += 1
+    return "".join(lines).encode("ascii")
+
+
+def generate_file(path, size, layout="none", compression=None):
+    """
+    Write a synthetic tab-separated file of exactly `size` bytes (before any
+    compression), with the comment lines given by `layout`. The header is
+    cut short if it is larger than the file.
+    """
+    n_header, _ = COMMENT_LAYOUTS[layout]
+    header = "".join("# header line {}\n".format(i) for i in range(n_header))
+    header = header[:size]
+    block = make_block(layout)
+
+    opener = gzip.open if compression == "gzip" else open
+    kwargs = {"compresslevel": 1} if compression == "gzip" else {}
+    with opener(path, "wb", **kwargs) as f:
+        f.write(header.encode("ascii"))
+        remaining = size - len(header)
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def measure(mode, path):
+    """
+    Time a mode on a file, in the current process.
+
+    :return: A dictionary with the wall-clock `seconds`, and the peak
+    resident memory of the process in kilobytes (`peak_rss_kb`).
+    """
+    _, function = MODES[mode]
+    start = time.perf_counter()
+    function(path)
+    seconds = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes, rather than kilobytes as on linux
+        peak_rss //= 1024
+    return {"seconds": seconds, "peak_rss_kb": peak_rss}
+
+
+def measure_in_child(mode, path):
+    """
+    Time a mode on a file in a freshly spawned process, so that the peak
+    memory is that of this run alone.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(measure, mode, path).result()
+
+
+def run_benchmarks(sizes, layouts, modes, data_dir, repeats=1):
+    """
+    Generate the synthetic files and time every mode on every file.
+
+    :param sizes: File sizes, in bytes.
+    :param layouts: Keys of `COMMENT_LAYOUTS`.
+    :param modes: Keys of `MODES`.
+    :param data_dir: The directory where the files are written.
+    :param repeats: The number of times that each mode is timed on each file;
+    the fastest run is reported.
+    :return: A list of dictionaries, one per (size, layout, mode).
+    """
+    results = []
+    for size in sizes:
+        for layout in layouts:
+            inputs = {}
+            for kind in sorted({MODES[mode][0] for mode in modes}):
+                compression = "gzip" if kind == "gzip" else None
+                path = os.path.join(
+                    data_dir,
+                    "{}_{}.tsv{}".format(size, layout, ".gz" if compression else ""),
+                )
+                generate_file(path, size, layout, compression)
+                inputs[kind] = path
+
+            for mode in modes:
+                runs = [
+                    measure_in_child(mode, inputs[MODES[mode][0]])
+                    for _ in range(repeats)
+                ]
+                seconds = min(run["seconds"] for run in runs)
+                results.append(
+                    {
+                        "mode": mode,
+                        "size_bytes": size,
+                        "layout": layout,
+                        "seconds": seconds,
+                        "throughput_mb_per_s": size / seconds / 1e6,
+                        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+                        "all_seconds": [run["seconds"] for run in runs],
+                    }
+                )
+
+            for path in inputs.values():
+                os.remove(path)
+    return results
+
+
+def run_workflow(output, label=None, data_dir=None, **kwargs):
+    """
+    Run the benchmarks and write the results, with a description of the
+    machine, to a JSON file. The keyword arguments are passed to
+    `run_benchmarks`.
+    """
+    temp_dir = tempfile.mkdtemp(dir=data_dir)
+    try:
+        results = run_benchmarks(data_dir=temp_dir, **kwargs)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    report = {
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def define_command_arg_parser():
+    """
+    Get a parser that extracts the command args used when calling this program
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--output", required=True, help="JSON file for the benchmark results"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="sizes of the synthetic files (eg, 1MB 10GB)",
+    )
+    parser.add_argument(
+        "--layouts",
+        nargs="+",
+        choices=sorted(COMMENT_LAYOUTS),
+        default=sorted(COMMENT_LAYOUTS),
+        help="where the `#` comment lines are in the synthetic files",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=sorted(MODES),
+        default=sorted(MODES),
+        help="hashing / validation modes to benchmark",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=1,
+        help="number of runs of each mode on each file (the fastest is kept)",
+    )
+    parser.add_argument(
+        "--label", default=None, help="label for this run, eg, a git commit"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=None,
+        help="directory for the synthetic files (these can be large)",
+    )
+    return parser
+
+
+# ---- run as a script
+
+if __name__ == "__main__":
+    ARGS = define_command_arg_parser().parse_args()
+    run_workflow(
+        ARGS.output,
+        label=ARGS.label,
+        data_dir=ARGS.data_dir,
+        sizes=[parse_size(size) for size in ARGS.sizes],
+        layouts=ARGS.layouts,
+        modes=ARGS.modes,
+        repeats=ARGS.repeats,
+    )
@@ -0,0 +1,333 @@
+"""
+Functions for copying files and directories into a project.
+
+- An existing copy is never overwritten.
+- A file is copied through the fastest route that the kernel and file system
+  support: a reflink (a copy-on-write clone, eg, on btrfs / XFS), then
+  `os.copy_file_range`, then `os.sendfile`, and otherwise read / write.
+- A file is copied into a temporary `.partial` file that is only renamed to
+  the copy once it is complete, so a killed setup never leaves a truncated
+  copy; and a later copy resumes from where the `.partial` file ends (provided
+  that the original is unchanged).
+- A directory is copied into a temporary `.partial` directory, that is renamed
+  once every file has been copied; the files are copied in parallel.
+"""
+
+import errno
+import glob
+import os
+import os.path
+import shutil
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The `FICLONE` ioctl (from linux/fs.h): make the destination file share the
+# data blocks of the source file
+FICLONE = 0x40049409
+
+# The largest number of bytes passed to each `copy_file_range` / `sendfile`
+# call
+KERNEL_COPY_SIZE = 64 * 1024 * 1024
+
+# The buffer size for read / write copies
+BLOCK_SIZE = 1024 * 1024
+
+# A resumed copy restarts this many bytes before the end of the `.partial`
+# file, in case the last data written before the copy was killed is torn
+RESUME_MARGIN = 1024 * 1024
+
+# Errors that show that a route for copying isn't supported for these files,
+# so that the next route should be tried
+UNSUPPORTED_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSOCK,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+}
+
+
+def _reflink(src, dst, offset, size):
+    if fcntl is None or offset != 0:
+        raise OSError(errno.ENOTSUP, "Reflinks are not available")
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    return size
+
+
+def _copy_file_range(src, dst, offset, size):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "`os.copy_file_range` is not available")
+    while offset < size:
+        n_copied = os.copy_file_range(
+            src.fileno(),
+            dst.fileno(),
+            min(KERNEL_COPY_SIZE, size - offset),
+            offset,
+            offset,
+        )
+        if n_copied == 0:
+            break
+        offset += n_copied
+    return offset
+
+
+def _sendfile(src, dst, offset, size):
+    dst.seek(offset)
+    while offset < size:
+        n_copied = os.sendfile(
+            dst.fileno(), src.fileno(), offset, min(KERNEL_COPY_SIZE, size - offset)
+        )
+        if n_copied == 0:
+            break
+        offset += n_copied
+    return offset
+
+
+def _read_write(src, dst, offset, size):
+    src.seek(offset)
+    dst.seek(offset)
+    while offset < size:
+        block = src.read(min(BLOCK_SIZE, size - offset))
+        if not block:
+            break
+        # the files are unbuffered, so a write may be partial
+        view = memoryview(block)
+        while view:
+            view = view[dst.write(view) :]
+        offset += len(block)
+    return offset
+
+
+# The routes for copying the contents of a file, fastest first. Each takes the
+# open source and destination files, the offset to copy from and the size of
+# the source; and returns the offset that the copy reached.
+COPY_ROUTES = [
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _sendfile),
+    ("read_write", _read_write),
+]
+
+
+def _copy_contents(src, dst, offset, size):
+    """
+    Copy the contents of `src` from `offset` onwards into `dst`, through the
+    fastest route that works.
+
+    :return: The name of the route that completed the copy, and the offset
+    that it reached.
+    """
+    for name, route in COPY_ROUTES:
+        try:
+            return name, route(src, dst, offset, size)
+        except OSError as error:
+            if error.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            # continue from wherever this route got to
+            offset = os.fstat(dst.fileno()).st_size
+    raise OSError(errno.ENOTSUP, "No route for copying `{}`".format(src.name))
+
+
+def partial_path(copy, stat_result):
+    """
+    The temporary file that a copy is written to. The name records the size
+    and modification time of the original, so that a copy is only resumed
+    from a `.partial` file of the same version of the original.
+    """
+    dname, name = os.path.split(copy)
+    return os.path.join(
+        dname,
+        ".{}.{}-{}.partial".format(name, stat_result.st_size, stat_result.st_mtime_ns),
+    )
+
+
+def _remove_stale_partials(copy, partial):
+    dname, name = os.path.split(copy)
+    pattern = os.path.join(
+        glob.escape(dname), ".{}.*.partial".format(glob.escape(name))
+    )
+    for path in glob.glob(pattern):
+        if path != partial:
+            os.remove(path)
+
+
+def _publish(partial, copy):
+    """
+    Move a complete `.partial` file to the copy location, unless something
+    has been made at that location in the meantime.
+
+    :return: True if the `.partial` file became the copy.
+    """
+    try:
+        # unlike a rename, a hard link never replaces an existing file
+        os.link(partial, copy)
+        published = True
+    except FileExistsError:
+        published = False
+    except OSError:
+        # eg, a file system without hard links
+        published = not os.path.lexists(copy)
+        if published:
+            os.rename(partial, copy)
+    if os.path.lexists(partial):
+        os.remove(partial)
+    return published
+
+
+def _check_complete(original, partial, stat_result, reached):
+    """
+    Raise an error (after removing the `.partial` file) unless the `.partial`
+    file holds the whole of the original, and the original hasn't changed
+    since the copy began.
+    """
+    copied = os.stat(partial).st_size
+    current = os.stat(original)
+    if (
+        reached == stat_result.st_size
+        and copied == stat_result.st_size
+        and current.st_size == stat_result.st_size
+        and current.st_mtime_ns == stat_result.st_mtime_ns
+    ):
+        return
+    os.remove(partial)
+    raise OSError(
+        errno.EIO,
+        "Copied {} of {} bytes of `{}`, which may have changed during the "
+        "copy".format(copied, stat_result.st_size, original),
+    )
+
+
+def copy_file(original, copy, preserve_times=False):
+    """
+    Copy a file (and its permissions; and, if `preserve_times`, its access
+    and modification times), unless the copy already exists.
+
+    :return: The name of the route that copied the file (see `COPY_ROUTES`), or
+    None if the copy already existed.
+    :raises OSError: If the copy is incomplete, eg, because the original was
+    rewritten during the copy; no copy is made.
+    """
+    if os.path.lexists(copy):
+        return None
+    stat_result = os.stat(original)
+    partial = partial_path(copy, stat_result)
+    _remove_stale_partials(copy, partial)
+
+    offset = 0
+    if os.path.exists(partial):
+        offset = max(0, os.stat(partial).st_size - RESUME_MARGIN)
+
+    with open(original, "rb", buffering=0) as src:
+        fd = os.open(partial, os.O_RDWR | os.O_CREAT, 0o600)
+        with open(fd, "r+b", buffering=0) as dst:
+            dst.truncate(offset)
+            route, reached = _copy_contents(src, dst, offset, stat_result.st_size)
+            os.fsync(dst.fileno())
+    _check_complete(original, partial, stat_result, reached)
+
+    if preserve_times:
+        shutil.copystat(original, partial)
+    else:
+        shutil.copymode(original, partial)
+    if not _publish(partial, copy):
+        return None
+    return route
+
+
+def copy_in_parallel(file_copies, n_workers=1, preserve_times=False):
+    """
+    Copy each (original, copy) pair of files, with up to `n_workers` files
+    being copied at once. Every file is attempted; the first error (in the
+    order of `file_copies`) is then raised.
+
+    :return: A list of the route that copied each file (None for those copies
+    that already existed).
+    """
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        futures = [
+            executor.submit(copy_file, original, copy, preserve_times)
+            for original, copy in file_copies
+        ]
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        raise errors[0]
+    return [future.result() for future in futures]
+
+
+def dir_copy_destination(original, copy):
+    """
+    Where a directory is copied to: as for `rsync`, the contents of
+    `original/` are copied into `copy`, whereas `original` (without a trailing
+    slash) is copied into `copy/<basename of original>`.
+    """
+    if original.endswith("/"):
+        return copy
+    return os.path.join(copy, os.path.basename(original))
+
+
+def _walk_tree(original, destination, exclude):
+    """
+    :return: Lists of the directories to make, the (link-target, link) pairs
+    of the symlinks to make, and the (original, copy) pairs of files to copy,
+    to copy the tree at `original` to `destination`.
+    """
+    dirs = []
+    links = []
+    files = []
+    queue = deque([(original, destination)])
+    while queue:
+        source_dir, dest_dir = queue.popleft()
+        dirs.append((source_dir, dest_dir))
+        for entry in os.scandir(source_dir):
+            if entry.name in exclude:
+                continue
+            dest = os.path.join(dest_dir, entry.name)
+            if entry.is_symlink():
+                links.append((os.readlink(entry.path), dest))
+            elif entry.is_dir():
+                queue.append((entry.path, dest))
+            else:
+                files.append((entry.path, dest))
+    return dirs, links, files
+
+
+def copy_dir(original, copy, exclude=(), n_workers=1):
+    """
+    Copy a directory (as for `rsync -a`, see `dir_copy_destination`), unless
+    the copy location already exists. Symlinks are copied as symlinks, and
+    any files or directories named in `exclude` are not copied.
+
+    The copy is made in a `.partial` directory next to the copy location, and
+    is renamed once it is complete; a later copy resumes in the same
+    `.partial` directory.
+
+    :return: True if the directory was copied.
+    """
+    copy = copy.rstrip("/") or copy
+    if os.path.lexists(copy):
+        return False
+    dname, name = os.path.split(copy)
+    partial = os.path.join(dname, ".{}.partial".format(name))
+    root = dir_copy_destination(original, partial)
+
+    dirs, links, files = _walk_tree(original.rstrip("/") or original, root, exclude)
+    for _, dest_dir in dirs:
+        os.makedirs(dest_dir, exist_ok=True)
+    for target, link in links:
+        if not os.path.lexists(link):
+            os.symlink(target, link)
+    copy_in_parallel(files, n_workers=n_workers, preserve_times=True)
+    for source_dir, dest_dir in reversed(dirs):
+        shutil.copystat(source_dir, dest_dir)
+
+    os.rename(partial, copy)
+    return True
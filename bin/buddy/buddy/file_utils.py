@@ -2,8 +2,12 @@
 Simple file manipulation functions
 
 - `yaml` files must be read using `yaml.safe_load` for security purposes
+- in the `.txt` config files, blank lines and lines that start with `#` are
+  dropped
 """
 
+import os.path
+
 import yaml
 
 
@@ -16,3 +20,39 @@ def read_yaml(yaml_file):
     if yaml_dict is None:
         return {}
     return yaml_dict
+
+
+def write_yaml(yaml_dict, yaml_file):
+    """
+    Writes a dictionary to a yaml file, keeping the order of the keys
+    """
+    with open(yaml_file, "w") as f:
+        yaml.safe_dump(yaml_dict, f, default_flow_style=False, sort_keys=False)
+
+
+def read_config_lines(config_file):
+    """
+    Reads the entries from a `.txt` config file: one entry per line, dropping
+    blank lines and comment lines (those that start with `#`)
+    """
+    with open(config_file, "r") as f:
+        return [
+            line.strip() for line in f if line.strip() and not line.startswith("#")
+        ]
+
+
+def read_path_pairs(config_file):
+    """
+    Reads the whitespace-separated pairs of file-paths (eg, "original copy")
+    from a `.txt` config file; tildes `~` in the file-paths are expanded
+    """
+    pairs = []
+    for line in read_config_lines(config_file):
+        fields = line.split()
+        if len(fields) != 2:
+            raise ValueError(
+                "Couldn't parse two file-paths from `{}` in `{}`; make sure "
+                "there's no spaces in your filenames".format(line, config_file)
+            )
+        pairs.append(tuple(os.path.expanduser(path) for path in fields))
+    return pairs
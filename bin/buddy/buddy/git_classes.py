@@ -3,11 +3,232 @@ Classes for holding details about any git repositories that should be cloned /
 copied into a given file-path.
 """
 
+import hashlib
 import os
+import re
+import shutil
 import sys
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
 
 import sh
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The file, within each mirror, whose modification time records when the
+# mirror was last used
+LAST_USED_FILE = "buddy_last_used"
+
+
+class GitMirrorCache:
+    """
+    `GitMirrorCache` holds bare mirrors of external repositories in a local
+    directory (which can be shared between projects), so that a repository is
+    only downloaded once and is then kept up to date with `git fetch`.
+
+    Repositories are cloned from their local mirror; on the same file system
+    git hard-links the object files, so a clone costs little disk and no
+    network. The clone's `origin` is then pointed back at the upstream url.
+    Since the clones don't refer to the mirrors, the mirrors can be evicted at
+    any time.
+
+    The cache can be shared between threads, and the cache directory between
+    processes (eg, the setups of several subjobs that run at once): each
+    mirror is locked through `flock` on a `<mirror>.lock` file next to it.
+    Updating or evicting a mirror takes an exclusive lock, and cloning from a
+    mirror takes a shared lock.
+    """
+
+    def __init__(self, cache_dir, max_age_days=None, max_mirrors=None):
+        self.cache_dir = cache_dir
+        self.max_age_days = max_age_days
+        self.max_mirrors = max_mirrors
+        self._updated = set()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def mirror_path(self, url):
+        """
+        The directory of the mirror for a url.
+        """
+        name = os.path.basename(url.rstrip("/"))
+        if name.endswith(".git"):
+            name = name[: -len(".git")]
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", name)
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "{}-{}.git".format(name, key))
+
+    def _lock(self, path):
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    @contextmanager
+    def _locked(self, path, shared=False, blocking=True):
+        """
+        Lock the mirror at `path`, between the threads of this process and
+        (where `fcntl` is available) between processes.
+
+        :return: (as the context) True if the lock was taken; this can only be
+        False if not `blocking`.
+        """
+        thread_lock = None if shared else self._lock(path)
+        if thread_lock is not None and not thread_lock.acquire(blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            with open(path + ".lock", "a") as lock_file:
+                operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                if not blocking:
+                    operation |= fcntl.LOCK_NB
+                try:
+                    fcntl.flock(lock_file.fileno(), operation)
+                    locked = True
+                except BlockingIOError:
+                    locked = False
+                # the lock is released when the lock file is closed
+                yield locked
+        finally:
+            if thread_lock is not None:
+                thread_lock.release()
+
+    def update(self, url):
+        """
+        Make, or fetch into, the mirror for a url; the mirror is fetched at
+        most once during the lifetime of the cache object.
+
+        :return: The directory of the mirror.
+        """
+        path = self.mirror_path(url)
+        with self._locked(path):
+            if path not in self._updated:
+                if os.path.isdir(path):
+                    sh.git("-C", path, "fetch", "--prune", "origin")
+                else:
+                    # Mirror into a temporary directory, so that an interrupted
+                    # download doesn't leave a broken mirror in the cache
+                    temp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+                    try:
+                        sh.git("clone", "--mirror", url, temp_dir)
+                        os.rename(temp_dir, path)
+                    except Exception:
+                        shutil.rmtree(temp_dir, ignore_errors=True)
+                        # without `flock`, another process may have made the
+                        # mirror first
+                        if not os.path.isdir(path):
+                            raise
+                self._updated.add(path)
+            self._touch(path)
+        return path
+
+    def _touch(self, path):
+        with open(os.path.join(path, LAST_USED_FILE), "a"):
+            pass
+        os.utime(os.path.join(path, LAST_USED_FILE))
+
+    def clone(self, url, output_path):
+        """
+        Clone the repository at `url` into `output_path` from its (updated)
+        mirror, and set the `origin` of the clone to `url`.
+        """
+        mirror = self.update(url)
+        with self._locked(mirror, shared=True):
+            sh.git("clone", mirror, output_path)
+        sh.git("-C", output_path, "remote", "set-url", "origin", url)
+
+    def last_used(self):
+        """
+        :return: A dictionary of mirror directory: the time (in seconds since
+        the epoch) that the mirror was last used.
+        """
+        return {
+            entry.path: _last_used(entry.path)
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".git") and entry.is_dir()
+        }
+
+    def evict(self):
+        """
+        Delete those mirrors that have not been used in the last
+        `max_age_days` days, and then the least recently used mirrors beyond
+        the first `max_mirrors`. Mirrors that were used by this cache object
+        are kept, as are those that are locked by another process, or that
+        have been used since the last-used times were read.
+
+        :return: A list of the deleted mirror directories.
+        """
+        times = self.last_used()
+        by_age = sorted(times, key=times.get, reverse=True)
+        evicted = []
+        if self.max_age_days is not None:
+            oldest = time.time() - self.max_age_days * 24 * 60 * 60
+            evicted += [path for path in by_age if times[path] < oldest]
+        if self.max_mirrors is not None:
+            evicted += [
+                path for path in by_age[self.max_mirrors :] if path not in evicted
+            ]
+        deleted = []
+        for path in evicted:
+            if path in self._updated:
+                continue
+            with self._locked(path, blocking=False) as locked:
+                if not locked or _last_used(path) != times[path]:
+                    continue
+                shutil.rmtree(path)
+                deleted.append(path)
+        return deleted
+
+
+def _last_used(mirror):
+    stamp = os.path.join(mirror, LAST_USED_FILE)
+    try:
+        return os.stat(stamp).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def read_head(repo_dir):
+    """
+    Get the sha1 of the commit that is checked out in a local repository, by
+    reading the files in its `.git` directory (rather than by running git).
+
+    :return: The sha1, or None if it can't be read (eg, `repo_dir` isn't the
+    root of a repository, or HEAD refers to a branch without any commits).
+    """
+    git_dir = os.path.join(repo_dir, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r") as f:
+            head = f.read().strip()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not head.startswith("ref: "):
+        return head
+
+    ref = head[len("ref: ") :]
+    try:
+        with open(os.path.join(git_dir, ref), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(git_dir, "packed-refs"), "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2 and fields[1] == ref:
+                    return fields[0]
+    except FileNotFoundError:
+        pass
+    return None
+
 
 class LocalRepository:
     """
@@ -27,22 +248,37 @@ class ExternalRepository:
     """
     `ExternalRepository` defines an external git repo that is to be downloaded
     and a commit that is to be checked-out.
+
+    By default, the full history of the repo is cloned. In `shallow` mode,
+    only the requested commit is fetched (with `--depth 1`; the commit must
+    then be given as a full 40-character sha1). A shallow fetch may also use a
+    partial-clone `filter` (eg, "blob:none", so that file contents are only
+    downloaded when they are checked out) and may check out only the `sparse`
+    paths (a list of patterns for `.git/info/sparse-checkout`).
     """
 
     # input_path (ie, url or file-path), commit, output_path (local file-path)
 
     # check that len(commit) >= 7
 
-    def __init__(self, input_path, commit, output_path):
+    def __init__(
+        self, input_path, commit, output_path, shallow=False, filter=None, sparse=None
+    ):
         self.input_path = input_path
         self.commit = commit
         self.output_path = output_path
+        self.shallow = shallow
+        self.filter = filter
+        self.sparse = sparse
 
     def __eq__(self, other):
         return (
             self.input_path == other.input_path
             and self.commit == other.commit
             and self.output_path == other.output_path
+            and self.shallow == other.shallow
+            and self.filter == other.filter
+            and self.sparse == other.sparse
         )
 
     def local_exists(self):
@@ -51,45 +287,118 @@ class ExternalRepository:
         """
         return os.path.exists(self.output_path)
 
-    def sha1_matches(self):
+    def sha1_matches(self, directory=None):
         """
-        Is the sha1 code for the requested commit a valid sha1 code for the
-        requested repository?
+        Is the requested commit the commit that is checked out in the local
+        copy of the repository?
+
+        :param directory: The local copy; by default, `output_path`.
         """
-        pass
+        if directory is None:
+            directory = self.output_path
+        head = str(sh.git("-C", directory, "rev-parse", "HEAD")).strip()
+        return len(self.commit) >= 7 and head.startswith(self.commit.lower())
 
-    def clone_into(self, directory):
+    def is_checked_out(self):
         """
-        Clone the external repository into the stated (possibly temporary)
-        directory.
+        Is the requested commit checked out in `output_path`? Unlike
+        `sha1_matches`, this doesn't run git, so it is False for anything
+        other than a (possibly abbreviated) sha1 `commit`.
         """
-        # TODO:
-        # git clone from url to directory
-        #
-        # try:
-        #   sh.git.clone(self.url, directory)
-        # except sh.ErrorReturnCode as e:
-        #   print(e)
-        #   sys.exit(1)
-        #
-        pass
+        head = read_head(self.output_path)
+        return (
+            head is not None
+            and len(self.commit) >= 7
+            and head.startswith(self.commit.lower())
+        )
+
+    def clone_into(self, directory, source=None):
+        """
+        Fetch just the requested commit of the external repository into the
+        stated (possibly temporary) directory, and check it out.
 
-    def clone(self):
+        :param directory: An empty or non-existing directory.
+        :param source: The url that the commit is fetched from, if that isn't
+        `input_path` (eg, a local mirror); the `origin` of the clone is
+        `input_path` regardless.
+        """
+        if not re.fullmatch(r"[0-9a-fA-F]{40}", self.commit):
+            raise ValueError(
+                "A shallow clone requires the full sha1 of the commit, not "
+                "`{}`".format(self.commit)
+            )
+        sh.git("init", "--quiet", directory)
+        sh.git("-C", directory, "remote", "add", "origin", source or self.input_path)
+        if self.sparse:
+            sh.git("-C", directory, "config", "core.sparseCheckout", "true")
+            sparse_file = os.path.join(directory, ".git", "info", "sparse-checkout")
+            os.makedirs(os.path.dirname(sparse_file), exist_ok=True)
+            with open(sparse_file, "w") as f:
+                f.write("".join("{}\n".format(path) for path in self.sparse))
+
+        fetch_args = ["--depth", "1"]
+        if self.filter:
+            fetch_args.append("--filter={}".format(self.filter))
+        sh.git("-C", directory, "fetch", "--quiet", *fetch_args, "origin", self.commit)
+        if source is not None:
+            sh.git("-C", directory, "remote", "set-url", "origin", self.input_path)
+        sh.git(
+            "-C",
+            directory,
+            "-c",
+            "advice.detachedHead=false",
+            "checkout",
+            "--quiet",
+            "FETCH_HEAD",
+        )
+
+    def _shallow_clone(self, cache=None):
+        source = None
+        if cache is not None:
+            source = "file://" + os.path.abspath(cache.update(self.input_path))
+
+        parent = os.path.dirname(os.path.abspath(self.output_path))
+        os.makedirs(parent, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=parent, prefix=".clone_")
+        try:
+            self.clone_into(temp_dir, source=source)
+            if not self.sha1_matches(temp_dir):
+                raise ValueError(
+                    "Commit `{}` was not checked out from `{}`".format(
+                        self.commit, self.input_path
+                    )
+                )
+            os.rename(temp_dir, self.output_path)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+    def clone(self, cache=None):
         """
         Clone the requested repository into the directory `output_path` and
         ensure that the requested `commit` is checked out
+
+        In `shallow` mode, the commit is fetched and checked out in a temporary
+        directory that is then moved to `output_path`; and if `output_path`
+        already exists, it must have the requested commit checked out.
+
+        :param cache: A `GitMirrorCache`; if given, the repository is cloned
+        from a local mirror of `input_path`.
         """
-        if not self.local_exists():
-            sh.git("clone", self.input_path, self.output_path)
-        # TODO:
-        # if output dir is occupied:
-        # - check that the sha-1 hash matches the wanted commit
-        #   and throw an exception if it doesn't
-        # otherwise:
-        # - try to clone from the URL to a temp directory
-        # - checkout the requested commit (throw exception if it
-        #   doesn't exist)
-        # - move from the temp directory to output
+        if self.shallow:
+            if not self.local_exists():
+                self._shallow_clone(cache)
+            elif not self.sha1_matches():
+                raise ValueError(
+                    "`{}` exists but doesn't have commit `{}` checked out".format(
+                        self.output_path, self.commit
+                    )
+                )
+        elif not self.local_exists():
+            if cache is None:
+                sh.git("clone", self.input_path, self.output_path)
+            else:
+                cache.clone(self.input_path, self.output_path)
 
     def checkout(self):
         try:
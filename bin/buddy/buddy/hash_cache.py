@@ -0,0 +1,165 @@
+"""
+An on-disk cache of file digests, so that unchanged files need not be re-hashed
+on every validation run.
+
+A cached digest is only re-used while the file's identity and stat metadata
+(path, size, modification time, inode and device) are unchanged.
+
+The cache can be used in one of two modes:
+- "trust": re-use any cached digest whose stat metadata still matches the file
+  (eg, for quick checks in pre-commit hooks);
+- "rehash": always re-compute the digest, and update the cache with the result
+  (eg, for nightly runs).
+"""
+
+import os
+import sqlite3
+import time
+
+from contextlib import closing
+
+CACHE_MODES = ("trust", "rehash")
+
+# A cache-hit only updates the `last_used` time of an entry if that time is
+# older than this (in seconds); this avoids a write for every lookup.
+TOUCH_INTERVAL = 60 * 60
+
+
+class HashCache:
+    """
+    `HashCache` stores the digests of files in an sqlite database, keyed on
+    the real path of the file and a description of the digest (eg, "md5").
+
+    Connections to the database are opened for each operation, so the cache
+    can be shared between threads and pickled into worker processes.
+    """
+
+    def __init__(self, cache_file, mode="trust", max_entries=None, max_age_days=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                "`mode` should be one of {}, not `{}`".format(CACHE_MODES, mode)
+            )
+        self.cache_file = cache_file
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._create_table()
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.cache_file, timeout=60))
+
+    def _create_table(self):
+        with self._connect() as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS digests (
+                    path TEXT NOT NULL,
+                    digest_type TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    device INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (path, digest_type)
+                )
+                """
+            )
+
+    def lookup(self, filepath, digest_type, stat_result=None):
+        """
+        Get the cached digest for a file.
+
+        :param filepath: A path to a file.
+        :param digest_type: A string describing how the digest was computed
+        (the algorithm and any options that affect the digest).
+        :param stat_result: The result of `os.stat(filepath)`, if available.
+        :return: The cached digest, or None if the file isn't in the cache,
+        its stat metadata has changed, or the cache is in "rehash" mode.
+        """
+        if self.mode == "rehash":
+            return None
+        if stat_result is None:
+            stat_result = os.stat(filepath)
+
+        path = os.path.realpath(filepath)
+        with self._connect() as conn, conn:
+            row = conn.execute(
+                """
+                SELECT size, mtime_ns, inode, device, digest, last_used
+                FROM digests WHERE path = ? AND digest_type = ?
+                """,
+                (path, digest_type),
+            ).fetchone()
+            if row is None or tuple(row[:4]) != stat_signature(stat_result):
+                return None
+
+            now = time.time()
+            if now - row[5] > TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE digests SET last_used = ? "
+                    "WHERE path = ? AND digest_type = ?",
+                    (now, path, digest_type),
+                )
+        return row[4]
+
+    def store(self, filepath, digest_type, digest, stat_result=None):
+        """
+        Add the digest for a file to the cache.
+
+        :param stat_result: The result of `os.stat(filepath)` from before the
+        digest was computed; so that a file that is modified while it is being
+        hashed will not match its cache entry.
+        """
+        if stat_result is None:
+            stat_result = os.stat(filepath)
+
+        path = os.path.realpath(filepath)
+        with self._connect() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, digest_type)
+                + stat_signature(stat_result)
+                + (digest, time.time()),
+            )
+
+    def evict(self):
+        """
+        Drop those entries that have not been used in the last `max_age_days`
+        days, and then the least recently used entries beyond the first
+        `max_entries`.
+        """
+        with self._connect() as conn, conn:
+            if self.max_age_days is not None:
+                oldest = time.time() - self.max_age_days * 24 * 60 * 60
+                conn.execute("DELETE FROM digests WHERE last_used < ?", (oldest,))
+            if self.max_entries is not None:
+                conn.execute(
+                    """
+                    DELETE FROM digests WHERE rowid NOT IN (
+                        SELECT rowid FROM digests
+                        ORDER BY last_used DESC LIMIT ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+
+def stat_signature(stat_result):
+    """
+    The parts of a file's stat metadata that identify the file and show whether
+    its contents may have changed.
+
+    :param stat_result: An `os.stat_result`.
+    :return: A tuple (size, mtime_ns, inode, device).
+    """
+    return (
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+        stat_result.st_ino,
+        stat_result.st_dev,
+    )
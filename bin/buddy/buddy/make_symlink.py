@@ -1,5 +1,9 @@
 """
 Functions to make links from one file location (link) to another (target)
+
+Eg, `python make_symlink.py some.target some.link`, or, to make every link in
+a file in a single process, `python make_symlink.py --links-file
+make_these_links.txt`
 """
 
 import argparse
@@ -8,6 +12,8 @@ import os
 import os.path
 import sys
 
+from buddy.file_utils import read_path_pairs, read_yaml
+
 
 def add_relative_symlink(target, link):
     """
@@ -46,17 +52,96 @@ def add_relative_symlink(target, link):
             raise err
 
 
+def add_relative_symlinks(target_link_pairs):
+    """
+    Create a symbolic link for each (target, link) pair, as for
+    `add_relative_symlink`.
+
+    Every pair is attempted, even if some of the links can't be made. The
+    failures are reported together on stderr (one `[CONFLICT]` line per pair)
+    and the first of the errors is then raised.
+
+    :param target_link_pairs: An iterable of (target, link) filepaths.
+    :return: Null
+    """
+    errors = []
+    for target, link in target_link_pairs:
+        try:
+            add_relative_symlink(target, link)
+        except (FileNotFoundError, FileExistsError) as err:
+            errors.append((target, link, err))
+
+    for target, link, err in errors:
+        print(
+            "[CONFLICT]\ttarget:{}\tlink:{}\terror:{}".format(
+                target, link, err.strerror
+            ),
+            file=sys.stderr,
+        )
+    if errors:
+        raise errors[0][2]
+
+
+def read_links_file(links_file):
+    """
+    Read the (target, link) pairs from a file.
+
+    A `.yaml` / `.yml` file should contain a list of dictionaries, each with
+    a `target` and a `link` entry. Any other file should contain one
+    whitespace-separated "target link" pair per line; blank lines and lines
+    that start with `#` are dropped. Tildes `~` in the filepaths are expanded.
+
+    :param links_file: A filepath.
+    :return: A list of (target, link) pairs.
+    """
+    if not links_file.endswith((".yaml", ".yml")):
+        return read_path_pairs(links_file)
+
+    pairs = []
+    for entry in read_yaml(links_file):
+        if not isinstance(entry, dict) or set(entry) != {"target", "link"}:
+            raise ValueError(
+                "Each entry in `{}` should have a `target` and a `link`: "
+                "`{}`".format(links_file, entry)
+            )
+        pairs.append(
+            (os.path.expanduser(entry["target"]), os.path.expanduser(entry["link"]))
+        )
+    return pairs
+
+
+def run_workflow(target=None, link=None, links_file=None):
+    """
+    Make a single link from `link` to `target`, or make every link that is
+    described in `links_file`.
+    """
+    if links_file is not None:
+        if target is not None or link is not None:
+            raise ValueError("Pass either a target and a link, or a links-file")
+        add_relative_symlinks(read_links_file(links_file))
+    else:
+        if target is None or link is None:
+            raise ValueError("Both a target and a link should be passed")
+        add_relative_symlink(target, link)
+
+
 def define_command_arg_parser():
     """
     Get a parser that extracts the command args used when calling this
     program
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument("target", nargs=1)
-    parser.add_argument("link", nargs=1)
+    parser.add_argument("target", nargs="?")
+    parser.add_argument("link", nargs="?")
+    parser.add_argument(
+        "--links-file",
+        default=None,
+        help="a file of 'target link' lines (or a .yaml list of "
+        "`target`/`link` entries); every link in the file is made",
+    )
     return parser
 
 
 if __name__ == "__main__":
     ARGS = define_command_arg_parser().parse_args()
-    add_relative_symlink(ARGS.target[0], ARGS.link[0])
+    run_workflow(ARGS.target, ARGS.link, links_file=ARGS.links_file)
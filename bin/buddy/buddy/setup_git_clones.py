@@ -1,21 +1,40 @@
 """
 Functions for identifying which git repos need to be cloned for the current
 project, and for cloning them
+
+The repositories are cloned concurrently (git spends most of its time waiting
+on the network), with the progress and timing of each repository reported on
+stderr.
 """
 
 import argparse
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from buddy.file_utils import read_yaml
-from buddy.git_classes import ExternalRepository
+from buddy.git_classes import ExternalRepository, GitMirrorCache
 
 
 def parse_repository_details(yaml_dictionary):
     """
     Extracts details of git repositories: where are they stored, where are they
     to be copied, which commit should be checked out?
+
+    Each repository may also set `shallow: true` (fetch only the commit), a
+    `filter` for a partial clone (eg, `blob:none`) and a list of `sparse` paths
+    that are checked out.
     """
     repositories = {
-        k: ExternalRepository(v["url"], v["commit"], v["output"])
+        k: ExternalRepository(
+            v["url"],
+            v["commit"],
+            v["output"],
+            shallow=v.get("shallow", False),
+            filter=v.get("filter"),
+            sparse=v.get("sparse"),
+        )
         for k, v in yaml_dictionary.items()
     }
     return repositories
@@ -30,15 +49,110 @@ def import_repository_details(yaml_file):
     return repositories
 
 
-def run_workflow(yaml_file):
+def provision_repository(repo, cache=None):
+    """
+    Clone a repository (from its mirror in `cache`, if given) and checkout the
+    required commit.
+
+    :return: The number of seconds taken.
+    """
+    start = time.perf_counter()
+    repo.clone(cache=cache)
+    repo.checkout()
+    return time.perf_counter() - start
+
+
+def _describe_error(error):
+    lines = str(error).strip().splitlines()
+    return "{}: {}".format(type(error).__name__, lines[0] if lines else "")
+
+
+def provision_repositories(repositories, n_workers=1, cache=None):
+    """
+    Clone each repository and checkout its required commit, with up to
+    `n_workers` repositories being set up at once.
+
+    A line is written to stderr as each repository is set up (`[CLONED]`) or
+    fails (`[FAILED]`). A failure doesn't stop the other repositories from
+    being set up; once every repository has been attempted, the first of the
+    errors (in the order of `repositories`) is raised.
+
+    :param repositories: A dictionary of name: ExternalRepository.
+    :param n_workers: The number of repositories that may be set up
+    concurrently.
+    :param cache: A `GitMirrorCache`, or None.
+    """
+    outputs = [repo.output_path for repo in repositories.values()]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError("Two repositories can't be cloned into the same output")
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        futures = {
+            executor.submit(provision_repository, repo, cache): name
+            for name, repo in repositories.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            output = repositories[name].output_path
+            try:
+                seconds = future.result()
+            except Exception as error:
+                errors[name] = error
+                print(
+                    "[FAILED]\trepository:{}\toutput:{}\terror:{}".format(
+                        name, output, _describe_error(error)
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+            print(
+                "[CLONED]\trepository:{}\toutput:{}\tseconds:{:.3f}".format(
+                    name, output, seconds
+                ),
+                file=sys.stderr,
+            )
+
+    if errors:
+        print(
+            "{} of {} repositories could not be set up: {}".format(
+                len(errors), len(repositories), ", ".join(sorted(errors))
+            ),
+            file=sys.stderr,
+        )
+        raise next(errors[name] for name in repositories if name in errors)
+
+
+def setup_repositories(
+    repositories, n_workers=4, cache_dir=None, cache_max_age_days=None
+):
+    """
+    Clone each repository and checkout its required commit (see
+    `provision_repositories`), using the mirrors in `cache_dir` if it is given.
+    """
+    cache = None
+    if cache_dir is not None:
+        cache = GitMirrorCache(cache_dir, max_age_days=cache_max_age_days)
+    provision_repositories(repositories, n_workers=n_workers, cache=cache)
+    if cache is not None:
+        cache.evict()
+
+
+def run_workflow(yaml_file, n_workers=4, cache_dir=None, cache_max_age_days=None):
     """
     For each git repository mentioned in the yaml file, clone it and checkout
     the required commit.
+
+    If `cache_dir` is given, the repositories are cloned from mirrors in that
+    directory (see `GitMirrorCache`); afterwards, any mirrors that haven't
+    been used in `cache_max_age_days` days are deleted.
     """
-    repositories = import_repository_details(yaml_file)
-    for _, repo in repositories.items():
-        repo.clone()
-        repo.checkout()
+    setup_repositories(
+        import_repository_details(yaml_file),
+        n_workers=n_workers,
+        cache_dir=cache_dir,
+        cache_max_age_days=cache_max_age_days,
+    )
 
 
 def define_command_arg_parser():
@@ -47,9 +161,34 @@ def define_command_arg_parser():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("git_yaml", nargs=1)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of repositories that may be cloned concurrently",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="directory of local git mirrors (shared between projects) that "
+        "the repositories are cloned from; mirrors are made or fetched as "
+        "needed",
+    )
+    parser.add_argument(
+        "--cache-max-age-days",
+        type=float,
+        default=None,
+        help="delete any mirrors in --cache-dir that haven't been used for "
+        "this many days",
+    )
     return parser
 
 
 if __name__ == "__main__":
     ARGS = define_command_arg_parser().parse_args()
-    run_workflow(ARGS.git_yaml[0])
+    run_workflow(
+        ARGS.git_yaml[0],
+        n_workers=ARGS.workers,
+        cache_dir=ARGS.cache_dir,
+        cache_max_age_days=ARGS.cache_max_age_days,
+    )
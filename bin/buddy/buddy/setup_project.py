@@ -0,0 +1,550 @@
+"""
+Set up the file structure of a project from the config files in
+`.sidekick/setup/`, in a single process:
+
+- check that the external directories in `check_these_dirs.yaml` exist;
+- make the links in `make_these_links.txt` (before any directories are made,
+  since the new directories may be subdirectories of the link targets);
+- make the directories in `make_these_subdirs.txt`;
+- copy the files in `copy_these_files.txt` and the directories in
+  `copy_these_dirs.txt` (an existing copy is never overwritten);
+- clone the git repositories in `clone_these_repos.yaml`;
+- touch the files in `touch_these_files.txt`.
+
+The setup first makes a plan: the list of actions that are needed, given the
+current state of the file system. Only those actions are then carried out, so
+re-running the setup of a project that is already set up does (almost)
+nothing. With `--dry-run` the plan is printed rather than carried out.
+
+The paths in the config files are stat'ed in concurrent batches while
+planning, and the stat results are shared (through a `StatCache`) with the
+stages that carry out the plan, so that each path is only stat'ed once.
+
+Eg, `python setup_project.py .sidekick/setup --workers 8 --dry-run`
+"""
+
+import argparse
+import os
+import os.path
+import sys
+
+from contextlib import contextmanager
+
+from buddy.copy_files import copy_dir, copy_in_parallel
+from buddy.file_utils import read_config_lines, read_path_pairs, read_yaml
+from buddy.make_symlink import add_relative_symlinks
+from buddy.setup_git_clones import parse_repository_details, setup_repositories
+from buddy.stat_cache import StatCache
+from buddy.validate_dir_existence import check_dirs, find_missing_dirs
+
+# The config file for each stage of the setup, within the config directory
+SETUP_FILES = {
+    "check_dirs": "check_these_dirs.yaml",
+    "make_dirs": "make_these_subdirs.txt",
+    "links": "make_these_links.txt",
+    "file_copies": "copy_these_files.txt",
+    "dir_copies": "copy_these_dirs.txt",
+    "repositories": "clone_these_repos.yaml",
+    "touch_files": "touch_these_files.txt",
+}
+
+# Neither git metadata nor `.gitignore` files are copied with a directory
+DIR_COPY_EXCLUDES = (".git", ".gitignore")
+
+DEFAULT_CONFIG_DIR = os.path.join(".sidekick", "setup")
+
+# The kinds of setup action, in the order that they are carried out
+ACTION_KINDS = ("link", "mkdir", "copy_file", "copy_dir", "clone", "checkout", "touch")
+
+# `scripts/setup.sh` touches this file once a project has been completely set
+# up; the setup is current while the file is newer than everything that
+# defines the setup: the setup scripts, the sources of the project's R package
+# (which `setup_libs.sh` builds) and `buddy` itself
+SETUP_STAMP = os.path.join(".sidekick", "setup_complete")
+SETUP_DEFINITIONS = (
+    os.path.join("scripts", "setup.sh"),
+    os.path.join("scripts", "helpers_for_setup"),
+    "lib",
+    os.path.join("bin", "buddy"),
+)
+
+# The subjobs of a project are listed in this file, within the config
+# directory, and are set up in `subjobs/<subjob_name>`
+SUBJOBS_FILE = "subjob_names.txt"
+SUBJOBS_DIR = "subjobs"
+
+
+class SetupAction:
+    """
+    `SetupAction` is a single step of a project's setup: the `kind` of action
+    (one of `ACTION_KINDS`), the `path` that it makes, and the `source` of
+    that path (a link target, the original of a copy, or a repository url).
+    """
+
+    def __init__(self, kind, path, source=None):
+        if kind not in ACTION_KINDS:
+            raise ValueError(
+                "`kind` should be one of {}, not `{}`".format(ACTION_KINDS, kind)
+            )
+        self.kind = kind
+        self.path = path
+        self.source = source
+
+    def __eq__(self, other):
+        return (
+            self.kind == other.kind
+            and self.path == other.path
+            and self.source == other.source
+        )
+
+    def __repr__(self):
+        return "SetupAction({!r}, {!r}, {!r})".format(self.kind, self.path, self.source)
+
+    def format(self):
+        """
+        Describe the action as a tab-separated line, eg,
+        "[LINK]\tpath:./data/ext\tsource:~/ext_data"
+        """
+        line = "[{}]\tpath:{}".format(self.kind.upper(), self.path)
+        if self.source is not None:
+            line += "\tsource:{}".format(self.source)
+        return line
+
+
+class SetupConfig:
+    """
+    `SetupConfig` holds the contents of all of the setup config files for a
+    project.
+    """
+
+    def __init__(
+        self,
+        check_dirs=(),
+        make_dirs=(),
+        links=(),
+        file_copies=(),
+        dir_copies=(),
+        repositories=None,
+        touch_files=(),
+    ):
+        self.check_dirs = list(check_dirs)
+        self.make_dirs = list(make_dirs)
+        self.links = list(links)
+        self.file_copies = list(file_copies)
+        self.dir_copies = list(dir_copies)
+        self.repositories = repositories or {}
+        self.touch_files = list(touch_files)
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+    @classmethod
+    def from_dir(cls, config_dir):
+        """
+        Read every setup config file from a directory.
+
+        All of the files in `SETUP_FILES` must exist (though they may contain
+        only comments).
+        """
+        paths = {
+            stage: os.path.join(config_dir, filename)
+            for stage, filename in SETUP_FILES.items()
+        }
+        missing = [path for path in paths.values() if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError(
+                "Setup config files are missing: {}".format(", ".join(missing))
+            )
+
+        return cls(
+            check_dirs=read_yaml(paths["check_dirs"]),
+            make_dirs=read_config_lines(paths["make_dirs"]),
+            links=read_path_pairs(paths["links"]),
+            file_copies=read_path_pairs(paths["file_copies"]),
+            dir_copies=read_path_pairs(paths["dir_copies"]),
+            repositories=parse_repository_details(read_yaml(paths["repositories"])),
+            touch_files=read_config_lines(paths["touch_files"]),
+        )
+
+
+def make_dirs(dirs, stat_cache=None):
+    """
+    Make each directory, and any intermediate directories, if it doesn't
+    exist. An error is raised if the path exists but isn't a directory.
+    """
+    for dirname in dirs:
+        os.makedirs(dirname, exist_ok=True)
+        if stat_cache is not None:
+            stat_cache.invalidate(dirname)
+
+
+def _make_parent_dir(path):
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+
+def copy_files(file_copies, n_workers=1, stat_cache=None):
+    """
+    Copy each original file (with its permissions) to its copy location,
+    unless the copy already exists; so that the project keeps a time-fixed
+    version of the file even if the original is later updated.
+
+    :param file_copies: A list of (original, copy) file-paths.
+    :param n_workers: The number of files that may be copied concurrently.
+    :param stat_cache: A `StatCache` shared with the other setup stages.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    stat_cache.stat_many([path for pair in file_copies for path in pair])
+    to_copy = []
+    for original, copy in file_copies:
+        _make_parent_dir(copy)
+        if stat_cache.exists(copy):
+            continue
+        if not stat_cache.isfile(original):
+            raise FileNotFoundError(
+                "Original file `{}` isn't an existing file and was to be "
+                "copied".format(original)
+            )
+        to_copy.append((original, copy))
+    try:
+        copy_in_parallel(to_copy, n_workers=n_workers)
+    finally:
+        for _, copy in to_copy:
+            stat_cache.invalidate(copy)
+
+
+def copy_dirs(dir_copies, n_workers=1, stat_cache=None):
+    """
+    Copy each original directory (with `rsync -a` semantics, but excluding
+    `.git` and `.gitignore`) to its copy location, unless the copy location
+    already exists.
+
+    :param dir_copies: A list of (original, copy) directory-paths.
+    :param n_workers: The number of files that may be copied concurrently.
+    :param stat_cache: A `StatCache` shared with the other setup stages.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    stat_cache.stat_many([path for pair in dir_copies for path in pair])
+    for original, copy in dir_copies:
+        _make_parent_dir(copy.rstrip("/"))
+        if stat_cache.exists(copy):
+            continue
+        if not stat_cache.isdir(original):
+            raise FileNotFoundError(
+                "Original dir `{}` isn't an existing directory and was to be "
+                "copied".format(original)
+            )
+        stat_cache.invalidate(copy)
+        copy_dir(original, copy, exclude=DIR_COPY_EXCLUDES, n_workers=n_workers)
+
+
+def touch_files(filenames, stat_cache=None):
+    """
+    Make an empty file for each filename that isn't an existing file.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    for filename in filenames:
+        if not stat_cache.isfile(filename):
+            with open(filename, "a"):
+                pass
+            stat_cache.invalidate(filename)
+
+
+def _link_is_current(target, link, stat_cache):
+    dname = os.path.dirname(link)
+    return stat_cache.islink(link) and os.readlink(link) == os.path.relpath(
+        target, start=dname
+    )
+
+
+def plan_setup(config, stat_cache=None):
+    """
+    Work out which setup actions are needed, given the current state of the
+    file system. The checked directories are checked while planning, since
+    nothing else can be done if any of them are missing.
+
+    Links that exist but point elsewhere, and originals that are missing, are
+    included in the plan, so that they are reported when the plan is carried
+    out. Repositories are checked without running git (see
+    `ExternalRepository.is_checked_out`).
+
+    :param config: A `SetupConfig`.
+    :param stat_cache: A `StatCache`; pass the same cache to `apply_setup`, so
+    that the paths aren't stat'ed again.
+    :return: A list of `SetupAction`s, in the order that they are carried out.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+    stat_cache.stat_many(
+        config.make_dirs
+        + [copy for _, copy in config.file_copies + config.dir_copies]
+        + [repo.output_path for repo in config.repositories.values()]
+        + config.touch_files
+    )
+    stat_cache.stat_many([link for _, link in config.links], follow_symlinks=False)
+    check_dirs(config.check_dirs, stat_cache=stat_cache)
+
+    actions = [
+        SetupAction("link", link, target)
+        for target, link in config.links
+        if not _link_is_current(target, link, stat_cache)
+    ]
+    actions += [
+        SetupAction("mkdir", dirname)
+        for dirname in config.make_dirs
+        if not stat_cache.isdir(dirname)
+    ]
+    actions += [
+        SetupAction("copy_file", copy, original)
+        for original, copy in config.file_copies
+        if not stat_cache.exists(copy)
+    ]
+    actions += [
+        SetupAction("copy_dir", copy, original)
+        for original, copy in config.dir_copies
+        if not stat_cache.exists(copy)
+    ]
+    for repo in config.repositories.values():
+        if not stat_cache.exists(repo.output_path):
+            actions.append(SetupAction("clone", repo.output_path, repo.input_path))
+        elif not repo.is_checked_out():
+            actions.append(SetupAction("checkout", repo.output_path, repo.commit))
+    actions += [
+        SetupAction("touch", filename)
+        for filename in config.touch_files
+        if not stat_cache.isfile(filename)
+    ]
+    return actions
+
+
+def apply_setup(
+    config,
+    actions,
+    n_workers=4,
+    cache_dir=None,
+    cache_max_age_days=None,
+    stat_cache=None,
+):
+    """
+    Carry out the planned setup actions.
+
+    :param config: The `SetupConfig` that the plan was made from.
+    :param actions: A list of `SetupAction`s, as returned by `plan_setup`.
+    :param n_workers: The number of files that may be copied, and the number
+    of git repositories that may be cloned, concurrently.
+    :param cache_dir, cache_max_age_days: Passed to `setup_repositories`.
+    :param stat_cache: The `StatCache` that was used by `plan_setup`.
+    """
+    if stat_cache is None:
+        stat_cache = StatCache()
+
+    def planned(*kinds):
+        return {action.path for action in actions if action.kind in kinds}
+
+    links = planned("link")
+    if links:
+        add_relative_symlinks([pair for pair in config.links if pair[1] in links])
+        # any of the cached paths may lie beneath a new link
+        stat_cache.clear()
+    make_dirs(
+        [dirname for dirname in config.make_dirs if dirname in planned("mkdir")],
+        stat_cache=stat_cache,
+    )
+    file_copies = planned("copy_file")
+    copy_files(
+        [pair for pair in config.file_copies if pair[1] in file_copies],
+        n_workers=n_workers,
+        stat_cache=stat_cache,
+    )
+    dir_copies = planned("copy_dir")
+    copy_dirs(
+        [pair for pair in config.dir_copies if pair[1] in dir_copies],
+        n_workers=n_workers,
+        stat_cache=stat_cache,
+    )
+
+    outputs = planned("clone", "checkout")
+    repositories = {
+        name: repo
+        for name, repo in config.repositories.items()
+        if repo.output_path in outputs
+    }
+    if repositories:
+        setup_repositories(
+            repositories,
+            n_workers=n_workers,
+            cache_dir=cache_dir,
+            cache_max_age_days=cache_max_age_days,
+        )
+        for repo in repositories.values():
+            stat_cache.invalidate(repo.output_path)
+    touch_files(
+        [name for name in config.touch_files if name in planned("touch")],
+        stat_cache=stat_cache,
+    )
+
+
+def setup_project(config, dry_run=False, **kwargs):
+    """
+    Plan the setup for a project and, unless this is a `dry_run`, carry out
+    the plan. The keyword arguments are passed to `apply_setup`.
+
+    :param config: A `SetupConfig`.
+    :return: The list of planned `SetupAction`s.
+    """
+    stat_cache = StatCache()
+    actions = plan_setup(config, stat_cache=stat_cache)
+    if actions and not dry_run:
+        apply_setup(config, actions, stat_cache=stat_cache, **kwargs)
+    return actions
+
+
+@contextmanager
+def _working_dir(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _latest_mtime(paths):
+    """
+    The latest modification time of the paths and, for directories, of
+    everything within them (other than hidden files and `__pycache__`).
+    """
+    latest = 0.0
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        latest = max(latest, os.stat(path).st_mtime)
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [
+                name
+                for name in dirnames
+                if not name.startswith(".") and name != "__pycache__"
+            ]
+            for name in dirnames + filenames:
+                if not name.startswith("."):
+                    latest = max(
+                        latest, os.lstat(os.path.join(dirpath, name)).st_mtime
+                    )
+    return latest
+
+
+def read_subjobs(config_dir=DEFAULT_CONFIG_DIR):
+    """
+    :return: The names of the subjobs of a project (an empty list if the
+    subjobs file is missing).
+    """
+    subjobs_file = os.path.join(config_dir, SUBJOBS_FILE)
+    if not os.path.isfile(subjobs_file):
+        return []
+    return read_config_lines(subjobs_file)
+
+
+def is_setup_current(project_dir=".", config_dir=DEFAULT_CONFIG_DIR):
+    """
+    Is a project (and, recursively, each of its subjobs) completely set up?
+
+    This is True if the setup stamp is newer than all of the setup config
+    files and scripts, and there are no planned setup actions. No subprocesses
+    are run, so this can be checked cheaply, eg, at the start of every cluster
+    job. Nothing is printed: missing directories are left for the full setup
+    to report.
+
+    :param project_dir: The root directory of the project.
+    :param config_dir: The config directory, relative to `project_dir`.
+    """
+    with _working_dir(project_dir):
+        if not os.path.isfile(SETUP_STAMP):
+            return False
+        definitions = (config_dir,) + SETUP_DEFINITIONS
+        if os.stat(SETUP_STAMP).st_mtime < _latest_mtime(definitions):
+            return False
+        try:
+            config = SetupConfig.from_dir(config_dir)
+            stat_cache = StatCache()
+            if find_missing_dirs(config.check_dirs, stat_cache=stat_cache):
+                return False
+            if plan_setup(config, stat_cache=stat_cache):
+                return False
+        except (OSError, ValueError):
+            return False
+        subjobs = read_subjobs(config_dir)
+
+    return all(
+        is_setup_current(os.path.join(project_dir, SUBJOBS_DIR, name), config_dir)
+        for name in subjobs
+    )
+
+
+def run_workflow(config_dir, dry_run=False, **kwargs):
+    """
+    Read the setup config files in `config_dir` and set up the project; or, if
+    this is a `dry_run`, print the plan to stdout. The keyword arguments are
+    passed to `apply_setup`.
+    """
+    actions = setup_project(SetupConfig.from_dir(config_dir), dry_run, **kwargs)
+    if dry_run:
+        for action in actions:
+            print(action.format())
+        if not actions:
+            print("Nothing to do: the project is set up", file=sys.stderr)
+
+
+def define_command_arg_parser():
+    """
+    Get a parser that extracts the command args used when calling this program
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "config_dir",
+        nargs="?",
+        default=DEFAULT_CONFIG_DIR,
+        help="directory containing the setup config files",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of files that may be copied, and of git repositories "
+        "that may be cloned, concurrently",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="directory of local git mirrors that the repositories are cloned "
+        "from (see `setup_git_clones.py`)",
+    )
+    parser.add_argument(
+        "--cache-max-age-days",
+        type=float,
+        default=None,
+        help="delete any mirrors in --cache-dir that haven't been used for "
+        "this many days",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the planned setup actions, without carrying them out",
+    )
+    return parser
+
+
+# ---- run as a script
+
+if __name__ == "__main__":
+    ARGS = define_command_arg_parser().parse_args()
+    run_workflow(
+        ARGS.config_dir,
+        dry_run=ARGS.dry_run,
+        n_workers=ARGS.workers,
+        cache_dir=ARGS.cache_dir,
+        cache_max_age_days=ARGS.cache_max_age_days,
+    )
@@ -0,0 +1,221 @@
+"""
+Set up every subjob of a project, and recursively their subjobs, by running
+`./sidekick setup` in each subjob's directory.
+
+The whole tree of subjobs is found first. A subjob is set up once its parent
+has been set up, and up to `--workers` subjobs are set up at once. Each setup
+runs in its own subjob directory with `SIDEKICK_SKIP_SUBJOBS=1` set, so that
+it doesn't set up its own subjobs as well; its output is written to a log
+file. A failure doesn't stop the other subjobs (other than those nested
+within the failed subjob) from being set up.
+
+Eg, `python setup_subjobs.py --workers 8`
+"""
+
+import argparse
+import os
+import os.path
+import subprocess
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from buddy.setup_project import DEFAULT_CONFIG_DIR, SUBJOBS_DIR, read_subjobs
+
+# Set in the environment of each subjob's setup, so that `setup_subjobs.sh`
+# doesn't set up the nested subjobs a second time
+SKIP_SUBJOBS_VARIABLE = "SIDEKICK_SKIP_SUBJOBS"
+
+DEFAULT_LOG_DIR = os.path.join("temp", "setup_logs")
+
+
+class Subjob:
+    """
+    `Subjob` defines a subjob directory (relative to the top-level project)
+    and the subjob that it is nested within (None for the subjobs of the
+    top-level project).
+    """
+
+    def __init__(self, path, parent=None):
+        self.path = path
+        self.parent = parent
+
+    def __eq__(self, other):
+        return self.path == other.path and self.parent == other.parent
+
+    def __repr__(self):
+        return "Subjob({!r}, {!r})".format(self.path, self.parent)
+
+    def log_name(self):
+        """
+        A filename for the log of this subjob's setup
+        """
+        parts = os.path.normpath(self.path).split(os.sep)
+        if SUBJOBS_DIR in parts:
+            parts = parts[parts.index(SUBJOBS_DIR) :]
+        return "{}.log".format("__".join(part for part in parts if part != SUBJOBS_DIR))
+
+
+def find_subjobs(project_dir=".", config_dir=DEFAULT_CONFIG_DIR):
+    """
+    Find every subjob of a project, and recursively the subjobs of those
+    subjobs, as listed in the `subjob_names.txt` file of each project.
+
+    :return: A list of `Subjob`s, in which each subjob comes after its parent.
+    """
+    subjobs = []
+    seen = set()
+    queue = [(project_dir, None)]
+    while queue:
+        directory, parent = queue.pop(0)
+        for name in read_subjobs(os.path.join(directory, config_dir)):
+            path = os.path.join(directory, SUBJOBS_DIR, name)
+            if not os.path.isdir(path):
+                raise FileNotFoundError(
+                    "Subjob `{}` should be defined before its setup".format(path)
+                )
+            if not os.path.isfile(os.path.join(path, "scripts", "setup.sh")):
+                raise FileNotFoundError(
+                    "Subjob `{}` should have a scripts/setup.sh defined".format(path)
+                )
+            real_path = os.path.realpath(path)
+            if real_path in seen:
+                raise ValueError(
+                    "Subjob `{}` is listed more than once in the tree of "
+                    "subjobs".format(path)
+                )
+            seen.add(real_path)
+            subjobs.append(Subjob(path, parent))
+            queue.append((path, path))
+    return subjobs
+
+
+def setup_subjob(subjob, log_dir=DEFAULT_LOG_DIR):
+    """
+    Run `./sidekick setup` in the directory of a subjob (but not for its
+    nested subjobs), writing the output to a log file.
+
+    :return: The number of seconds taken.
+    :raises subprocess.CalledProcessError: If the setup fails.
+    """
+    env = dict(os.environ, **{SKIP_SUBJOBS_VARIABLE: "1"})
+    log_file = os.path.join(log_dir, subjob.log_name())
+    start = time.perf_counter()
+    with open(log_file, "w") as log:
+        subprocess.run(
+            ["./sidekick", "setup"],
+            cwd=subjob.path,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+    return time.perf_counter() - start
+
+
+def setup_subjobs(subjobs, n_workers=4, log_dir=DEFAULT_LOG_DIR):
+    """
+    Set up each subjob after its parent, with up to `n_workers` subjobs being
+    set up at once.
+
+    A line is written to stderr as each subjob is set up (`[DONE]`), fails
+    (`[FAILED]`), or is skipped because its parent failed (`[SKIPPED]`). Once
+    every subjob has been attempted, the first of the errors (in the order of
+    `subjobs`) is raised.
+
+    :param subjobs: A list of `Subjob`s, as returned by `find_subjobs`.
+    :param n_workers: The number of subjobs that may be set up concurrently.
+    :param log_dir: The directory for the log of each subjob's setup.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    waiting = list(subjobs)
+    done = set()
+    errors = {}
+
+    def report(label, subjob, detail):
+        print(
+            "[{}]\tsubjob:{}\t{}\tlog:{}".format(
+                label, subjob.path, detail, os.path.join(log_dir, subjob.log_name())
+            ),
+            file=sys.stderr,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        running = {}
+        while waiting or running:
+            for subjob in list(waiting):
+                if subjob.parent is None or subjob.parent in done:
+                    waiting.remove(subjob)
+                    future = executor.submit(setup_subjob, subjob, log_dir)
+                    running[future] = subjob
+                elif subjob.parent in errors:
+                    waiting.remove(subjob)
+                    errors[subjob.path] = None
+                    report("SKIPPED", subjob, "parent:{}".format(subjob.parent))
+            if not running:
+                if waiting:
+                    raise ValueError(
+                        "The parents of subjobs {} are not in the list of "
+                        "subjobs".format([subjob.path for subjob in waiting])
+                    )
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                subjob = running.pop(future)
+                try:
+                    seconds = future.result()
+                except (OSError, subprocess.CalledProcessError) as error:
+                    errors[subjob.path] = error
+                    report("FAILED", subjob, "error:{}".format(error))
+                    continue
+                done.add(subjob.path)
+                report("DONE", subjob, "seconds:{:.3f}".format(seconds))
+
+    failed = [subjob.path for subjob in subjobs if errors.get(subjob.path)]
+    if failed:
+        print(
+            "{} of {} subjobs could not be set up: {}".format(
+                len(failed), len(subjobs), ", ".join(failed)
+            ),
+            file=sys.stderr,
+        )
+        raise errors[failed[0]]
+
+
+def run_workflow(project_dir=".", n_workers=4, log_dir=DEFAULT_LOG_DIR):
+    """
+    Set up every subjob (and nested subjob) of the project in `project_dir`
+    """
+    subjobs = find_subjobs(project_dir)
+    if not subjobs:
+        print("No subjobs defined for `{}`".format(project_dir), file=sys.stderr)
+        return
+    setup_subjobs(subjobs, n_workers=n_workers, log_dir=log_dir)
+
+
+def define_command_arg_parser():
+    """
+    Get a parser that extracts the command args used when calling this program
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of subjobs that may be set up concurrently",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default=DEFAULT_LOG_DIR,
+        help="directory for the log of each subjob's setup",
+    )
+    return parser
+
+
+# ---- run as a script
+
+if __name__ == "__main__":
+    ARGS = define_command_arg_parser().parse_args()
+    run_workflow(n_workers=ARGS.workers, log_dir=ARGS.log_dir)
@@ -0,0 +1,120 @@
+"""
+A cache of `stat` results, so that the stages of a project's setup don't stat
+the same paths again; on a network file system each `stat` is a round trip
+to the server.
+
+Paths can be stat'ed in batches, concurrently. Any stage that changes a path
+should `invalidate` it.
+"""
+
+import os
+import os.path
+import stat
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StatCache:
+    """
+    `StatCache` holds the results of `os.stat` (following symlinks) and
+    `os.lstat` (not following symlinks) for paths; a missing path is cached as
+    None.
+
+    The cache can be shared between threads.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        # `..` is only normalised away where that can't change the meaning of
+        # the path (if `a` is a symlink, `a/..` need not be `.`)
+        if ".." in path.split(os.sep):
+            return os.path.join(os.getcwd(), path)
+        return os.path.abspath(path)
+
+    def stat(self, path, follow_symlinks=True):
+        """
+        :return: The (possibly cached) stat result for the path, or None if
+        the path can't be stat'ed.
+        """
+        key = (self._key(path), follow_symlinks)
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        try:
+            result = os.stat(path, follow_symlinks=follow_symlinks)
+        except (OSError, ValueError):
+            result = None
+        with self._lock:
+            self._results[key] = result
+        return result
+
+    def stat_many(self, paths, follow_symlinks=True, n_workers=8):
+        """
+        Stat each path (other than those already in the cache, or repeated)
+        with up to `n_workers` stats in flight at once.
+
+        :return: A dictionary of path: stat result (or None).
+        """
+        unique = list(dict.fromkeys(paths))
+        if n_workers > 1 and len(unique) > 1:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                results = executor.map(
+                    lambda path: self.stat(path, follow_symlinks), unique
+                )
+                return dict(zip(unique, results))
+        return {path: self.stat(path, follow_symlinks) for path in unique}
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def lexists(self, path):
+        return self.stat(path, follow_symlinks=False) is not None
+
+    def isdir(self, path):
+        result = self.stat(path)
+        return result is not None and stat_is_dir(result)
+
+    def isfile(self, path):
+        result = self.stat(path)
+        return result is not None and stat_is_file(result)
+
+    def islink(self, path):
+        result = self.stat(path, follow_symlinks=False)
+        return result is not None and stat_is_link(result)
+
+    def invalidate(self, path):
+        """
+        Drop the cached results for a path, eg, after it has been made.
+        """
+        key = self._key(path)
+        with self._lock:
+            self._results.pop((key, True), None)
+            self._results.pop((key, False), None)
+
+    def clear(self):
+        """
+        Drop every cached result, eg, after a link has been made that any of
+        the cached paths may lie beneath.
+        """
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+def stat_is_dir(stat_result):
+    return stat.S_ISDIR(stat_result.st_mode)
+
+
+def stat_is_file(stat_result):
+    return stat.S_ISREG(stat_result.st_mode)
+
+
+def stat_is_link(stat_result):
+    return stat.S_ISLNK(stat_result.st_mode)
@@ -0,0 +1,488 @@
+"""
+Write a manifest for every file in a directory tree, and check a directory
+tree against such a manifest.
+
+The manifest is a yaml file in the format used by `validate_file_contents.py`:
+each file is a validation test (named by the file's path relative to the root
+of the tree) that defines the `input_file`, its digest, `expected_size` and
+`expected_mtime`. So the manifest can also be checked with `sidekick validate`.
+
+Paths in the manifest are relative to the working directory, as for any other
+validation yaml; so a manifest should be checked from the directory where it
+was written.
+"""
+
+import argparse
+import fnmatch
+import os
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from buddy.file_utils import read_yaml, write_yaml
+from buddy.validation_classes import (
+    HASH_CONSTRUCTORS,
+    VALIDATOR_CLASSES,
+    ChunkValidator,
+    DigestValidator,
+    get_chunk_digests,
+    get_digests,
+)
+from buddy.validation_workflow import VALIDATION_LEVELS, ValidationWorkflow
+
+# The `expected_*` key that holds each algorithm's digest in a manifest
+DIGEST_KEYS = {
+    cls.algorithm: key
+    for key, cls in VALIDATOR_CLASSES.items()
+    if issubclass(cls, DigestValidator)
+}
+
+# Pseudo-algorithm for manifests that hold the content-defined chunks of each
+# file (`expected_chunks`) rather than a single digest
+CHUNKS = "chunks"
+
+
+class TreeDiff:
+    """
+    `TreeDiff` holds the differences between a directory tree and its manifest:
+    the paths of files that were added to the tree, removed from it, or whose
+    metadata / contents have changed.
+    """
+
+    def __init__(self, added=None, removed=None, changed=None):
+        self.added = sorted(added or [])
+        self.removed = sorted(removed or [])
+        self.changed = sorted(changed or [])
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.changed)
+
+    def format(self):
+        """
+        Make a tab-separated report of the differences; one line per file.
+        """
+        lines = []
+        for label, paths in [
+            ("[ADDED]", self.added),
+            ("[REMOVED]", self.removed),
+            ("[CHANGED]", self.changed),
+        ]:
+            lines += ["{}\tinput_file:{}".format(label, path) for path in paths]
+        return "\n".join(lines)
+
+    def __eq__(self, other):
+        return (
+            self.added == other.added
+            and self.removed == other.removed
+            and self.changed == other.changed
+        )
+
+
+def is_selected(relative_path, include=None, exclude=None):
+    """
+    Should a file be part of the manifest?
+
+    :param relative_path: The path of the file relative to the root of the
+    tree, using "/" as a separator.
+    :param include: A list of glob patterns; if provided, the file must match
+    at least one of them.
+    :param exclude: A list of glob patterns; neither the file nor any of the
+    directories that contain it may match any of them.
+    """
+    if include and not _matches_any(relative_path, include):
+        return False
+    parts = relative_path.split("/")
+    return not any(
+        _matches_any("/".join(parts[:i]), exclude) for i in range(1, len(parts) + 1)
+    )
+
+
+def _matches_any(relative_path, patterns):
+    return bool(patterns) and any(fnmatch.fnmatch(relative_path, p) for p in patterns)
+
+
+def scan_tree(root, include=None, exclude=None, n_workers=1):
+    """
+    Find the files in a directory tree, along with their stat metadata.
+
+    Directories are scanned concurrently with `os.scandir`, so that the
+    metadata for each file comes from the directory listing (or a single
+    `stat()` call) rather than from separate `os.path` calls. Symbolic links
+    to directories are not followed. A directory that matches one of the
+    `exclude` patterns is skipped entirely.
+
+    :param root: The root of the directory tree.
+    :param include: Glob patterns, see `is_selected`.
+    :param exclude: Glob patterns, see `is_selected`.
+    :param n_workers: The number of directories that may be scanned
+    concurrently.
+    :return: A dictionary mapping the relative path of each file (using "/" as
+    a separator) to its `os.stat_result`, sorted by path.
+    """
+    files = {}
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        pending = {executor.submit(_scan_dir, root, "", include, exclude)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_files, subdirs = future.result()
+                files.update(dir_files)
+                pending.update(
+                    executor.submit(_scan_dir, root, subdir, include, exclude)
+                    for subdir in subdirs
+                )
+    return dict(sorted(files.items()))
+
+
+def _scan_dir(root, relative_dir, include, exclude):
+    files = {}
+    subdirs = []
+    with os.scandir(os.path.join(root, relative_dir)) as entries:
+        for entry in entries:
+            relative_path = relative_dir + entry.name
+            # the directories that contain this entry have already been
+            # checked against the `exclude` patterns
+            if _matches_any(relative_path, exclude):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(relative_path + "/")
+            elif entry.is_file():
+                if not include or _matches_any(relative_path, include):
+                    files[relative_path] = entry.stat()
+    return files, subdirs
+
+
+def describe_file(path, algorithm="md5"):
+    """
+    The part of a manifest entry that describes the contents of a file: its
+    digest (eg, {"expected_md5sum": ...}) or, if `algorithm` is "chunks", its
+    content-defined chunks ({"expected_chunks": [...]}).
+    """
+    if algorithm == CHUNKS:
+        return {"expected_chunks": get_chunk_digests(path)}
+    return {DIGEST_KEYS[algorithm]: get_digests(path, [algorithm])[algorithm]}
+
+
+def describe_files(paths, algorithm="md5", n_workers=1):
+    """
+    Describe the contents of several files, see `describe_file`.
+
+    :return: A dictionary mapping each path to its description.
+    """
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        descriptions = executor.map(lambda path: describe_file(path, algorithm), paths)
+        return dict(zip(paths, descriptions))
+
+
+def make_manifest_entry(input_file, stat_result, description):
+    entry = {"input_file": input_file}
+    entry.update(description)
+    entry["expected_size"] = stat_result.st_size
+    entry["expected_mtime"] = stat_result.st_mtime
+    return entry
+
+
+def make_manifest(root, include=None, exclude=None, algorithm="md5", n_workers=1):
+    """
+    Make a manifest for a directory tree.
+
+    :return: A dictionary that defines a validation test for every (selected)
+    file in the tree; see `ValidationWorkflow.from_yaml_dict`.
+    """
+    files = scan_tree(root, include, exclude, n_workers)
+    paths = {relative: os.path.join(root, relative) for relative in files}
+    descriptions = describe_files(list(paths.values()), algorithm, n_workers)
+    return {
+        relative: make_manifest_entry(
+            paths[relative], stat_result, descriptions[paths[relative]]
+        )
+        for relative, stat_result in files.items()
+    }
+
+
+def check_tree(
+    root, manifest_file, include=None, exclude=None, n_workers=1, level="full"
+):
+    """
+    Compare a directory tree to its manifest.
+
+    The tree is scanned once. A file is "changed" if its size / mtime differ
+    from those in the manifest; at the "full" level, the remaining files are
+    also hashed and a file is "changed" if its digest differs.
+
+    :return: A `TreeDiff`.
+    """
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(
+            "`level` should be one of {}, not `{}`".format(VALIDATION_LEVELS, level)
+        )
+    workflow = ValidationWorkflow.from_yaml_file(manifest_file)
+    expected = {
+        os.path.normpath(validator.input_file): name
+        for name, validator in workflow.validators.items()
+    }
+    files = scan_tree(root, include, exclude, n_workers)
+    found = {
+        os.path.normpath(os.path.join(root, relative)): stat_result
+        for relative, stat_result in files.items()
+    }
+
+    added = [path for path in found if path not in expected]
+    removed = [
+        path
+        for path in expected
+        if path not in found
+        and _is_in_tree(path, root)
+        and is_selected(_relative_to(path, root), include, exclude)
+    ]
+
+    changed = []
+    to_hash = {}
+    for path, stat_result in found.items():
+        if path not in expected:
+            continue
+        name = expected[path]
+        validator = workflow.validators[name]
+        if not validator.check_metadata(stat_result):
+            changed.append(path)
+        elif level == "full":
+            to_hash[name] = validator
+
+    for result in ValidationWorkflow(to_hash).iter_results(n_workers=n_workers):
+        if not result.passed:
+            changed.append(os.path.normpath(result.input_file))
+
+    return TreeDiff(added, removed, changed)
+
+
+def update_manifest(
+    root, manifest_file, include=None, exclude=None, algorithm="md5", n_workers=1
+):
+    """
+    Bring the manifest for a directory tree up to date, hashing only those
+    files that are new or whose size / mtime differ from the manifest. The
+    digests of the remaining files are carried forward from the manifest.
+
+    As for the "quick" validation level, this trusts that a file whose size
+    and mtime are unchanged has unchanged contents; a full `check_tree` should
+    still be ran from time to time.
+
+    Entries of the manifest that are outside the (selected part of the) tree
+    are kept unchanged.
+
+    :return: A tuple: the updated manifest (a dictionary, as returned by
+    `make_manifest`), and a `TreeDiff` of the files that were added, removed
+    or whose digest has changed.
+    """
+    previous = read_yaml(manifest_file)
+    validators = ValidationWorkflow.parse_validator_details(previous)
+    previous_names = {
+        os.path.normpath(validator.input_file): name
+        for name, validator in validators.items()
+    }
+
+    files = scan_tree(root, include, exclude, n_workers)
+    paths = {relative: os.path.join(root, relative) for relative in files}
+    previous_descriptions = {}
+    carried = {}
+    for relative, stat_result in files.items():
+        name = previous_names.get(os.path.normpath(paths[relative]))
+        if name is None:
+            continue
+        validator = validators[name]
+        description = _previous_description(validator, algorithm)
+        previous_descriptions[relative] = description
+        if (
+            description is not None
+            and validator.expected_size is not None
+            and validator.expected_mtime is not None
+            and validator.check_metadata(stat_result)
+        ):
+            carried[relative] = description
+    descriptions = describe_files(
+        [paths[relative] for relative in files if relative not in carried],
+        algorithm,
+        n_workers,
+    )
+
+    manifest = {}
+    added, changed = [], []
+    for relative, stat_result in files.items():
+        path = paths[relative]
+        if relative in carried:
+            description = carried[relative]
+        else:
+            description = descriptions[path]
+        manifest[relative] = make_manifest_entry(path, stat_result, description)
+
+        if relative not in previous_descriptions:
+            added.append(os.path.normpath(path))
+        elif previous_descriptions[relative] not in (None, description):
+            changed.append(os.path.normpath(path))
+
+    found = {os.path.normpath(path) for path in paths.values()}
+    removed = []
+    for path, name in previous_names.items():
+        if path in found:
+            continue
+        if _is_in_tree(path, root) and is_selected(
+            _relative_to(path, root), include, exclude
+        ):
+            removed.append(path)
+        elif name not in manifest:
+            manifest[name] = previous[name]
+
+    return manifest, TreeDiff(added, removed, changed)
+
+
+def _previous_description(validator, algorithm):
+    """
+    Describe a file as it was when the manifest was written (see
+    `describe_file`); or None if the validator from the manifest did not hash
+    the whole of the raw file with `algorithm`.
+    """
+    if algorithm == CHUNKS:
+        if isinstance(validator, ChunkValidator):
+            return {"expected_chunks": validator.expected_chunks}
+        return None
+    if (
+        isinstance(validator, DigestValidator)
+        and validator.algorithm == algorithm
+        and validator.comment is None
+        and validator.compression is None
+    ):
+        return {DIGEST_KEYS[algorithm]: validator.expected_digest}
+    return None
+
+
+def _is_in_tree(path, root):
+    relative = os.path.relpath(path, root)
+    return relative != os.pardir and not relative.startswith(os.pardir + os.sep)
+
+
+def _relative_to(path, root):
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+# ---- workflows
+
+
+def write_workflow(root, manifest_file, **kwargs):
+    """
+    Write a manifest for a directory tree. The keyword arguments (`include`,
+    `exclude`, `algorithm`, `n_workers`) are passed to `make_manifest`.
+    """
+    write_yaml(make_manifest(root, **kwargs), manifest_file)
+
+
+def update_workflow(root, manifest_file, **kwargs):
+    """
+    Update the manifest for a directory tree in place, and print the files
+    that were added, removed or changed. The keyword arguments are passed to
+    `update_manifest`.
+
+    The new manifest is written to a temporary file that then replaces the
+    old one, so an interrupted update leaves the old manifest intact.
+    """
+    manifest, diff = update_manifest(root, manifest_file, **kwargs)
+    temp_file = manifest_file + ".tmp"
+    write_yaml(manifest, temp_file)
+    os.replace(temp_file, manifest_file)
+    if not diff.is_empty():
+        print(diff.format())
+
+
+def check_workflow(root, manifest_file, **kwargs):
+    """
+    Check a directory tree against its manifest and print any differences.
+    The keyword arguments are passed to `check_tree`.
+    """
+    diff = check_tree(root, manifest_file, **kwargs)
+    if not diff.is_empty():
+        print(diff.format())
+
+
+def define_command_arg_parser():
+    """
+    Get a parser that extracts the command args used when calling this program
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "mode",
+        choices=["write", "check", "update"],
+        help="`write`: make a manifest for the tree; "
+        "`check`: report files that were added, removed or changed since the "
+        "manifest was written; "
+        "`update`: re-hash only the new files and those whose size / mtime "
+        "changed, update the manifest and report the differences",
+    )
+    parser.add_argument("root", help="root of the directory tree")
+    parser.add_argument("manifest_yaml", help="the manifest file")
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=None,
+        help="only consider files whose path (relative to the root) matches "
+        "this glob; may be repeated",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=None,
+        help="ignore files / directories whose path (relative to the root) "
+        "matches this glob; may be repeated",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of directories scanned / files hashed concurrently",
+    )
+    parser.add_argument(
+        "--algorithm",
+        choices=sorted(a for a in DIGEST_KEYS if a in HASH_CONSTRUCTORS) + [CHUNKS],
+        default="md5",
+        help="digest that is written to the manifest; `chunks` records the "
+        "digests of content-defined chunks, so that checks can report which "
+        "byte ranges of a file changed",
+    )
+    parser.add_argument(
+        "--level",
+        choices=VALIDATION_LEVELS,
+        default="full",
+        help="`full`: compare file metadata and digests; "
+        "`quick`: only compare the file sizes and mtimes",
+    )
+    return parser
+
+
+# ---- run as a script
+
+if __name__ == "__main__":
+    ARGS = define_command_arg_parser().parse_args()
+    if ARGS.mode == "write":
+        write_workflow(
+            ARGS.root,
+            ARGS.manifest_yaml,
+            include=ARGS.include,
+            exclude=ARGS.exclude,
+            algorithm=ARGS.algorithm,
+            n_workers=ARGS.workers,
+        )
+    elif ARGS.mode == "update":
+        update_workflow(
+            ARGS.root,
+            ARGS.manifest_yaml,
+            include=ARGS.include,
+            exclude=ARGS.exclude,
+            algorithm=ARGS.algorithm,
+            n_workers=ARGS.workers,
+        )
+    else:
+        check_workflow(
+            ARGS.root,
+            ARGS.manifest_yaml,
+            include=ARGS.include,
+            exclude=ARGS.exclude,
+            n_workers=ARGS.workers,
+            level=ARGS.level,
+        )
@@ -12,18 +12,84 @@ import os.path
 import sys
 
 from buddy.file_utils import read_yaml
+from buddy.stat_cache import StatCache, stat_is_dir
 
 
-def run_workflow(yaml_path):
+def _ancestors(path):
     """
-    Checks that every directory mentioned in the yaml file is really a
-    directory
+    The parent directories of a (normalised, relative or absolute) path
+    """
+    parent = os.path.dirname(path)
+    while parent and parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
 
-    :param yaml_path: a file-path
-    :return:
+
+def _normalise(path):
+    # `normpath` would turn `a/../b` into `b`, which is wrong if `a` is a
+    # symlink
+    if ".." in path.split(os.sep):
+        return path.rstrip(os.sep) or path
+    return os.path.normpath(path)
+
+
+def find_missing_dirs(dirs, stat_cache=None, n_workers=8):
+    """
+    Finds those file-paths that aren't directories.
+
+    The deepest paths are stat'ed first, concurrently: if a path is a
+    directory, then so are its parents, and those aren't stat'ed. Paths
+    that contain `..` are always stat'ed, since a `..` after a symlink may
+    not lead where the path suggests.
+
+    :param dirs: a list of file-paths
+    :param stat_cache: a `StatCache`, so the stat results can be re-used
+    :param n_workers: the number of paths that may be stat'ed concurrently
+    :return: a list of the paths that aren't directories, in the order of
+    `dirs`
     """
-    dirs = read_yaml(yaml_path)
+    if stat_cache is None:
+        stat_cache = StatCache()
+    normalised = {path: _normalise(path) for path in dirs}
+    inferable = {norm for norm in normalised.values() if ".." not in norm.split(os.sep)}
+    ancestors = {parent for norm in inferable for parent in _ancestors(norm) if parent}
 
+    # paths that aren't a parent of any other path
+    deepest = [norm for norm in set(normalised.values()) if norm not in ancestors]
+    results = stat_cache.stat_many(deepest, n_workers=n_workers)
+    known_dirs = {
+        parent
+        for norm, result in results.items()
+        if result is not None and stat_is_dir(result) and norm in inferable
+        for parent in _ancestors(norm)
+    }
+    remaining = [
+        norm
+        for norm in set(normalised.values())
+        if norm not in results and norm not in known_dirs
+    ]
+    results.update(stat_cache.stat_many(remaining, n_workers=n_workers))
+
+    return [
+        path
+        for path, norm in normalised.items()
+        if norm not in known_dirs
+        and (results[norm] is None or not stat_is_dir(results[norm]))
+    ]
+
+
+def check_dirs(dirs, stat_cache=None, n_workers=8):
+    """
+    Checks that every directory in a list is really a directory
+
+    Every missing directory is reported on stderr (one `[MISSING]` line each)
+    before a `FileNotFoundError` is raised.
+
+    :param dirs: a list of file-paths
+    :param stat_cache: a `StatCache`, so the stat results can be re-used
+    :param n_workers: the number of paths that may be stat'ed concurrently
+    :return:
+    """
     for current_dir in dirs:
         if not os.path.expanduser(current_dir) == current_dir:
             print(
@@ -32,10 +98,24 @@ def run_workflow(yaml_path):
             )
             raise Exception()
 
-        if not os.path.isdir(current_dir):
-            raise FileNotFoundError(
-                errno.ENOENT, os.strerror(errno.ENOENT), current_dir
-            )
+    missing = find_missing_dirs(dirs, stat_cache=stat_cache, n_workers=n_workers)
+    for current_dir in missing:
+        print("[MISSING]\tdir:{}".format(current_dir), file=sys.stderr)
+    if missing:
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), ", ".join(missing)
+        )
+
+
+def run_workflow(yaml_path):
+    """
+    Checks that every directory mentioned in the yaml file is really a
+    directory
+
+    :param yaml_path: a file-path
+    :return:
+    """
+    check_dirs(read_yaml(yaml_path))
 
 
 def define_command_arg_parser():
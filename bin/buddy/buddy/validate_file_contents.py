@@ -1,6 +1,11 @@
 import argparse
+import sys
 
-from buddy.validation_workflow import ValidationWorkflow
+from contextlib import contextmanager
+
+from buddy.hash_cache import CACHE_MODES, HashCache
+from buddy.validation_reports import REPORT_WRITERS, MultiReportWriter, TimingSummary
+from buddy.validation_workflow import RUNNERS, VALIDATION_LEVELS, ValidationWorkflow
 
 
 def setup_workflow(yaml_file):
@@ -8,11 +13,61 @@ def setup_workflow(yaml_file):
     return workflow
 
 
-def run_workflow(yaml_file):
+def run_workflow(yaml_file, cache=None, timings=False, **kwargs):
+    """
+    Run the validation tests defined in a yaml file and print a report of any
+    failures. The keyword arguments (`n_workers`, `fail_fast`, `prefilter`,
+    `level`, `runner`, `report_writer`) are passed to
+    `ValidationWorkflow.run_validators`.
+
+    If `timings` is set, the validation is instrumented and a summary of the
+    timings (total throughput, I/O versus hashing time, slowest files) is
+    printed to stderr.
+    """
     workflow = setup_workflow(yaml_file)
-    report = workflow.format_failure_report()
+    if cache is not None:
+        workflow.use_hash_cache(cache)
+
+    summary = None
+    if timings:
+        summary = TimingSummary()
+        writers = [w for w in (kwargs.get("report_writer"), summary) if w is not None]
+        kwargs["report_writer"] = MultiReportWriter(writers)
+        kwargs["instrument"] = True
+
+    report = workflow.format_failure_report(**kwargs)
+    if cache is not None:
+        cache.evict()
     if report:
         print(report)
+    if summary is not None:
+        print(summary.format(), file=sys.stderr)
+
+
+def setup_hash_cache(args):
+    if args.hash_cache is None:
+        return None
+    return HashCache(
+        args.hash_cache,
+        mode=args.cache_mode,
+        max_entries=args.cache_max_entries,
+        max_age_days=args.cache_max_age_days,
+    )
+
+
+@contextmanager
+def open_report(args):
+    """
+    Open the stream for the structured report, if one was requested; "-"
+    denotes stdout. A report file is closed on exit, but stdout is left open.
+    """
+    if args.report is None:
+        yield None
+    elif args.report == "-":
+        yield sys.stdout
+    else:
+        with open(args.report, "w") as stream:
+            yield stream
 
 
 def define_command_arg_parser():
@@ -21,6 +76,82 @@ def define_command_arg_parser():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("validate_yaml", nargs=1)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of validation tests that may run concurrently",
+    )
+    parser.add_argument(
+        "--runner",
+        choices=RUNNERS,
+        default="pool",
+        help="`pool`: validate files on a pool of threads / processes; "
+        "`async`: keep up to --workers files in flight from an asyncio event "
+        "loop, adapting the number in flight to the throughput (for network "
+        "file systems)",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="stop validating after the first failure",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="fail tests for missing files or files that don't have the "
+        "`expected_size` before hashing anything (implied by --fail-fast)",
+    )
+    parser.add_argument(
+        "--level",
+        choices=VALIDATION_LEVELS,
+        default="full",
+        help="`full`: check file metadata and digests; "
+        "`quick`: only check that files exist and match their "
+        "`expected_size` / `expected_mtime`",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        help="file to which each result is written as soon as it completes "
+        "(`-` for stdout)",
+    )
+    parser.add_argument(
+        "--report-format",
+        choices=sorted(REPORT_WRITERS),
+        default="jsonl",
+        help="format of the --report file: JSON Lines or tab-separated",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="measure the time spent reading and hashing each file, and print "
+        "a summary (total throughput, slowest files) to stderr",
+    )
+    parser.add_argument(
+        "--hash-cache",
+        default=None,
+        help="file in which the digests of unchanged files are cached",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=CACHE_MODES,
+        default="trust",
+        help="`trust`: reuse the cached digests of unchanged files; "
+        "`rehash`: recompute every digest and update the cache",
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=None,
+        help="keep at most this many (recently used) digests in the cache",
+    )
+    parser.add_argument(
+        "--cache-max-age-days",
+        type=float,
+        default=None,
+        help="drop cached digests that haven't been used for this many days",
+    )
     return parser
 
 
@@ -28,4 +159,19 @@ def define_command_arg_parser():
 
 if __name__ == "__main__":
     ARGS = define_command_arg_parser().parse_args()
-    run_workflow(ARGS.validate_yaml[0])
+    with open_report(ARGS) as REPORT_STREAM:
+        run_workflow(
+            ARGS.validate_yaml[0],
+            cache=setup_hash_cache(ARGS),
+            timings=ARGS.timings,
+            n_workers=ARGS.workers,
+            fail_fast=ARGS.fail_fast,
+            prefilter=ARGS.prefilter,
+            level=ARGS.level,
+            runner=ARGS.runner,
+            report_writer=(
+                None
+                if REPORT_STREAM is None
+                else REPORT_WRITERS[ARGS.report_format](REPORT_STREAM)
+            ),
+        )
@@ -1,27 +1,528 @@
+import gzip
 import hashlib
+import mmap
+import os
+import shutil
+import subprocess
+import time
+import zlib
 
+from contextlib import contextmanager
 
-class Md5sumValidator:
-    def __init__(self, test_name, input_file, expected_md5sum, comment=None):
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+# Number of bytes read from a file at a time when hashing its entire contents
+BLOCK_SIZE = 1024 * 1024
+
+# Compression formats that can be decompressed (as a stream) before hashing
+COMPRESSIONS = ("gzip",)
+
+# Largest difference (in seconds) between a file's mtime and its
+# `expected_mtime` for the two to be considered equal; this allows for the
+# rounding of mtimes that are written as decimals in yaml files
+MTIME_TOLERANCE = 1e-6
+
+# Content-defined chunking (see `get_chunk_digests`): a chunk ends at the end of
+# the first line, after the first `CHUNK_MIN_SIZE` bytes of the chunk, whose
+# crc32 has none of the `CHUNK_BOUNDARY_MASK` bits set; or at the end of the
+# first line after `CHUNK_MAX_SIZE` bytes. For lines of ~100 bytes, chunks are
+# about 700kB on average. Changing these invalidates any stored chunk digests.
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_BOUNDARY_MASK = (1 << 12) - 1
+
+# Multithreaded gzip decompressor, used in preference to python's `gzip`
+# module when it is available on the PATH
+PARALLEL_GUNZIP = "pigz"
+
+
+class Crc32Hash:
+    """
+    A `hashlib`-style wrapper around `zlib.crc32`: a fast, non-cryptographic
+    checksum for integrity-only checks.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return "{:08x}".format(self.value)
+
+
+class Crc32cHash(Crc32Hash):
+    """
+    A `hashlib`-style wrapper around `crc32c.crc32c` (requires the optional
+    `crc32c` package, which uses the hardware CRC32C instructions).
+    """
+
+    def update(self, data):
+        self.value = crc32c.crc32c(data, self.value)
+
+
+class HashStats:
+    """
+    `HashStats` accumulates instrumentation for the hashing of files: the
+    number of bytes read, the time spent waiting for those bytes (`io_seconds`;
+    this includes any decompression) and the time spent feeding them into the
+    hashes (`hash_seconds`). Comparing the two shows whether validation is
+    limited by the disk or by the CPU.
+    """
+
+    def __init__(self, bytes_read=0, io_seconds=0.0, hash_seconds=0.0):
+        self.bytes_read = bytes_read
+        self.io_seconds = io_seconds
+        self.hash_seconds = hash_seconds
+
+    def add(self, bytes_read, io_seconds, hash_seconds):
+        self.bytes_read += bytes_read
+        self.io_seconds += io_seconds
+        self.hash_seconds += hash_seconds
+
+    @property
+    def throughput(self):
+        """
+        Megabytes (1e6 bytes) hashed per second of reading and hashing; None
+        if nothing was read.
+        """
+        seconds = self.io_seconds + self.hash_seconds
+        if not self.bytes_read or not seconds:
+            return None
+        return self.bytes_read / seconds / 1e6
+
+
+# Constructors for the hash objects that can be used to compute a digest; each
+# object must provide `update(bytes)` and `hexdigest()`
+HASH_CONSTRUCTORS = {
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "crc32": Crc32Hash,
+}
+if crc32c is not None:
+    HASH_CONSTRUCTORS["crc32c"] = Crc32cHash
+if xxhash is not None:
+    HASH_CONSTRUCTORS["xxh64"] = xxhash.xxh64
+
+
+class ValidationResult:
+    """
+    `ValidationResult` holds the outcome of applying a single validator: did
+    the test pass, what digest was observed, and how many bytes were read in
+    how many seconds. When the validation is instrumented, the time spent on
+    I/O and on hashing is also recorded (see `HashStats`).
+    """
+
+    def __init__(
+        self,
+        test_name,
+        test_type,
+        input_file,
+        passed,
+        digest=None,
+        bytes_read=None,
+        seconds=None,
+        io_seconds=None,
+        hash_seconds=None,
+        changed_ranges=None,
+    ):
         self.test_name = test_name
+        self.test_type = test_type
         self.input_file = input_file
-        self.expected_md5sum = expected_md5sum
-        self.test_type = "md5sum"
-        self.comment = comment
+        self.passed = passed
+        self.digest = digest
+        self.bytes_read = bytes_read
+        self.seconds = seconds
+        self.io_seconds = io_seconds
+        self.hash_seconds = hash_seconds
+        self.changed_ranges = changed_ranges
 
-    def is_valid(self):
-        return get_md5sum(self.input_file, self.comment) == self.expected_md5sum
+    @property
+    def throughput(self):
+        """
+        Rate at which the file was read, in megabytes (1e6 bytes) per second;
+        None if this is unknown.
+        """
+        if not self.bytes_read or not self.seconds:
+            return None
+        return self.bytes_read / self.seconds / 1e6
+
+    def to_dict(self):
+        return {
+            "test_name": self.test_name,
+            "test_type": self.test_type,
+            "input_file": self.input_file,
+            "passed": self.passed,
+            "digest": self.digest,
+            "bytes_read": self.bytes_read,
+            "seconds": self.seconds,
+            "throughput_mb_per_s": self.throughput,
+            "io_seconds": self.io_seconds,
+            "hash_seconds": self.hash_seconds,
+            "changed_ranges": self.changed_ranges,
+        }
 
     def __eq__(self, other):
+        return self.to_dict() == other.to_dict()
+
+
+class FileValidator:
+    """
+    Base class for validators of a single file. Every validator can check the
+    file's stat metadata against an optional `expected_size` (in bytes, on
+    disk) and `expected_mtime` (in seconds since the epoch) using a single
+    `stat()` call.
+    """
+
+    test_type = "metadata"
+
+    def __init__(
+        self, test_name, input_file, expected_size=None, expected_mtime=None, cache=None
+    ):
+        self.test_name = test_name
+        self.input_file = input_file
+        self.expected_size = expected_size
+        self.expected_mtime = expected_mtime
+        self.cache = cache
+
+    def check_metadata(self, stat_result=None):
+        """
+        A cheap check that can rule out a file before it is hashed: does the
+        file exist, and does its stat metadata match the `expected_size` and
+        `expected_mtime`, if these were provided?
+
+        :param stat_result: The result of `os.stat(self.input_file)` if it is
+        already available.
+        """
+        if stat_result is None:
+            try:
+                stat_result = os.stat(self.input_file)
+            except FileNotFoundError:
+                return False
+        if self.expected_size is not None and stat_result.st_size != self.expected_size:
+            return False
+        if self.expected_mtime is not None and not mtimes_match(
+            stat_result.st_mtime, self.expected_mtime
+        ):
+            return False
+        return True
+
+    @property
+    def is_io_bound(self):
+        return True
+
+    def make_result(self, passed, digest=None, bytes_read=None, changed_ranges=None):
+        return ValidationResult(
+            test_name=self.test_name,
+            test_type=self.test_type,
+            input_file=self.input_file,
+            passed=passed,
+            digest=digest,
+            bytes_read=bytes_read,
+            changed_ranges=changed_ranges,
+        )
+
+    def _metadata_equal(self, other):
         return (
-            self.test_name == other.test_name
+            type(self) is type(other)
+            and self.test_name == other.test_name
             and self.input_file == other.input_file
-            and self.expected_md5sum == other.expected_md5sum
+            and self.expected_size == other.expected_size
+            and self.expected_mtime == other.expected_mtime
+        )
+
+
+class MetadataValidator(FileValidator):
+    """
+    `MetadataValidator` only checks the existence and stat metadata of a file;
+    it is used for tests that define `expected_size` and / or `expected_mtime`
+    but no digest.
+    """
+
+    def is_valid(self):
+        return self.check_metadata()
+
+    def validate(self, _stats=None):
+        """
+        Apply the test. A `HashStats` can be passed, as for the other
+        validators, but it is left unchanged: a metadata check reads nothing
+        and hashes nothing.
+
+        :return: A `ValidationResult`.
+        """
+        return self.make_result(self.is_valid(), bytes_read=0)
+
+    @property
+    def read_key(self):
+        # Nothing is read, so there is nothing to share with other validators
+        return ("metadata", self.test_name)
+
+    def __eq__(self, other):
+        return self._metadata_equal(other)
+
+
+class DigestValidator(FileValidator):
+    """
+    Base class for validators that compare the digest of a file to an expected
+    value. Subclasses define the hash `algorithm` (a key of
+    `HASH_CONSTRUCTORS`) and the `test_type` that is used in reports.
+    """
+
+    algorithm = None
+    test_type = None
+
+    def __init__(
+        self,
+        test_name,
+        input_file,
+        expected_digest,
+        comment=None,
+        compression=None,
+        **kwargs
+    ):
+        super().__init__(test_name, input_file, **kwargs)
+        self.expected_digest = expected_digest
+        self.comment = comment
+        self.compression = compression
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(
+                "Test `{}`: `compression` should be one of {}".format(
+                    test_name, COMPRESSIONS
+                )
+            )
+
+    def is_valid(self, stats=None):
+        """
+        Does the file's digest match the expected digest?
+
+        :param stats: A `HashStats`; if provided, the bytes read and the time
+        spent reading / hashing the file are added to it.
+        """
+        return self.compute_digest(stats) == self.expected_digest
+
+    def validate(self, stats=None):
+        """
+        Apply the test, keeping the observed digest.
+
+        :param stats: A `HashStats`, as for `is_valid`.
+        :return: A `ValidationResult`.
+        """
+        return self.result_from_digests({self.algorithm: self.compute_digest(stats)})
+
+    def result_from_digests(self, digests):
+        """
+        Make a `ValidationResult` from digests that have already been
+        computed (eg, by `get_digests`).
+        """
+        digest = digests[self.algorithm]
+        return self.make_result(digest == self.expected_digest, digest=digest)
+
+    def compute_digest(self, stats=None):
+        return get_digest(
+            self.input_file, self.algorithm, self.comment, **self._hash_options(stats)
+        )
+
+    def matches(self, digests):
+        """
+        Does the digest computed by this validator's algorithm match the
+        expected digest?
+
+        :param digests: A dictionary mapping algorithm-names to digests, as
+        returned by `get_digests`.
+        """
+        return digests[self.algorithm] == self.expected_digest
+
+    @property
+    def read_key(self):
+        """
+        Validators with the same `read_key` hash exactly the same stream of
+        bytes, so their digests can be computed from a single read of the
+        file.
+        """
+        return (os.path.normpath(self.input_file), self.comment, self.compression)
+
+    def _hash_options(self, stats=None):
+        """
+        Those optional arguments to `get_digest` that have been set for this
+        validator (or, for `stats`, for this call).
+        """
+        options = {}
+        if stats is not None:
+            options["stats"] = stats
+        if self.compression is not None:
+            options["compression"] = self.compression
+        if self.cache is not None:
+            options["cache"] = self.cache
+        return options
+
+    @property
+    def is_io_bound(self):
+        """
+        Hashing the whole of a file is limited by the speed of the disk
+        (`hashlib` releases the GIL while it digests large buffers), whereas
+        filtering out comment lines or decompressing in python keeps the
+        python interpreter busy.
+        """
+        return self.comment is None and (
+            self.compression is None or find_parallel_gunzip() is not None
+        )
+
+    def __eq__(self, other):
+        return (
+            self._metadata_equal(other)
+            and self.expected_digest == other.expected_digest
             and self.comment == other.comment
+            and self.compression == other.compression
+        )
+
+
+class Md5sumValidator(DigestValidator):
+    algorithm = "md5"
+    test_type = "md5sum"
+
+    def __init__(self, test_name, input_file, expected_md5sum, **kwargs):
+        super().__init__(test_name, input_file, expected_md5sum, **kwargs)
+
+    @property
+    def expected_md5sum(self):
+        return self.expected_digest
+
+    def compute_digest(self, stats=None):
+        return get_md5sum(self.input_file, self.comment, **self._hash_options(stats))
+
+
+class Sha256Validator(DigestValidator):
+    algorithm = "sha256"
+    test_type = "sha256sum"
+
+    def __init__(self, test_name, input_file, expected_sha256, **kwargs):
+        super().__init__(test_name, input_file, expected_sha256, **kwargs)
+
+
+class Blake2bValidator(DigestValidator):
+    algorithm = "blake2b"
+    test_type = "b2sum"
+
+    def __init__(self, test_name, input_file, expected_blake2b, **kwargs):
+        super().__init__(test_name, input_file, expected_blake2b, **kwargs)
+
+
+class Crc32Validator(DigestValidator):
+    algorithm = "crc32"
+    test_type = "crc32"
+
+    def __init__(self, test_name, input_file, expected_crc32, **kwargs):
+        super().__init__(test_name, input_file, expected_crc32, **kwargs)
+
+
+class Crc32cValidator(DigestValidator):
+    algorithm = "crc32c"
+    test_type = "crc32c"
+
+    def __init__(self, test_name, input_file, expected_crc32c, **kwargs):
+        super().__init__(test_name, input_file, expected_crc32c, **kwargs)
+
+
+class Xxh64Validator(DigestValidator):
+    algorithm = "xxh64"
+    test_type = "xxh64sum"
+
+    def __init__(self, test_name, input_file, expected_xxh64, **kwargs):
+        super().__init__(test_name, input_file, expected_xxh64, **kwargs)
+
+
+class ChunkValidator(FileValidator):
+    """
+    `ChunkValidator` compares the content-defined chunks of a file (see
+    `get_chunk_digests`) to a list of expected chunks. Since an edit to a few
+    lines of a file only changes the chunks that hold those lines, a failing
+    test can report which byte ranges of the file have changed.
+
+    The expected chunks are a list of {offset: ..., length: ..., digest: ...}
+    dictionaries, as returned by `get_chunk_digests`.
+    """
+
+    algorithm = "md5"
+    test_type = "chunks"
+
+    def __init__(self, test_name, input_file, expected_chunks, **kwargs):
+        super().__init__(test_name, input_file, **kwargs)
+        self.expected_chunks = expected_chunks
+
+    def is_valid(self, stats=None):
+        return self.validate(stats).passed
+
+    def validate(self, stats=None):
+        """
+        Apply the test, keeping the byte ranges of the file that have changed.
+
+        :param stats: A `HashStats`; if provided, the bytes read and the time
+        taken are added to it (all of that time is counted as hashing, since
+        the file is split into chunks as it is read).
+        :return: A `ValidationResult`.
+        """
+        start = time.perf_counter()
+        chunks = get_chunk_digests(self.input_file, self.algorithm)
+        if stats is not None:
+            stats.add(_total_length(chunks), 0.0, time.perf_counter() - start)
+
+        changed_ranges = find_changed_ranges(self.expected_chunks, chunks)
+        return self.make_result(
+            _chunk_keys(chunks) == _chunk_keys(self.expected_chunks),
+            changed_ranges=changed_ranges,
         )
 
+    @property
+    def read_key(self):
+        # Chunk boundaries depend on the lines of the file, so the read can't
+        # be shared with the validators that hash the whole file
+        return ("chunks", self.test_name)
+
+    @property
+    def is_io_bound(self):
+        # every line of the file is examined in python
+        return False
+
+    def __eq__(self, other):
+        return self._metadata_equal(other) and _chunk_keys(
+            self.expected_chunks
+        ) == _chunk_keys(other.expected_chunks)
+
+
+def mtimes_match(observed, expected):
+    """
+    Compare a file's mtime to an expected value. An integer `expected` value
+    matches any mtime within that second (as reported by `stat -c %Y`).
+    """
+    if isinstance(expected, int):
+        return int(observed) == expected
+    return abs(observed - expected) <= MTIME_TOLERANCE
+
+
+# The validator class that is used for a test, given the `expected_*` key that
+# is present in the test's definition
+VALIDATOR_CLASSES = {
+    "expected_md5sum": Md5sumValidator,
+    "expected_sha256": Sha256Validator,
+    "expected_blake2b": Blake2bValidator,
+    "expected_crc32": Crc32Validator,
+    "expected_crc32c": Crc32cValidator,
+    "expected_xxh64": Xxh64Validator,
+    "expected_chunks": ChunkValidator,
+}
 
-def get_md5sum(filepath, comment=None):
+
+def get_md5sum(filepath, comment=None, cache=None, compression=None, stats=None):
     """
     Compute the md5 sum for a file.
     If `comment` is specified, ignore all lines of the file that start with
@@ -30,19 +531,424 @@ def get_md5sum(filepath, comment=None):
     :param filepath: a path to a file, a string.
     :param comment: the comment character for the file; all lines that start
     with this character will be disregarded.
+    :param cache: a `HashCache`; if provided, a cached md5sum is returned when
+    the file is unchanged, and any newly computed md5sum is added to the cache.
+    :param compression: if "gzip", the md5sum of the decompressed contents of
+    the file is computed.
+    :param stats: a `HashStats`; if provided, the bytes read and the time spent
+    reading / hashing the file are added to it.
 
     :return: the md5sum for the file, as a string
     """
-    my_predicate = lambda x: True
-    if comment is not None:
-        my_predicate = lambda x: not x.startswith(comment)
+    return get_digest(filepath, "md5", comment, cache, compression, stats)
+
+
+def get_digest(
+    filepath, algorithm="md5", comment=None, cache=None, compression=None, stats=None
+):
+    """
+    Compute the digest of a file using one of the `HASH_CONSTRUCTORS`.
+    If `comment` is specified, ignore all lines of the file that start with
+    this comment-character.
+
+    :param filepath: a path to a file, a string.
+    :param algorithm: the name of the hash algorithm, a key of
+    `HASH_CONSTRUCTORS`.
+    :param comment: the comment character for the file; all lines that start
+    with this character will be disregarded.
+    :param cache: a `HashCache`; if provided, a cached digest is returned when
+    the file is unchanged, and any newly computed digest is added to the cache.
+    :param compression: if "gzip", the digest of the decompressed contents of
+    the file is computed.
+    :param stats: a `HashStats`; if provided, the bytes read and the time spent
+    reading / hashing the file are added to it.
+
+    :return: the digest for the file, as a hexadecimal string
+    """
+    digests = get_digests(filepath, [algorithm], comment, cache, compression, stats)
+    return digests[algorithm]
+
+
+def get_digests(
+    filepath, algorithms, comment=None, cache=None, compression=None, stats=None
+):
+    """
+    Compute several digests of a file while reading the file only once.
+    If `comment` is specified, ignore all lines of the file that start with
+    this comment-character.
+
+    The file is read in binary mode: without a `comment` it is hashed in large
+    fixed-size blocks; with a `comment`, the lines are compared to the comment
+    as bytes, so nothing is decoded / re-encoded. An uncompressed file with a
+    `comment` is memory-mapped, and the spans between comment lines are found
+    with a byte search and hashed in place, rather than line by line.
+
+    :param filepath: a path to a file, a string.
+    :param algorithms: the names of the hash algorithms, keys of
+    `HASH_CONSTRUCTORS`.
+    :param comment: the comment character for the file; all lines that start
+    with this character will be disregarded.
+    :param cache: a `HashCache`; if provided, cached digests are returned when
+    the file is unchanged, and only the missing digests are computed (and then
+    added to the cache).
+    :param compression: if "gzip", the file is decompressed as it is read and
+    the digests are computed on the decompressed contents (no temporary file
+    is written). The multithreaded `pigz` is used for decompression if it is
+    available.
+    :param stats: a `HashStats`; if provided, the bytes read and the time spent
+    reading / hashing the file are added to it (nothing is read for digests
+    that are found in the `cache`).
+
+    :return: a dictionary mapping each algorithm to the digest for the file,
+    as a hexadecimal string
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(
+            "`compression` should be one of {}, not `{}`".format(
+                COMPRESSIONS, compression
+            )
+        )
+    if cache is not None:
+        return _get_digests_via_cache(
+            filepath, algorithms, comment, cache, compression, stats
+        )
+
+    hashes = {algorithm: HASH_CONSTRUCTORS[algorithm]() for algorithm in algorithms}
+    if stats is None:
+        stats = HashStats()
+    with open_input(filepath, compression, raw=True) as f:
+        if comment is None:
+            _update_hashes_from_blocks(hashes.values(), f, stats)
+        elif compression is None:
+            _update_hashes_from_mapped_file(
+                hashes.values(), f, comment.encode("utf-8"), stats
+            )
+        else:
+            _update_hashes_from_lines(
+                hashes.values(), f, comment.encode("utf-8"), stats
+            )
+
+    return {algorithm: my_hash.hexdigest() for algorithm, my_hash in hashes.items()}
+
+
+def _get_digests_via_cache(filepath, algorithms, comment, cache, compression, stats):
+    def digest_type(algorithm):
+        description = "{} comment={!r}".format(algorithm, comment)
+        if compression is not None:
+            description += " compression={}".format(compression)
+        return description
+
+    stat_result = os.stat(filepath)
+    digests = {}
+    for algorithm in algorithms:
+        digest = cache.lookup(filepath, digest_type(algorithm), stat_result)
+        if digest is not None:
+            digests[algorithm] = digest
+
+    missing = [algorithm for algorithm in algorithms if algorithm not in digests]
+    if missing:
+        computed = get_digests(
+            filepath, missing, comment, compression=compression, stats=stats
+        )
+        for algorithm, digest in computed.items():
+            cache.store(filepath, digest_type(algorithm), digest, stat_result)
+        digests.update(computed)
+
+    return digests
+
+
+@contextmanager
+def open_input(filepath, compression=None, raw=False):
+    """
+    Open a file for reading as a binary stream; decompressing it on the fly if
+    `compression` is "gzip".
+
+    If `raw` is set, an uncompressed file is opened without a read-buffer;
+    this avoids a copy when the caller reads the file in large blocks, but
+    makes reading the file line-by-line very slow.
+    """
+    if compression is None:
+        with open(filepath, "rb", buffering=0 if raw else -1) as f:
+            yield f
+        return
+
+    with open(filepath, "rb") as raw:
+        gunzip = find_parallel_gunzip()
+        if gunzip is None:
+            with gzip.GzipFile(fileobj=raw) as f:
+                yield f
+            return
+
+        process = subprocess.Popen(gunzip, stdin=raw, stdout=subprocess.PIPE)
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            raise OSError(
+                "`{}` could not decompress `{}`".format(" ".join(gunzip), filepath)
+            )
+
+
+def find_parallel_gunzip():
+    """
+    The command for decompressing a gzip stream from stdin to stdout with a
+    multithreaded decompressor; or None if no such decompressor is available.
+    """
+    if shutil.which(PARALLEL_GUNZIP) is None:
+        return None
+    return [PARALLEL_GUNZIP, "-dc"]
+
+
+def _update_hashes_from_blocks(hashes, f, stats, block_size=BLOCK_SIZE):
+    """
+    Feed the whole of a binary file-object into some hashes, one block at a
+    time. A single buffer is reused for every block. The bytes read, and the
+    time spent reading / hashing them, are added to `stats`.
+    """
+    clock = time.perf_counter
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    bytes_read, io_seconds, hash_seconds = 0, 0.0, 0.0
+
+    started = clock()
+    n_bytes = f.readinto(buffer)
+    while n_bytes:
+        read = clock()
+        for my_hash in hashes:
+            my_hash.update(view[:n_bytes])
+        hashed = clock()
+        bytes_read += n_bytes
+        io_seconds += read - started
+        hash_seconds += hashed - read
+
+        started = hashed
+        n_bytes = f.readinto(buffer)
+    io_seconds += clock() - started
+    stats.add(bytes_read, io_seconds, hash_seconds)
+
+
+def _update_hashes_from_mapped_file(hashes, f, comment, stats, block_size=BLOCK_SIZE):
+    """
+    Feed those lines of a file that do not start with `comment` (a bytes
+    object) into some hashes. The file is memory-mapped and each span of
+    non-comment lines is fed to the hashes as slices of the map (at most
+    `block_size` bytes at a time), so no bytes are copied and no object is
+    made for each line.
+
+    The pages of the file are read as they are hashed, so all of the time is
+    added to `stats` as hashing time.
+    """
+    started = time.perf_counter()
+    size = os.fstat(f.fileno()).st_size
+    if size:
+        # an empty file can't be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for start, end in _iter_uncommented_spans(mapped, comment):
+                    for block_start in range(start, end, block_size):
+                        block_end = min(end, block_start + block_size)
+                        with view[block_start:block_end] as block:
+                            for my_hash in hashes:
+                                my_hash.update(block)
+    stats.add(size, 0.0, time.perf_counter() - started)
+
+
+def _iter_uncommented_spans(data, comment):
+    """
+    Find the spans of `data` (a bytes-like object with a `find` method) that
+    hold the lines that do not start with `comment`.
+
+    :return: an iterator over (start, end) offsets; consecutive non-comment
+    lines are merged into a single span.
+    """
+    marker = b"\n" + comment
+    size = len(data)
+    position = 0
+    while position < size:
+        if data.find(comment, position, position + len(comment)) == position:
+            newline = data.find(b"\n", position)
+            if newline == -1:
+                return
+            position = newline + 1
+        else:
+            next_comment = data.find(marker, position)
+            if next_comment == -1:
+                yield position, size
+                return
+            yield position, next_comment + 1
+            position = next_comment + 1
+
+
+def _update_hashes_from_lines(hashes, f, comment, stats, block_size=BLOCK_SIZE):
+    """
+    Feed those lines of a binary file-object that do not start with `comment`
+    (a bytes object) into some hashes. The lines are read about `block_size`
+    bytes at a time, and the retained lines of each block are joined so that
+    each hash is updated once per block rather than once per line. The bytes
+    read (including those of comment lines), and the time spent reading /
+    hashing them, are added to `stats`.
+    """
+    clock = time.perf_counter
+    bytes_read, io_seconds, hash_seconds = 0, 0.0, 0.0
+
+    started = clock()
+    lines = f.readlines(block_size)
+    while lines:
+        read = clock()
+        data = b"".join(line for line in lines if not line.startswith(comment))
+        for my_hash in hashes:
+            my_hash.update(data)
+        hashed = clock()
+        bytes_read += sum(map(len, lines))
+        io_seconds += read - started
+        hash_seconds += hashed - read
+
+        started = hashed
+        lines = f.readlines(block_size)
+    io_seconds += clock() - started
+    stats.add(bytes_read, io_seconds, hash_seconds)
+
+
+def get_chunk_digests(filepath, algorithm="md5"):
+    """
+    Split a file into content-defined chunks and compute the digest of each.
+
+    Chunk boundaries are always at the end of a line and depend only on the
+    contents of the lines since the previous boundary (see `CHUNK_MIN_SIZE`,
+    `CHUNK_MAX_SIZE` and `CHUNK_BOUNDARY_MASK`). So when a few lines of a file
+    are edited, inserted or removed, only the chunks that hold those lines
+    change; the chunks after them are the same, at a shifted offset.
+
+    :param filepath: a path to a file, a string.
+    :param algorithm: the name of the hash algorithm for the chunks, a key of
+    `HASH_CONSTRUCTORS`.
+    :return: a list of dictionaries, one per chunk, with keys `offset`,
+    `length` and `digest`.
+    """
+    with open(filepath, "rb") as f:
+        return list(_iter_chunk_digests(f, algorithm))
+
+
+def update_chunk_digests(filepath, chunks, start, end, algorithm="md5"):
+    """
+    Update the chunk digests of a file after the bytes in the range [start,
+    end) of the file (as it is now) have been edited; only the chunks around
+    that range are read and hashed. This is for callers that know which bytes
+    they have edited (eg, a script that rewrites a few rows of a table in
+    place); `ChunkValidator` and `tree_manifest.py` can't know where a file
+    has changed without reading it, so they chunk the whole file.
+
+    The file is re-chunked from the start of the chunk that held `start`,
+    until a chunk boundary at or after `end` coincides with one of the old
+    boundaries. The chunks after that boundary hold the same bytes as before,
+    so they are carried forward with their offsets shifted by the change in
+    the size of the file.
+
+    :param filepath: a path to a file, a string.
+    :param chunks: the chunks of the file before it was edited, as returned by
+    `get_chunk_digests`.
+    :param start: the offset of the first edited byte in the file.
+    :param end: the offset of the first byte after the edit in the file.
+    :param algorithm: the hash algorithm that was used for `chunks`.
+    :return: a list of chunks, as returned by `get_chunk_digests`.
+    """
+    shift = os.stat(filepath).st_size - _total_length(chunks)
+    # the final chunk ends at the end of the file rather than at a
+    # content-defined boundary, so it is never kept
+    kept = [
+        chunk for chunk in chunks[:-1] if chunk["offset"] + chunk["length"] <= start
+    ]
+    resume = _total_length(kept)
+
+    # the old chunk boundaries after the edit, at their new offsets
+    old_ends = {}
+    for index, chunk in enumerate(chunks):
+        new_end = chunk["offset"] + chunk["length"] + shift
+        if new_end >= end:
+            old_ends[new_end] = index
+
+    updated = []
+    with open(filepath, "rb") as f:
+        for chunk in _iter_chunk_digests(f, algorithm, resume):
+            updated.append(chunk)
+            chunk_end = chunk["offset"] + chunk["length"]
+            if chunk_end >= end and chunk_end in old_ends:
+                carried = [
+                    dict(old, offset=old["offset"] + shift)
+                    for old in chunks[old_ends[chunk_end] + 1 :]
+                ]
+                return kept + updated + carried
+    return kept + updated
+
+
+def find_changed_ranges(expected_chunks, observed_chunks):
+    """
+    Find the byte ranges of a file whose chunks aren't among the expected
+    chunks. Adjacent ranges are merged.
+
+    :param expected_chunks: chunks, as returned by `get_chunk_digests`.
+    :param observed_chunks: the current chunks of the file.
+    :return: a list of [start, end) pairs of offsets into the current file. If
+    the chunks differ only because some expected chunks were removed, this is
+    an empty range at the first offset where the chunks differ.
+    """
+    known = {(chunk["length"], chunk["digest"]) for chunk in expected_chunks}
+    ranges = []
+    for chunk in observed_chunks:
+        if (chunk["length"], chunk["digest"]) in known:
+            continue
+        chunk_start = chunk["offset"]
+        chunk_end = chunk_start + chunk["length"]
+        if ranges and ranges[-1][1] == chunk_start:
+            ranges[-1][1] = chunk_end
+        else:
+            ranges.append([chunk_start, chunk_end])
+
+    if not ranges and _chunk_keys(expected_chunks) != _chunk_keys(observed_chunks):
+        offset = 0
+        for expected, observed in zip(expected_chunks, observed_chunks):
+            if _chunk_keys([expected]) != _chunk_keys([observed]):
+                break
+            offset = observed["offset"] + observed["length"]
+        ranges.append([offset, offset])
+    return ranges
+
+
+def _iter_chunk_digests(f, algorithm, offset=0):
+    f.seek(offset)
+    for chunk in _iter_chunks(f):
+        my_hash = HASH_CONSTRUCTORS[algorithm]()
+        my_hash.update(chunk)
+        yield {"offset": offset, "length": len(chunk), "digest": my_hash.hexdigest()}
+        offset += len(chunk)
+
+
+def _iter_chunks(f):
+    """
+    Split the lines of a binary file-object into content-defined chunks.
+    """
+    lines = []
+    size = 0
+    for line in f:
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_MAX_SIZE or (
+            size >= CHUNK_MIN_SIZE and not zlib.crc32(line) & CHUNK_BOUNDARY_MASK
+        ):
+            yield b"".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b"".join(lines)
+
+
+def _chunk_keys(chunks):
+    return [(chunk["offset"], chunk["length"], chunk["digest"]) for chunk in chunks]
 
-    try:
-        my_hash = hashlib.md5()
-        with open(filepath, "r") as f:
-            for line in filter(my_predicate, f):
-                my_hash.update(line.encode("utf-8"))
-    except:
-        raise
 
-    return my_hash.hexdigest()
+def _total_length(chunks):
+    return sum(chunk["length"] for chunk in chunks)
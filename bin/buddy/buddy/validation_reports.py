@@ -0,0 +1,192 @@
+"""
+Writers for streaming reports of validation results.
+
+Each result is written (and flushed) as soon as it is available, so that the
+progress of a long validation run can be followed with `tail -f` and the
+report can be loaded into other tools without re-running the validation.
+"""
+
+import json
+import time
+
+# Columns of a TSV report; these are the keys of `ValidationResult.to_dict()`
+REPORT_COLUMNS = [
+    "test_name",
+    "test_type",
+    "input_file",
+    "passed",
+    "digest",
+    "bytes_read",
+    "seconds",
+    "throughput_mb_per_s",
+    "io_seconds",
+    "hash_seconds",
+    "changed_ranges",
+]
+
+
+class JsonLinesReportWriter:
+    """
+    Writes one JSON object per validation result, one result per line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, result):
+        write_line(self.stream, json.dumps(result.to_dict()))
+
+
+class TsvReportWriter:
+    """
+    Writes one tab-separated row per validation result, after a header row.
+    Missing values are written as "NA".
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        write_line(self.stream, "\t".join(REPORT_COLUMNS))
+
+    def write(self, result):
+        row = result.to_dict()
+        if row["changed_ranges"] is not None:
+            row["changed_ranges"] = format_changed_ranges(row["changed_ranges"])
+        write_line(
+            self.stream,
+            "\t".join(format_tsv_value(row[column]) for column in REPORT_COLUMNS),
+        )
+
+
+class MultiReportWriter:
+    """
+    Passes each validation result to several report writers.
+    """
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write(self, result):
+        for writer in self.writers:
+            writer.write(result)
+
+
+class TimingSummary:
+    """
+    Collects the timings of validation results, so that they can be
+    summarised once the validation has finished: the total number of bytes
+    read, the overall throughput, the time spent on I/O versus hashing, and
+    the slowest files.
+
+    A `TimingSummary` can be used as a report writer; the wall-clock time of
+    the run is measured from the creation of the summary to the last result.
+    """
+
+    def __init__(self, n_slowest=5):
+        self.n_slowest = n_slowest
+        self.results = []
+        self.started = time.perf_counter()
+        self.finished = self.started
+
+    def write(self, result):
+        self.results.append(result)
+        self.finished = time.perf_counter()
+
+    @property
+    def wall_seconds(self):
+        return self.finished - self.started
+
+    @property
+    def bytes_read(self):
+        return sum(result.bytes_read or 0 for result in self.results)
+
+    @property
+    def io_seconds(self):
+        return sum(result.io_seconds or 0.0 for result in self.results)
+
+    @property
+    def hash_seconds(self):
+        return sum(result.hash_seconds or 0.0 for result in self.results)
+
+    @property
+    def throughput(self):
+        """
+        Megabytes (1e6 bytes) read per second of wall-clock time, over all
+        files; None if nothing was read.
+        """
+        if not self.bytes_read or not self.wall_seconds:
+            return None
+        return self.bytes_read / self.wall_seconds / 1e6
+
+    def slowest(self):
+        """
+        The `n_slowest` results that took the longest, slowest first.
+        """
+        timed = [result for result in self.results if result.seconds]
+        return sorted(timed, key=lambda result: result.seconds, reverse=True)[
+            : self.n_slowest
+        ]
+
+    def format(self):
+        """
+        Make a tab-separated summary: one line for the totals and one line for
+        each of the slowest files.
+        """
+        lines = [
+            "\t".join(
+                [
+                    "[TIMINGS]",
+                    "files_read:{}".format(
+                        sum(1 for result in self.results if result.bytes_read)
+                    ),
+                    "bytes_read:{}".format(self.bytes_read),
+                    "wall_seconds:{}".format(format_number(self.wall_seconds)),
+                    "throughput_mb_per_s:{}".format(format_number(self.throughput)),
+                    "io_seconds:{}".format(format_number(self.io_seconds)),
+                    "hash_seconds:{}".format(format_number(self.hash_seconds)),
+                ]
+            )
+        ]
+        for result in self.slowest():
+            lines.append(
+                "\t".join(
+                    [
+                        "[SLOWEST]",
+                        "test_name:{}".format(result.test_name),
+                        "input_file:{}".format(result.input_file),
+                        "seconds:{}".format(format_number(result.seconds)),
+                        "throughput_mb_per_s:{}".format(
+                            format_number(result.throughput)
+                        ),
+                    ]
+                )
+            )
+        return "\n".join(lines)
+
+
+def format_number(value):
+    if value is None:
+        return "NA"
+    return "{:.3f}".format(value)
+
+
+def write_line(stream, line):
+    stream.write(line + "\n")
+    stream.flush()
+
+
+def format_changed_ranges(changed_ranges):
+    """
+    Format the byte ranges of a file that have changed as "start-end,..."
+    """
+    return ",".join("{}-{}".format(start, end) for start, end in changed_ranges)
+
+
+def format_tsv_value(value):
+    if value is None:
+        return "NA"
+    if isinstance(value, bool):
+        return "PASS" if value else "FAIL"
+    return str(value)
+
+
+REPORT_WRITERS = {"jsonl": JsonLinesReportWriter, "tsv": TsvReportWriter}
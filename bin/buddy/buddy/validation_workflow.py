@@ -1,5 +1,137 @@
-from buddy.validation_classes import Md5sumValidator
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+from buddy.async_validation import iter_group_results_async
+from buddy.validation_classes import (
+    HASH_CONSTRUCTORS,
+    VALIDATOR_CLASSES,
+    HashStats,
+    MetadataValidator,
+    get_digests,
+)
 from buddy.file_utils import read_yaml
+from buddy.validation_reports import format_changed_ranges
+
+# "full": check the stat metadata and the digests of the files
+# "quick": only check the existence and stat metadata of the files
+VALIDATION_LEVELS = ("full", "quick")
+
+# "pool": validate the files on a pool of threads / processes
+# "async": validate the files from an asyncio event loop, adapting the number
+# of files in flight to the throughput (see `buddy.async_validation`)
+RUNNERS = ("pool", "async")
+
+
+def _validate_group(validators, instrument=False):
+    """
+    Apply a group of validators that all hash the same stream of bytes (see
+    `read_key`), reading the file only once.
+
+    This is a module-level function so that the call can be pickled and sent
+    to a worker process.
+
+    :param validators: A list of Validator objects with a common `read_key`.
+    :param instrument: Measure the bytes read, and the time spent on I/O and
+    on hashing, rather than taking the number of bytes from the file's size.
+    :return: A list of `ValidationResult`s. The single pass over the file is
+    attributed to the first result: the time taken and the number of bytes
+    read are zero for the remaining results, so that these can be summed over
+    all results.
+    """
+    stats = HashStats() if instrument else None
+    start = time.perf_counter()
+    if len(validators) == 1:
+        results = [validators[0].validate(stats)]
+    else:
+        first = validators[0]
+        digests = get_digests(
+            first.input_file,
+            sorted({v.algorithm for v in validators}),
+            first.comment,
+            **first._hash_options(stats)
+        )
+        results = [v.result_from_digests(digests) for v in validators]
+    seconds = time.perf_counter() - start
+
+    first_result = results[0]
+    first_result.seconds = seconds
+    if stats is not None:
+        first_result.io_seconds = stats.io_seconds
+        first_result.hash_seconds = stats.hash_seconds
+        if first_result.bytes_read is None:
+            first_result.bytes_read = stats.bytes_read
+    elif first_result.bytes_read is None:
+        first_result.bytes_read = _size_on_disk(first_result.input_file)
+
+    for result in results[1:]:
+        result.seconds = 0.0
+        result.bytes_read = 0
+        if stats is not None:
+            result.io_seconds = 0.0
+            result.hash_seconds = 0.0
+    return results
+
+
+def _size_on_disk(filepath):
+    try:
+        return os.stat(filepath).st_size
+    except OSError:
+        return None
+
+
+def group_by_read_key(validators):
+    """
+    Group together the validators that hash the same stream of bytes.
+
+    :param validators: A dictionary of Validator objects.
+    :return: A list of lists of test-names; the groups are ordered by their
+    first appearance in `validators`.
+    """
+    groups = {}
+    for name, validator in validators.items():
+        groups.setdefault(validator.read_key, []).append(name)
+    return list(groups.values())
+
+
+def _iter_group_results(validator_groups, n_workers, executor_class, instrument=False):
+    """
+    Apply each group of validators, yielding (index of the group, list of
+    results) as each group completes. Any groups that have not started when
+    the generator is closed are cancelled.
+    """
+    if n_workers <= 1 or len(validator_groups) <= 1:
+        for index, group in enumerate(validator_groups):
+            yield index, _validate_group(group, instrument)
+        return
+
+    with executor_class(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(_validate_group, group, instrument): index
+            for index, group in enumerate(validator_groups)
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def choose_executor_class(validators):
+    """
+    Threads are sufficient when every validator is I/O-bound; otherwise the
+    validators are spread over processes so that they aren't serialised by the
+    GIL.
+
+    :param validators: An iterable of Validator objects.
+    :return: `ThreadPoolExecutor` or `ProcessPoolExecutor`.
+    """
+    if all(v.is_io_bound for v in validators):
+        return ThreadPoolExecutor
+    return ProcessPoolExecutor
 
 
 class ValidationWorkflow:
@@ -38,22 +170,224 @@ class ValidationWorkflow:
         """
         return cls.from_yaml_dict(read_yaml(yaml_file))
 
-    def get_failing_validators(self):
-        return {k: v for k, v in self.validators.items() if not v.is_valid()}
-
-    def format_failure_report(self):
-        def format_single_failure(validator):
-            return "\t".join(
-                [
-                    "[FAILURE]",
-                    "test_name:{}".format(validator.test_name),
-                    "test_type:{}".format(validator.test_type),
-                    "input_file:{}".format(validator.input_file),
-                ]
+    def use_hash_cache(self, cache):
+        """
+        Make every validator in the workflow look up / store its digests in a
+        `HashCache`.
+        """
+        for validator in self.validators.values():
+            validator.cache = cache
+
+    def run_validators(self, report_writer=None, **kwargs):
+        """
+        Apply each validation test. The keyword arguments are passed to
+        `iter_results`.
+
+        :param report_writer: An object with a `write(result)` method (see
+        `buddy.validation_reports`); each `ValidationResult` is passed to this
+        as soon as it is available.
+        :return: A dictionary mapping each test-name to a bool (did the test
+        pass?). The order matches that of `self.validators`. If `fail_fast` is
+        set, tests that were not ran are absent.
+        """
+        results = self._collect_results(report_writer, **kwargs)
+        return {name: result.passed for name, result in results.items()}
+
+    def _collect_results(self, report_writer=None, **kwargs):
+        results = {}
+        for name, result in self._iter_named_results(**kwargs):
+            if report_writer is not None:
+                report_writer.write(result)
+            results[name] = result
+        return {name: results[name] for name in self.validators if name in results}
+
+    def iter_results(
+        self,
+        n_workers=1,
+        fail_fast=False,
+        prefilter=False,
+        level="full",
+        instrument=False,
+        runner="pool",
+    ):
+        """
+        Apply each validation test, yielding a `ValidationResult` for each test
+        as soon as it completes (so the order may differ from that of
+        `self.validators`).
+
+        Validators that refer to the same `input_file` (and comment character)
+        are grouped, so that each file is read only once, however many digests
+        are computed for it.
+
+        :param n_workers: The number of files that may be validated
+        concurrently. If this is 1, the files are validated one after another
+        in the current process.
+        :param fail_fast: Stop after the first failing test: no further files
+        are hashed (although any files that are being hashed by other workers
+        at that point are completed).
+        :param prefilter: Before any file is hashed, fail those tests whose
+        file is missing or does not have the `expected_size` / `expected_mtime`,
+        and don't hash their files. This is always done when `fail_fast` is
+        set. (Without `prefilter`, those tests still fail, but their files are
+        hashed.)
+        :param level: "full" or "quick". At the "quick" level, only the
+        metadata checks are ran and no file is hashed.
+        :param instrument: Record the bytes read, and the time spent on I/O and
+        on hashing, in the `io_seconds` / `hash_seconds` of each result (see
+        `HashStats`). When several digests are computed from a single read of
+        a file, the read is attributed to the first of those results.
+        :param runner: "pool" or "async". The "async" runner keeps up to
+        `n_workers` files in flight from an asyncio event loop, and adapts the
+        number of files in flight to the observed throughput; this suits
+        high-latency network file systems.
+        """
+        for _, result in self._iter_named_results(
+            n_workers=n_workers,
+            fail_fast=fail_fast,
+            prefilter=prefilter,
+            level=level,
+            instrument=instrument,
+            runner=runner,
+        ):
+            yield result
+
+    def _iter_named_results(
+        self,
+        n_workers=1,
+        fail_fast=False,
+        prefilter=False,
+        level="full",
+        instrument=False,
+        runner="pool",
+    ):
+        if level not in VALIDATION_LEVELS:
+            raise ValueError(
+                "`level` should be one of {}, not `{}`".format(VALIDATION_LEVELS, level)
+            )
+        if runner not in RUNNERS:
+            raise ValueError(
+                "`runner` should be one of {}, not `{}`".format(RUNNERS, runner)
+            )
+
+        if level == "quick":
+            for name, passed in self.check_metadata().items():
+                yield name, self.validators[name].make_result(passed, bytes_read=0)
+            return
+
+        prefailed = set()
+        if prefilter or fail_fast:
+            metadata = self.check_metadata()
+            for name, passed in metadata.items():
+                if not passed:
+                    prefailed.add(name)
+                    yield name, self.validators[name].make_result(False, bytes_read=0)
+            if fail_fast and prefailed:
+                return
+        else:
+            # The `expected_size` / `expected_mtime` of a test are checked
+            # even when they don't prevent the file from being hashed
+            metadata = self.check_metadata(
+                name
+                for name, validator in self.validators.items()
+                if validator.expected_size is not None
+                or validator.expected_mtime is not None
+            )
+
+        remaining = {k: v for k, v in self.validators.items() if k not in prefailed}
+        name_groups = group_by_read_key(remaining)
+        validator_groups = [
+            [remaining[name] for name in names] for names in name_groups
+        ]
+        if runner == "async":
+            group_results = iter_group_results_async(
+                _validate_group,
+                validator_groups,
+                max_in_flight=n_workers,
+                instrument=instrument,
             )
+        else:
+            group_results = _iter_group_results(
+                validator_groups,
+                n_workers,
+                choose_executor_class(remaining.values()),
+                instrument,
+            )
+        with closing(group_results):
+            for index, results in group_results:
+                for name, result in zip(name_groups[index], results):
+                    result.passed = result.passed and metadata.get(name, True)
+                    yield name, result
+                if fail_fast and not all(result.passed for result in results):
+                    return
+
+    def check_metadata(self, names=None):
+        """
+        Check the existence and stat metadata of the file for every validator
+        (or for those validators in `names`), calling `stat()` only once for
+        each file.
+
+        :return: A dictionary mapping each test-name to a bool (did the
+        metadata checks pass?).
+        """
+        stat_results = {}
+        outcomes = {}
+        if names is None:
+            names = self.validators
+        for name in names:
+            validator = self.validators[name]
+            path = os.path.normpath(validator.input_file)
+            if path not in stat_results:
+                try:
+                    stat_results[path] = os.stat(path)
+                except FileNotFoundError:
+                    stat_results[path] = None
+            stat_result = stat_results[path]
+            outcomes[name] = stat_result is not None and validator.check_metadata(
+                stat_result
+            )
+        return outcomes
+
+    def get_failing_validators(self, **kwargs):
+        """
+        Find the validation tests that fail. The keyword arguments are passed
+        to `run_validators`.
 
-        failures = self.get_failing_validators()
-        return "\n".join(map(format_single_failure, failures.values()))
+        :return: A dictionary containing those validators that failed.
+        """
+        outcomes = self.run_validators(**kwargs)
+        return {
+            k: v
+            for k, v in self.validators.items()
+            if k in outcomes and not outcomes[k]
+        }
+
+    def format_failure_report(self, **kwargs):
+        """
+        Make a tab-separated report of the failing validation tests; one line
+        per failure. The keyword arguments are passed to `run_validators`.
+
+        For tests that compare the chunks of a file, the byte ranges that have
+        changed are included as `changed_ranges:start-end,...`.
+        """
+
+        def format_single_failure(result):
+            fields = [
+                "[FAILURE]",
+                "test_name:{}".format(result.test_name),
+                "test_type:{}".format(result.test_type),
+                "input_file:{}".format(result.input_file),
+            ]
+            if result.changed_ranges:
+                fields.append(
+                    "changed_ranges:{}".format(
+                        format_changed_ranges(result.changed_ranges)
+                    )
+                )
+            return "\t".join(fields)
+
+        results = self._collect_results(**kwargs)
+        failures = [result for result in results.values() if not result.passed]
+        return "\n".join(map(format_single_failure, failures))
 
     @staticmethod
     def parse_validator_details(yaml_dictionary):
@@ -62,6 +396,17 @@ class ValidationWorkflow:
         objects that can be used to apply those tests.
         - To compare md5sum between a file and a string, one of the keys must
         be `expected_md5sum` and another must be `input_file`.
+        - Other digests can be compared by using one of the keys
+        `expected_sha256`, `expected_blake2b`, `expected_crc32`,
+        `expected_crc32c` or `expected_xxh64` instead of `expected_md5sum`
+        (`crc32c` and `xxh64` require the optional `crc32c` and `xxhash`
+        packages).
+        - The optional keys `expected_size` (bytes) and `expected_mtime`
+        (seconds since the epoch) are checked against the file's stat
+        metadata. A test may define these without any digest.
+        - `expected_chunks` (a list of {offset, length, digest} dictionaries,
+        see `get_chunk_digests`) compares the content-defined chunks of the
+        file, so that a failing test reports the byte ranges that changed.
 
         :param yaml_dictionary: A dictionary that defines a set of validation
         tests. This should be of the form: {test1: {input_file: ...,
@@ -71,7 +416,39 @@ class ValidationWorkflow:
         """
 
         validators = {
-            k: Md5sumValidator(test_name=k, **v) for k, v in yaml_dictionary.items()
+            k: ValidationWorkflow.select_validator_class(k, v)(test_name=k, **v)
+            for k, v in yaml_dictionary.items()
         }
 
         return validators
+
+    @staticmethod
+    def select_validator_class(test_name, test_details):
+        """
+        Choose the Validator class for a validation-test definition, based on
+        the `expected_*` digest that the definition contains.
+
+        :param test_name: The name of the validation test.
+        :param test_details: The dictionary that defines the validation test.
+        :return: A Validator class.
+        """
+        digest_keys = [k for k in test_details if k in VALIDATOR_CLASSES]
+        metadata_keys = {"expected_size", "expected_mtime"}.intersection(test_details)
+        if not digest_keys and metadata_keys:
+            return MetadataValidator
+        if len(digest_keys) != 1:
+            raise ValueError(
+                "Test `{}` should define exactly one of {}".format(
+                    test_name, sorted(VALIDATOR_CLASSES)
+                )
+            )
+
+        validator_class = VALIDATOR_CLASSES[digest_keys[0]]
+        if validator_class.algorithm not in HASH_CONSTRUCTORS:
+            raise ValueError(
+                "Test `{}` uses the `{}` algorithm, but the package that "
+                "provides it is not installed".format(
+                    test_name, validator_class.algorithm
+                )
+            )
+        return validator_class
@@ -0,0 +1,71 @@
+import gzip
+import json
+import os
+import pytest
+import sh
+
+from buddy.benchmark_validation import (
+    generate_file,
+    parse_size,
+    run_workflow,
+)
+
+# user
+# .. can compare the speed and memory use of the validation modes between
+#    versions of the code
+
+
+class TestParseSize(object):
+    def test_sizes_use_decimal_units(self):
+        assert parse_size("512") == 512
+        assert parse_size("1KB") == 1000
+        assert parse_size("100mb") == 100 * 10 ** 6
+        assert parse_size("10GB") == 10 ** 10
+
+    def test_unknown_units_raise(self):
+        with pytest.raises(ValueError):
+            parse_size("10 furlongs")
+
+
+class TestGenerateFile(object):
+    def test_files_have_the_requested_size_and_comments(self, tmpdir):
+        with sh.pushd(tmpdir):
+            generate_file("plain.tsv", 3 * 10 ** 6, layout="interleaved")
+            assert os.path.getsize("plain.tsv") == 3 * 10 ** 6
+            with open("plain.tsv", "rb") as f:
+                lines = f.read().splitlines()
+            assert lines[0].startswith(b"#")
+            assert b"# comment line" in lines[200]
+            assert not lines[201].startswith(b"#")
+
+            generate_file("compressed.tsv.gz", 5000, compression="gzip")
+            with gzip.open("compressed.tsv.gz", "rb") as f:
+                assert len(f.read()) == 5000
+
+    def test_small_files_are_not_larger_than_requested(self, tmpdir):
+        with sh.pushd(tmpdir):
+            generate_file("small.tsv", 100, layout="header")
+            assert os.path.getsize("small.tsv") == 100
+
+
+class TestBenchmarkSmoke(object):
+    def test_results_are_written_as_json(self, tmpdir):
+        with sh.pushd(tmpdir):
+            run_workflow(
+                "benchmark.json",
+                label="smoke-test",
+                data_dir=".",
+                sizes=[10000],
+                layouts=["header"],
+                modes=["md5", "md5-comment"],
+            )
+            with open("benchmark.json") as f:
+                report = json.load(f)
+
+            assert report["label"] == "smoke-test"
+            assert [r["mode"] for r in report["results"]] == ["md5", "md5-comment"]
+            for result in report["results"]:
+                assert result["size_bytes"] == 10000
+                assert result["throughput_mb_per_s"] > 0
+                assert result["peak_rss_kb"] > 0
+            assert os.listdir(".") == ["benchmark.json"]
@@ -0,0 +1,201 @@
+import errno
+import os
+import sh
+import pytest
+
+import buddy.copy_files
+
+from buddy.copy_files import (
+    COPY_ROUTES,
+    copy_dir,
+    copy_file,
+    copy_in_parallel,
+    partial_path,
+)
+
+
+def write_file(path, contents):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(contents)
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def unsupported(*args, **kwargs):
+    raise OSError(errno.EXDEV, "not supported here")
+
+
+class TestCopyFile(object):
+    def test_copy_contents_and_mode(self, tmpdir):
+        with sh.pushd(tmpdir):
+            contents = os.urandom(3 * 1024 * 1024 + 17)
+            write_file("original", contents)
+            os.chmod("original", 0o750)
+            route = copy_file("original", "copy")
+            assert route in dict(COPY_ROUTES)
+            assert read_file("copy") == contents
+            assert os.stat("copy").st_mode & 0o777 == 0o750
+            assert sorted(os.listdir(".")) == ["copy", "original"]
+
+    def test_existing_copy_is_not_overwritten(self, tmpdir):
+        with sh.pushd(tmpdir):
+            write_file("original", b"new")
+            write_file("copy", b"old")
+            assert copy_file("original", "copy") is None
+            assert read_file("copy") == b"old"
+
+    @pytest.mark.parametrize(
+        "broken_routes, expected_route",
+        [
+            (["reflink"], "copy_file_range"),
+            (["reflink", "copy_file_range"], "sendfile"),
+            (["reflink", "copy_file_range", "sendfile"], "read_write"),
+        ],
+    )
+    def test_fall_back_to_slower_routes(
+        self, tmpdir, monkeypatch, broken_routes, expected_route
+    ):
+        routes = [
+            (name, unsupported if name in broken_routes else route)
+            for name, route in COPY_ROUTES
+        ]
+        monkeypatch.setattr(buddy.copy_files, "COPY_ROUTES", routes)
+        with sh.pushd(tmpdir):
+            contents = os.urandom(100000)
+            write_file("original", contents)
+            assert copy_file("original", "copy") == expected_route
+            assert read_file("copy") == contents
+
+    @pytest.mark.parametrize("name", [name for name, _ in COPY_ROUTES[1:]])
+    def test_routes_stop_at_the_size_of_the_original(self, tmpdir, name):
+        route = dict(COPY_ROUTES)[name]
+        with sh.pushd(tmpdir):
+            contents = os.urandom(10000)
+            write_file("original", contents)
+            # as if the original had grown since its size was read
+            with open("original", "rb", buffering=0) as src:
+                with open("copy", "w+b", buffering=0) as dst:
+                    assert route(src, dst, 1000, 6000) == 6000
+            assert read_file("copy")[1000:] == contents[1000:6000]
+
+    def test_resume_from_partial_file(self, tmpdir, monkeypatch):
+        offsets = []
+
+        def read_write(src, dst, offset, size):
+            offsets.append(offset)
+            return dict(COPY_ROUTES)["read_write"](src, dst, offset, size)
+
+        monkeypatch.setattr(buddy.copy_files, "COPY_ROUTES", [("rw", read_write)])
+        monkeypatch.setattr(buddy.copy_files, "RESUME_MARGIN", 1000)
+        with sh.pushd(tmpdir):
+            contents = os.urandom(10000)
+            write_file("original", contents)
+            partial = partial_path("copy", os.stat("original"))
+            # the end of the partial file was torn when the copy was killed
+            write_file(partial, contents[:6000] + b"\0" * 500)
+
+            assert copy_file("original", "copy") == "rw"
+            assert offsets == [5500]
+            assert read_file("copy") == contents
+            assert not os.path.exists(partial)
+
+    def test_short_copy_is_not_published(self, tmpdir, monkeypatch):
+        def short_read_write(src, dst, offset, size):
+            # as if the original was truncated during the copy
+            dst.write(src.read(size // 2))
+            return size // 2
+
+        monkeypatch.setattr(
+            buddy.copy_files, "COPY_ROUTES", [("short", short_read_write)]
+        )
+        with sh.pushd(tmpdir):
+            write_file("original", os.urandom(10000))
+            with pytest.raises(OSError):
+                copy_file("original", "copy")
+            assert os.listdir(".") == ["original"]
+
+    def test_original_changed_during_copy_is_not_published(self, tmpdir, monkeypatch):
+        def rewriting_read_write(src, dst, offset, size):
+            reached = dict(COPY_ROUTES)["read_write"](src, dst, offset, size)
+            os.utime("original", ns=(1, 1))
+            return reached
+
+        monkeypatch.setattr(
+            buddy.copy_files, "COPY_ROUTES", [("rw", rewriting_read_write)]
+        )
+        with sh.pushd(tmpdir):
+            write_file("original", os.urandom(10000))
+            with pytest.raises(OSError):
+                copy_file("original", "copy")
+            assert os.listdir(".") == ["original"]
+
+    def test_partial_file_of_a_changed_original_is_removed(self, tmpdir):
+        with sh.pushd(tmpdir):
+            write_file("original", b"abc")
+            stale = partial_path("copy", os.stat("original"))
+            write_file(stale, b"abc")
+            write_file("original", b"defgh")
+            os.utime("original", ns=(1, 1))
+            copy_file("original", "copy")
+            assert read_file("copy") == b"defgh"
+            assert not os.path.exists(stale)
+
+
+class TestCopyInParallel(object):
+    def test_every_file_is_attempted(self, tmpdir):
+        with sh.pushd(tmpdir):
+            write_file("a", b"a")
+            write_file("c", b"c")
+            pairs = [("a", "copies/a"), ("missing", "copies/b"), ("c", "copies/c")]
+            os.makedirs("copies")
+            with pytest.raises(FileNotFoundError):
+                copy_in_parallel(pairs, n_workers=2)
+            assert sorted(os.listdir("copies")) == ["a", "c"]
+
+
+class TestCopyDir(object):
+    def make_original(self):
+        write_file("original/a.txt", b"a")
+        write_file("original/sub/b.txt", b"b")
+        write_file("original/.git/HEAD", b"ref")
+        write_file("original/.gitignore", b"*.log")
+        os.symlink("a.txt", "original/link")
+        os.utime("original/sub/b.txt", (1000000000, 1000000000))
+
+    def test_copy_contents_of_dir(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_original()
+            assert copy_dir("original/", "lib/copy", exclude=(".git", ".gitignore"))
+            assert sorted(os.listdir("lib/copy")) == ["a.txt", "link", "sub"]
+            assert read_file("lib/copy/sub/b.txt") == b"b"
+            assert os.readlink("lib/copy/link") == "a.txt"
+            assert os.stat("lib/copy/sub/b.txt").st_mtime == 1000000000
+            assert os.listdir("lib") == ["copy"]
+
+    def test_copy_dir_into_copy_location(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_original()
+            assert copy_dir("original", "lib/copy", n_workers=4)
+            assert sorted(os.listdir("lib/copy")) == ["original"]
+            assert os.path.isfile("lib/copy/original/.git/HEAD")
+
+    def test_existing_copy_is_not_overwritten(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_original()
+            os.makedirs("lib/copy")
+            assert not copy_dir("original/", "lib/copy")
+            assert os.listdir("lib/copy") == []
+
+    def test_resume_from_partial_dir(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_original()
+            # a killed copy had already copied `a.txt`
+            write_file("lib/.copy.partial/a.txt", b"already copied")
+            assert copy_dir("original/", "lib/copy")
+            assert read_file("lib/copy/a.txt") == b"already copied"
+            assert read_file("lib/copy/sub/b.txt") == b"b"
+            assert not os.path.exists("lib/.copy.partial")
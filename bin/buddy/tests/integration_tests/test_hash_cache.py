@@ -0,0 +1,93 @@
+import os
+import pytest
+import sh
+
+from buddy.hash_cache import HashCache
+from buddy.validation_classes import get_md5sum
+from tests.integration_tests.data_for_md5sum_tests import empty_md5
+
+# user
+# .. can avoid re-hashing files that are unchanged since the last run
+# .. can force every file to be re-hashed
+
+
+def fake_md5sum():
+    return "f" * 32
+
+
+class TestHashCacheModes(object):
+    def test_unknown_mode_is_rejected(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with pytest.raises(ValueError):
+                HashCache("cache.sqlite", mode="sometimes")
+
+    def test_trusted_cache_reuses_digest_of_unchanged_file(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.touch("empty_file")
+            cache = HashCache("cache.sqlite", mode="trust")
+            cache.store("empty_file", "md5 comment=None", fake_md5sum())
+
+            assert get_md5sum("empty_file", cache=cache) == fake_md5sum()
+
+    def test_rehash_mode_recomputes_and_updates_the_cache(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.touch("empty_file")
+            HashCache("cache.sqlite").store(
+                "empty_file", "md5 comment=None", fake_md5sum()
+            )
+
+            rehash_cache = HashCache("cache.sqlite", mode="rehash")
+            assert get_md5sum("empty_file", cache=rehash_cache) == empty_md5()
+
+            trust_cache = HashCache("cache.sqlite", mode="trust")
+            assert trust_cache.lookup("empty_file", "md5 comment=None") == empty_md5()
+
+    def test_modified_file_is_rehashed(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.touch("some_file")
+            cache = HashCache("cache.sqlite")
+            cache.store("some_file", "md5 comment=None", fake_md5sum())
+
+            with open("some_file", "w") as f:
+                print("new-data", file=f)
+
+            assert get_md5sum("some_file", cache=cache) == get_md5sum("some_file")
+
+    def test_comment_character_is_part_of_the_key(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with open("some_file", "w") as f:
+                print("# a comment", file=f)
+            cache = HashCache("cache.sqlite")
+
+            assert get_md5sum("some_file", comment="#", cache=cache) == empty_md5()
+            assert get_md5sum("some_file", cache=cache) != empty_md5()
+            assert len(cache) == 2
+
+
+class TestHashCacheEviction(object):
+    def test_least_recently_used_entries_are_evicted(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            cache = HashCache("cache.sqlite", max_entries=2)
+            for i in range(3):
+                sh.touch("file{}".format(i))
+                mocker.patch("time.time", return_value=1000.0 + i)
+                cache.store("file{}".format(i), "md5sum", fake_md5sum())
+
+            cache.evict()
+            assert len(cache) == 2
+            assert cache.lookup("file0", "md5sum") is None
+            assert cache.lookup("file2", "md5sum") == fake_md5sum()
+
+    def test_old_entries_are_evicted(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            cache = HashCache("cache.sqlite", max_age_days=1)
+            sh.touch("old_file")
+            sh.touch("new_file")
+            mocker.patch("time.time", return_value=0.0)
+            cache.store("old_file", "md5sum", fake_md5sum())
+            mocker.patch("time.time", return_value=2 * 24 * 60 * 60.0)
+            cache.store("new_file", "md5sum", fake_md5sum())
+
+            cache.evict()
+            assert len(cache) == 1
+            assert cache.lookup("new_file", "md5sum") == fake_md5sum()
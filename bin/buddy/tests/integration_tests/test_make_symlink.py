@@ -3,7 +3,11 @@ import os.path
 import pytest
 import sh
 
-from buddy.make_symlink import add_relative_symlink
+from buddy.make_symlink import (
+    add_relative_symlink,
+    add_relative_symlinks,
+    read_links_file,
+)
 
 
 class TestLinkMaker(object):
@@ -99,3 +103,73 @@ class TestLinkMaker(object):
         with sh.pushd(tmpdir):
             with pytest.raises(FileNotFoundError):
                 add_relative_symlink("doesnt_exist.txt", "some_link")
+
+
+class TestBatchLinkMaker(object):
+    def test_make_all_links_in_a_links_file(self, tmpdir):
+        # - the links-file contains comments, blank lines and two links
+        # - both links are made, relative to their containing dirs
+        with sh.pushd(tmpdir):
+            sh.touch("a.txt")
+            sh.touch("b.txt")
+            with open("links.txt", "w") as f:
+                f.write("# a comment\n\na.txt a.link\nb.txt subdir/b.link\n")
+            add_relative_symlinks(read_links_file("links.txt"))
+            assert os.readlink("a.link") == "a.txt"
+            assert os.readlink("subdir/b.link") == "../b.txt"
+
+    def test_read_links_from_yaml(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with open("links.yaml", "w") as f:
+                f.write("- target: a.txt\n  link: a.link\n")
+            assert read_links_file("links.yaml") == [("a.txt", "a.link")]
+
+    def test_tildes_are_expanded(self, tmpdir, monkeypatch):
+        monkeypatch.setenv("HOME", str(tmpdir))
+        with sh.pushd(tmpdir):
+            with open("links.txt", "w") as f:
+                f.write("~/a.txt ./a.link\n")
+            assert read_links_file("links.txt") == [
+                (os.path.join(str(tmpdir), "a.txt"), "./a.link")
+            ]
+
+    def test_error_if_line_cant_be_parsed(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with open("links.txt", "w") as f:
+                f.write("a.txt a.link extra\n")
+            with pytest.raises(ValueError):
+                read_links_file("links.txt")
+
+    def test_all_conflicts_are_reported(self, tmpdir, capsys):
+        # - the first and third links conflict with existing files / links
+        # - the second link is still made
+        # - both conflicts are reported, and the first error is raised
+        with sh.pushd(tmpdir):
+            sh.touch("a.txt")
+            sh.touch("b.txt")
+            sh.touch("not_a_link")
+            add_relative_symlink("b.txt", "existing.link")
+            pairs = [
+                ("a.txt", "not_a_link"),
+                ("a.txt", "a.link"),
+                ("a.txt", "existing.link"),
+            ]
+            with pytest.raises(FileExistsError):
+                add_relative_symlinks(pairs)
+            assert os.readlink("a.link") == "a.txt"
+
+        conflicts = [
+            line
+            for line in capsys.readouterr().err.splitlines()
+            if line.startswith("[CONFLICT]")
+        ]
+        assert len(conflicts) == 2
+        assert "link:not_a_link" in conflicts[0]
+        assert "link:existing.link" in conflicts[1]
+
+    def test_existing_links_pass_through(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.touch("a.txt")
+            add_relative_symlinks([("a.txt", "a.link")])
+            add_relative_symlinks([("a.txt", "a.link")])
+            assert os.readlink("a.link") == "a.txt"
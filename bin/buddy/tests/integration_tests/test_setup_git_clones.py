@@ -1,8 +1,17 @@
+import glob
+import multiprocessing
 import sh
 import os
 import pytest
+import time
 
-from buddy.git_classes import ExternalRepository
+from buddy.git_classes import (
+    LAST_USED_FILE,
+    ExternalRepository,
+    GitMirrorCache,
+    read_head,
+)
+from buddy.setup_git_clones import provision_repositories
 
 
 def commit_file_and_get_hash(repo_path, file_name):
@@ -14,6 +23,10 @@ def commit_file_and_get_hash(repo_path, file_name):
         return commit_hash
 
 
+def clone_from_cache(url, output_path):
+    GitMirrorCache("cache").clone(url, output_path)
+
+
 class TestGitInit(object):
     def test_initial_commit(self, tmpdir):
         with sh.pushd(tmpdir):
@@ -80,3 +93,202 @@ class TestCheckoutInvalidHash(object):
 
             with pytest.raises(sh.ErrorReturnCode):
                 copied_repo.checkout()
+
+
+class TestProvisionRepositories(object):
+    def test_valid_repositories_are_checked_out_despite_a_failure(self, tmpdir):
+        with sh.pushd(tmpdir):
+            repo_name = "my_repo"
+            sh.git("init", repo_name)
+
+            commit_hash_1 = commit_file_and_get_hash(repo_name, "file1")
+            _ = commit_file_and_get_hash(repo_name, "file2")
+
+            repositories = {
+                "bad": ExternalRepository(repo_name, "NOTAHASHCODE", "bad_copy"),
+                "good": ExternalRepository(repo_name, commit_hash_1, "good_copy"),
+            }
+            with pytest.raises(sh.ErrorReturnCode):
+                provision_repositories(repositories, n_workers=2)
+
+            assert os.path.isfile("good_copy/file1")
+            assert not os.path.isfile("good_copy/file2")
+
+
+class TestGitMirrorCache(object):
+    def test_clone_from_mirror(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.git("init", "upstream")
+            commit_hash_1 = commit_file_and_get_hash("upstream", "file1")
+            url = "file://" + os.path.join(str(tmpdir), "upstream")
+
+            cache = GitMirrorCache("cache")
+            repo = ExternalRepository(url, commit_hash_1, "my_copy")
+            repo.clone(cache=cache)
+            repo.checkout()
+
+            assert os.path.isfile("my_copy/file1")
+            assert os.path.isdir(cache.mirror_path(url))
+            origin = str(sh.git("-C", "my_copy", "remote", "get-url", "origin"))
+            assert origin.strip() == url
+
+            # the clone's packs are hard-linked to those of the mirror
+            packs = glob.glob("my_copy/.git/objects/pack/*.pack")
+            assert packs and all(os.stat(pack).st_nlink > 1 for pack in packs)
+
+    def test_mirror_is_fetched_for_new_commits(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.git("init", "upstream")
+            commit_hash_1 = commit_file_and_get_hash("upstream", "file1")
+            url = "file://" + os.path.join(str(tmpdir), "upstream")
+            ExternalRepository(url, commit_hash_1, "copy1").clone(
+                cache=GitMirrorCache("cache")
+            )
+
+            commit_hash_2 = commit_file_and_get_hash("upstream", "file2")
+            repo = ExternalRepository(url, commit_hash_2, "copy2")
+            repo.clone(cache=GitMirrorCache("cache"))
+            repo.checkout()
+            assert os.path.isfile("copy2/file2")
+
+    def test_unused_mirrors_are_evicted(self, tmpdir):
+        with sh.pushd(tmpdir):
+            urls = []
+            for name in ["old", "new"]:
+                sh.git("init", name)
+                commit_file_and_get_hash(name, "file1")
+                urls.append("file://" + os.path.join(str(tmpdir), name))
+            old_url, new_url = urls
+
+            GitMirrorCache("cache").update(old_url)
+            a_week_ago = time.time() - 7 * 24 * 60 * 60
+            old_mirror = GitMirrorCache("cache").mirror_path(old_url)
+            stamp = os.path.join(old_mirror, LAST_USED_FILE)
+            os.utime(stamp, (a_week_ago, a_week_ago))
+
+            cache = GitMirrorCache("cache", max_age_days=1)
+            cache.update(new_url)
+            assert cache.evict() == [cache.mirror_path(old_url)]
+            assert not os.path.exists(cache.mirror_path(old_url))
+            assert os.path.isdir(cache.mirror_path(new_url))
+
+    def test_mirrors_locked_by_another_process_are_not_evicted(self, tmpdir):
+        fcntl = pytest.importorskip("fcntl")
+        with sh.pushd(tmpdir):
+            sh.git("init", "upstream")
+            commit_file_and_get_hash("upstream", "file1")
+            url = "file://" + os.path.join(str(tmpdir), "upstream")
+            mirror = GitMirrorCache("cache").update(url)
+            os.utime(os.path.join(mirror, LAST_USED_FILE), (0, 0))
+
+            cache = GitMirrorCache("cache", max_age_days=1)
+            # as if another process were cloning from the mirror
+            with open(mirror + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH)
+                assert cache.evict() == []
+                assert os.path.isdir(mirror)
+            assert cache.evict() == [mirror]
+            assert not os.path.exists(mirror)
+
+    def test_mirror_can_be_shared_between_processes(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.git("init", "upstream")
+            commit_hash = commit_file_and_get_hash("upstream", "file1")
+            url = "file://" + os.path.join(str(tmpdir), "upstream")
+            GitMirrorCache("cache").update(url)
+
+            # each process fetches into the same mirror
+            with multiprocessing.get_context("spawn").Pool(4) as pool:
+                outputs = ["copy{}".format(i) for i in range(8)]
+                pool.starmap(clone_from_cache, [(url, out) for out in outputs])
+            for output in outputs:
+                assert read_head(output) == commit_hash
+
+
+class TestShallowClone(object):
+    def make_upstream(self, tmpdir):
+        sh.git("init", "upstream")
+        sh.mkdir("upstream/a", "upstream/b")
+        commit_file_and_get_hash("upstream", "a/file1")
+        commit_hash = commit_file_and_get_hash("upstream", "b/file2")
+        _ = commit_file_and_get_hash("upstream", "a/file3")
+        return "file://" + os.path.join(str(tmpdir), "upstream"), commit_hash
+
+    def test_only_the_pinned_commit_is_fetched(self, tmpdir):
+        with sh.pushd(tmpdir):
+            url, commit_hash = self.make_upstream(tmpdir)
+            repo = ExternalRepository(url, commit_hash, "sub/my_copy", shallow=True)
+            repo.clone()
+            repo.checkout()
+
+            assert repo.sha1_matches()
+            assert os.path.isfile("sub/my_copy/b/file2")
+            assert not os.path.isfile("sub/my_copy/a/file3")
+            n_commits = str(sh.git("-C", "sub/my_copy", "rev-list", "--count", "HEAD"))
+            assert n_commits.strip() == "1"
+            # no temporary directories are left behind
+            assert os.listdir("sub") == ["my_copy"]
+
+    def test_sparse_paths_and_filter(self, tmpdir):
+        with sh.pushd(tmpdir):
+            url, commit_hash = self.make_upstream(tmpdir)
+            repo = ExternalRepository(
+                url,
+                commit_hash,
+                "my_copy",
+                shallow=True,
+                filter="blob:none",
+                sparse=["/b/"],
+            )
+            repo.clone()
+            assert os.path.isfile("my_copy/b/file2")
+            assert not os.path.exists("my_copy/a")
+
+    def test_shallow_clone_from_mirror(self, tmpdir):
+        with sh.pushd(tmpdir):
+            url, commit_hash = self.make_upstream(tmpdir)
+            repo = ExternalRepository(url, commit_hash, "my_copy", shallow=True)
+            repo.clone(cache=GitMirrorCache("cache"))
+            assert repo.sha1_matches()
+            origin = str(sh.git("-C", "my_copy", "remote", "get-url", "origin"))
+            assert origin.strip() == url
+
+    def test_error_if_existing_copy_has_another_commit(self, tmpdir):
+        with sh.pushd(tmpdir):
+            url, commit_hash = self.make_upstream(tmpdir)
+            sh.git("clone", url, "my_copy")
+            repo = ExternalRepository(url, commit_hash, "my_copy", shallow=True)
+            with pytest.raises(ValueError):
+                repo.clone()
+
+    def test_error_if_sha1_is_abbreviated(self, tmpdir):
+        with sh.pushd(tmpdir):
+            url, commit_hash = self.make_upstream(tmpdir)
+            repo = ExternalRepository(url, commit_hash[:7], "my_copy", shallow=True)
+            with pytest.raises(ValueError):
+                repo.clone()
+            assert not os.path.exists("my_copy")
+
+
+class TestReadHead(object):
+    def test_head_on_a_branch_and_detached(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.git("init", "my_repo")
+            commit_hash_1 = commit_file_and_get_hash("my_repo", "file1")
+            commit_hash_2 = commit_file_and_get_hash("my_repo", "file2")
+            assert read_head("my_repo") == commit_hash_2
+
+            sh.git("-C", "my_repo", "checkout", commit_hash_1)
+            assert read_head("my_repo") == commit_hash_1
+
+    def test_head_from_packed_refs(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.git("init", "my_repo")
+            commit_hash = commit_file_and_get_hash("my_repo", "file1")
+            sh.git("-C", "my_repo", "pack-refs", "--all")
+            assert read_head("my_repo") == commit_hash
+
+    def test_no_head_outside_a_repository(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.makedirs("not_a_repo")
+            assert read_head("not_a_repo") is None
@@ -0,0 +1,245 @@
+import os
+import sh
+import pytest
+import time
+
+from textwrap import dedent
+
+from buddy.git_classes import ExternalRepository
+from buddy.setup_project import (
+    SETUP_FILES,
+    SETUP_STAMP,
+    SetupAction,
+    SetupConfig,
+    is_setup_current,
+    plan_setup,
+    run_workflow,
+)
+
+
+def write_config(config_dir, **contents):
+    """
+    Write every setup config file into `config_dir`; the contents of a file
+    are taken from the keyword argument with the same name as its stage
+    """
+    os.makedirs(config_dir, exist_ok=True)
+    for stage, filename in SETUP_FILES.items():
+        with open(os.path.join(config_dir, filename), "w") as f:
+            f.write(dedent(contents.get(stage, "# nothing to do\n")))
+
+
+class TestSetupConfig(object):
+    def test_read_config_dir(self, tmpdir, monkeypatch):
+        monkeypatch.setenv("HOME", "/home/me")
+        with sh.pushd(tmpdir):
+            write_config(
+                "config",
+                check_dirs="- ext_dir\n",
+                make_dirs="# a comment\n\n./data\n./results\n",
+                links="~/target ./data/link\n",
+                touch_files="notes.txt\n",
+            )
+            config = SetupConfig.from_dir("config")
+            assert config == SetupConfig(
+                check_dirs=["ext_dir"],
+                make_dirs=["./data", "./results"],
+                links=[("/home/me/target", "./data/link")],
+                touch_files=["notes.txt"],
+            )
+
+    def test_error_if_a_config_file_is_missing(self, tmpdir):
+        with sh.pushd(tmpdir):
+            write_config("config")
+            os.remove(os.path.join("config", SETUP_FILES["touch_files"]))
+            with pytest.raises(FileNotFoundError):
+                SetupConfig.from_dir("config")
+
+
+class TestSetupProject(object):
+    def test_every_stage_is_run(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.makedirs("external/scripts/.git")
+            for path in ["external/data.tsv", "external/scripts/a.R"]:
+                sh.touch(path)
+            sh.touch("external/scripts/.gitignore")
+            os.makedirs("project")
+
+        with sh.pushd(os.path.join(str(tmpdir), "project")):
+            write_config(
+                "config",
+                check_dirs="- ../external\n",
+                links="../external ./data/ext\n",
+                make_dirs="./data/ext/subdir\n./results\n",
+                file_copies="../external/data.tsv ./lib/data.tsv\n",
+                dir_copies=(
+                    "../external/scripts/ ./lib/scripts\n"
+                    "../external/scripts ./lib/copied\n"
+                ),
+                touch_files="./results/notes.txt\n",
+            )
+            run_workflow("config")
+
+            assert os.readlink("data/ext") == "../../external"
+            assert os.path.isdir("../external/subdir")
+            assert os.path.isdir("results")
+            assert os.path.isfile("lib/data.tsv")
+            assert sorted(os.listdir("lib/scripts")) == ["a.R"]
+            assert sorted(os.listdir("lib/copied/scripts")) == ["a.R"]
+            assert os.path.isfile("results/notes.txt")
+
+            # re-running the setup doesn't change anything
+            run_workflow("config")
+            assert os.readlink("data/ext") == "../../external"
+
+    def test_existing_copies_are_not_overwritten(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with open("original.txt", "w") as f:
+                f.write("new contents")
+            with open("copy.txt", "w") as f:
+                f.write("old contents")
+            write_config("config", file_copies="original.txt copy.txt\n")
+            run_workflow("config")
+            with open("copy.txt") as f:
+                assert f.read() == "old contents"
+
+    def test_error_if_a_checked_dir_is_missing(self, tmpdir):
+        with sh.pushd(tmpdir):
+            write_config("config", check_dirs="- missing_dir\n")
+            with pytest.raises(FileNotFoundError):
+                run_workflow("config")
+
+    def test_error_if_original_file_is_missing(self, tmpdir):
+        with sh.pushd(tmpdir):
+            write_config("config", file_copies="missing.txt copy.txt\n")
+            with pytest.raises(FileNotFoundError):
+                run_workflow("config")
+
+
+class TestPlanSetup(object):
+    def test_plan_for_a_new_project(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.touch("original.txt")
+            config = SetupConfig(
+                links=[("original.txt", "data/link")],
+                make_dirs=["results"],
+                file_copies=[("original.txt", "lib/copy.txt")],
+                touch_files=["notes.txt"],
+            )
+            assert plan_setup(config) == [
+                SetupAction("link", "data/link", "original.txt"),
+                SetupAction("mkdir", "results"),
+                SetupAction("copy_file", "lib/copy.txt", "original.txt"),
+                SetupAction("touch", "notes.txt"),
+            ]
+
+    def test_plan_is_empty_once_set_up(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            os.makedirs("external/scripts")
+            sh.touch("external/data.tsv")
+            write_config(
+                "config",
+                check_dirs="- external\n",
+                links="external ./data/ext\n",
+                make_dirs="./results\n",
+                file_copies="external/data.tsv ./lib/data.tsv\n",
+                dir_copies="external/scripts/ ./lib/scripts\n",
+                touch_files="./results/notes.txt\n",
+            )
+            run_workflow("config")
+
+            popen = mocker.patch("subprocess.Popen")
+            assert plan_setup(SetupConfig.from_dir("config")) == []
+            popen.assert_not_called()
+
+    def test_dry_run_prints_the_plan(self, tmpdir, capsys):
+        with sh.pushd(tmpdir):
+            write_config("config", make_dirs="./results\n")
+            run_workflow("config", dry_run=True)
+            assert not os.path.exists("results")
+        assert capsys.readouterr().out == "[MKDIR]\tpath:./results\n"
+
+    def test_checkout_is_planned_for_another_commit(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.git("init", "my_repo")
+            sh.touch("my_repo/file1")
+            sh.git("-C", "my_repo", "add", "file1")
+            sh.git("-C", "my_repo", "commit", "-m", "adding file1")
+            head = str(sh.git("-C", "my_repo", "rev-parse", "HEAD")).strip()
+
+            current = ExternalRepository("some_url", head[:7], "my_repo")
+            assert plan_setup(SetupConfig(repositories={"a": current})) == []
+
+            other = ExternalRepository("some_url", "a1b2c3d", "my_repo")
+            assert plan_setup(SetupConfig(repositories={"a": other})) == [
+                SetupAction("checkout", "my_repo", "a1b2c3d")
+            ]
+
+
+CHECK_DIRS_PATH = os.path.join(".sidekick", "setup", SETUP_FILES["check_dirs"])
+
+
+class TestIsSetupCurrent(object):
+    def make_project(self, path, subjobs=""):
+        os.makedirs(path)
+        with sh.pushd(path):
+            write_config(os.path.join(".sidekick", "setup"), make_dirs="./results\n")
+            with open(os.path.join(".sidekick", "setup", "subjob_names.txt"), "w") as f:
+                f.write(subjobs)
+            run_workflow(os.path.join(".sidekick", "setup"))
+            sh.touch(SETUP_STAMP)
+
+    def test_set_up_project(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_project("project")
+            assert is_setup_current("project")
+
+    def test_project_without_a_stamp(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_project("project")
+            os.remove(os.path.join("project", SETUP_STAMP))
+            assert not is_setup_current("project")
+
+    def test_project_with_planned_actions(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_project("project")
+            os.rmdir(os.path.join("project", "results"))
+            assert not is_setup_current("project")
+
+    def test_missing_checked_dirs_are_not_reported(self, tmpdir, capsys):
+        with sh.pushd(tmpdir):
+            self.make_project("project")
+            with open(os.path.join("project", CHECK_DIRS_PATH), "w") as f:
+                f.write("- missing_dir\n- ~/missing_dir\n")
+            sh.touch(os.path.join("project", SETUP_STAMP))
+
+            assert not is_setup_current("project")
+            assert capsys.readouterr().err == ""
+
+    def test_config_newer_than_stamp(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_project("project")
+            stamp = os.path.join("project", SETUP_STAMP)
+            os.utime(stamp, (0, 0))
+            assert not is_setup_current("project")
+
+    def test_r_package_sources_newer_than_stamp(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_project("project")
+            r_file = os.path.join("project", "lib", "local_rfuncs", "R", "f.R")
+            os.makedirs(os.path.dirname(r_file))
+            sh.touch(r_file)
+            stamp_mtime = time.time() + 100
+            os.utime(os.path.join("project", SETUP_STAMP), (stamp_mtime, stamp_mtime))
+            assert is_setup_current("project")
+
+            os.utime(r_file, (stamp_mtime + 10, stamp_mtime + 10))
+            assert not is_setup_current("project")
+
+    def test_subjobs_are_checked(self, tmpdir):
+        with sh.pushd(tmpdir):
+            self.make_project("project", subjobs="# a comment\nsub1\n")
+            self.make_project(os.path.join("project", "subjobs", "sub1"))
+            assert is_setup_current("project")
+
+            os.rmdir(os.path.join("project", "subjobs", "sub1", "results"))
+            assert not is_setup_current("project")
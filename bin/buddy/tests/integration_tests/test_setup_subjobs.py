@@ -0,0 +1,99 @@
+import os
+import sh
+import pytest
+import subprocess
+
+from buddy.setup_subjobs import Subjob, find_subjobs, setup_subjobs
+
+# A stand-in for `./sidekick setup`: records that it ran (and whether nested
+# subjobs were to be skipped); fails if the subjob contains a `fail` file or if
+# its parent has not been set up already
+SIDEKICK_SCRIPT = """#!/bin/bash
+echo "setting up ${PWD}"
+if [[ -f fail ]] || [[ ! -f ../../setup_ran ]]; then exit 1; fi
+echo "${SIDEKICK_SKIP_SUBJOBS}" > setup_ran
+"""
+
+
+def make_job(path, subjobs=(), fail=False):
+    os.makedirs(os.path.join(path, ".sidekick", "setup"), exist_ok=True)
+    os.makedirs(os.path.join(path, "scripts"), exist_ok=True)
+    sh.touch(os.path.join(path, "scripts", "setup.sh"))
+    with open(os.path.join(path, ".sidekick", "setup", "subjob_names.txt"), "w") as f:
+        f.write("# subjobs\n" + "".join("{}\n".format(name) for name in subjobs))
+    sidekick = os.path.join(path, "sidekick")
+    with open(sidekick, "w") as f:
+        f.write(SIDEKICK_SCRIPT)
+    os.chmod(sidekick, 0o755)
+    if fail:
+        sh.touch(os.path.join(path, "fail"))
+
+
+def make_tree(failing=()):
+    # project
+    # - a
+    #   - c
+    # - b
+    make_job(".", subjobs=["a", "b"])
+    make_job("subjobs/a", subjobs=["c"], fail="a" in failing)
+    make_job("subjobs/b", fail="b" in failing)
+    make_job("subjobs/a/subjobs/c", fail="c" in failing)
+    # the project itself is already set up
+    sh.touch("setup_ran")
+
+
+class TestFindSubjobs(object):
+    def test_nested_subjobs(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            assert find_subjobs(".") == [
+                Subjob("./subjobs/a"),
+                Subjob("./subjobs/b"),
+                Subjob("./subjobs/a/subjobs/c", "./subjobs/a"),
+            ]
+
+    def test_no_subjobs(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_job(".")
+            assert find_subjobs(".") == []
+
+    def test_error_if_subjob_is_missing(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_job(".", subjobs=["missing"])
+            with pytest.raises(FileNotFoundError):
+                find_subjobs(".")
+
+
+class TestSetupSubjobs(object):
+    def test_every_subjob_is_set_up(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            setup_subjobs(find_subjobs("."), n_workers=4, log_dir="logs")
+
+            for path in ["subjobs/a", "subjobs/b", "subjobs/a/subjobs/c"]:
+                with open(os.path.join(path, "setup_ran")) as f:
+                    assert f.read() == "1\n"
+            assert sorted(os.listdir("logs")) == ["a.log", "a__c.log", "b.log"]
+            with open(os.path.join("logs", "a__c.log")) as f:
+                assert "setting up" in f.read()
+
+    def test_failures_are_collected(self, tmpdir, capsys):
+        # - `a` fails, so its subjob `c` is skipped; but `b` is still set up
+        with sh.pushd(tmpdir):
+            make_tree(failing=["a"])
+            with pytest.raises(subprocess.CalledProcessError):
+                setup_subjobs(find_subjobs("."), n_workers=2, log_dir="logs")
+
+            assert os.path.isfile("subjobs/b/setup_ran")
+            assert not os.path.isfile("subjobs/a/subjobs/c/setup_ran")
+
+        labels = sorted(
+            line.split("\t")[:2]
+            for line in capsys.readouterr().err.splitlines()
+            if line.startswith("[")
+        )
+        assert labels == [
+            ["[DONE]", "subjob:./subjobs/b"],
+            ["[FAILED]", "subjob:./subjobs/a"],
+            ["[SKIPPED]", "subjob:./subjobs/a/subjobs/c"],
+        ]
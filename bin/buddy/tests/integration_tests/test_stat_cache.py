@@ -0,0 +1,44 @@
+import os
+import sh
+
+from buddy.stat_cache import StatCache
+
+
+class TestStatCache(object):
+    def test_results_are_cached(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.makedirs("a_dir")
+            stat_cache = StatCache()
+
+            assert stat_cache.isdir("a_dir")
+            assert not stat_cache.exists("missing")
+            assert len(stat_cache) == 2
+
+            # the cached result stands until the path is invalidated
+            open("missing", "w").close()
+            assert not stat_cache.exists("./missing")
+            stat_cache.invalidate("missing")
+            assert stat_cache.isfile("missing")
+
+    def test_links_are_stated_with_and_without_following(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.symlink("no_target", "a_link")
+            stat_cache = StatCache()
+
+            assert stat_cache.islink("a_link")
+            assert stat_cache.lexists("a_link")
+            assert not stat_cache.exists("a_link")
+
+    def test_stat_many_stats_each_path_once(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            os.makedirs("a_dir")
+            stat_cache = StatCache()
+            stat = mocker.spy(os, "stat")
+
+            results = stat_cache.stat_many(["a_dir", "missing", "a_dir"])
+            assert list(results) == ["a_dir", "missing"]
+            assert results["missing"] is None
+            assert stat.call_count == 2
+
+            stat_cache.stat_many(["a_dir", "./missing"])
+            assert stat.call_count == 2
@@ -0,0 +1,199 @@
+import os
+import sh
+
+import buddy.tree_manifest
+
+from buddy.file_utils import read_yaml
+from buddy.tree_manifest import (
+    TreeDiff,
+    check_tree,
+    check_workflow,
+    scan_tree,
+    update_manifest,
+    update_workflow,
+    write_workflow,
+)
+from buddy.validation_workflow import ValidationWorkflow
+from tests.integration_tests.data_for_md5sum_tests import empty_md5
+
+# user
+# .. can write a manifest for every file in a directory tree
+# .. can find the files that were added / removed / changed since then
+# .. can update a manifest without re-hashing the unchanged files
+
+
+def make_tree():
+    os.makedirs(os.path.join("data", "job", "logs"))
+    sh.touch(os.path.join("data", "empty_file"))
+    with open(os.path.join("data", "job", "results.tsv"), "w") as f:
+        print("some-data", file=f)
+    sh.touch(os.path.join("data", "job", "logs", "run.log"))
+
+
+class TestScanTree(object):
+    def test_all_files_are_found(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            files = scan_tree("data", n_workers=2)
+            assert list(files) == ["empty_file", "job/logs/run.log", "job/results.tsv"]
+            assert files["job/results.tsv"].st_size == 10
+
+    def test_files_can_be_included_and_excluded(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            assert list(scan_tree("data", include=["job/*"])) == [
+                "job/logs/run.log",
+                "job/results.tsv",
+            ]
+            assert list(scan_tree("data", exclude=["job/logs"])) == [
+                "empty_file",
+                "job/results.tsv",
+            ]
+
+
+class TestWriteManifest(object):
+    def test_manifest_is_a_validation_yaml(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml", exclude=["*.log"])
+
+            manifest = read_yaml("manifest.yaml")
+            assert list(manifest) == ["empty_file", "job/results.tsv"]
+            assert manifest["empty_file"]["input_file"] == "data/empty_file"
+            assert manifest["empty_file"]["expected_md5sum"] == empty_md5()
+            assert manifest["empty_file"]["expected_size"] == 0
+
+            workflow = ValidationWorkflow.from_yaml_file("manifest.yaml")
+            assert workflow.get_failing_validators() == {}
+
+
+class TestCheckTree(object):
+    def test_unchanged_tree_has_no_differences(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+
+            assert check_tree("data", "manifest.yaml", n_workers=2) == TreeDiff()
+            mocker.patch("builtins.print")
+            check_workflow("data", "manifest.yaml")
+            print.assert_not_called()
+
+    def test_added_removed_and_changed_files_are_reported(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+
+            sh.touch(os.path.join("data", "job", "new_file"))
+            os.remove(os.path.join("data", "job", "logs", "run.log"))
+            with open(os.path.join("data", "empty_file"), "w") as f:
+                print("not-empty", file=f)
+
+            assert check_tree("data", "manifest.yaml") == TreeDiff(
+                added=["data/job/new_file"],
+                removed=["data/job/logs/run.log"],
+                changed=["data/empty_file"],
+            )
+
+    def test_same_size_edits_are_found_by_hashing(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+
+            results_file = os.path.join("data", "job", "results.tsv")
+            stat_result = os.stat(results_file)
+            with open(results_file, "w") as f:
+                print("some-DATA", file=f)
+            os.utime(
+                results_file, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns)
+            )
+
+            assert check_tree("data", "manifest.yaml", level="quick") == TreeDiff()
+            assert check_tree("data", "manifest.yaml") == TreeDiff(
+                changed=["data/job/results.tsv"]
+            )
+
+    def test_excluded_files_are_not_reported_as_removed(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+
+            assert check_tree("data", "manifest.yaml", exclude=["job"]) == TreeDiff()
+
+    def test_subtree_can_be_checked_against_the_manifest_of_its_parent(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+
+            job_dir = os.path.join("data", "job")
+            assert check_tree(job_dir, "manifest.yaml") == TreeDiff()
+            os.remove(os.path.join("data", "job", "logs", "run.log"))
+            assert check_tree(job_dir, "manifest.yaml") == TreeDiff(
+                removed=["data/job/logs/run.log"]
+            )
+
+
+class TestUpdateManifest(object):
+    def test_only_new_and_modified_files_are_hashed(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+            sh.touch(os.path.join("data", "job", "new_file"))
+            with open(os.path.join("data", "empty_file"), "w") as f:
+                print("not-empty", file=f)
+
+            mocker.spy(buddy.tree_manifest, "get_digests")
+            manifest, diff = update_manifest("data", "manifest.yaml")
+            hashed = [c[0][0] for c in buddy.tree_manifest.get_digests.call_args_list]
+            assert sorted(hashed) == ["data/empty_file", "data/job/new_file"]
+
+            assert diff == TreeDiff(
+                added=["data/job/new_file"], changed=["data/empty_file"]
+            )
+            assert manifest["job/new_file"]["expected_md5sum"] == empty_md5()
+            assert manifest["empty_file"]["expected_size"] == 10
+
+    def test_touched_but_unmodified_files_are_not_changed(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml")
+            os.remove(os.path.join("data", "job", "logs", "run.log"))
+            os.utime(os.path.join("data", "job", "results.tsv"), (0, 0))
+
+            manifest, diff = update_manifest("data", "manifest.yaml")
+            assert diff == TreeDiff(removed=["data/job/logs/run.log"])
+            assert manifest["job/results.tsv"]["expected_mtime"] == 0
+
+    def test_manifest_is_updated_in_place(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml", exclude=["job/logs"])
+            sh.touch(os.path.join("data", "job", "new_file"))
+
+            mocker.patch("builtins.print")
+            update_workflow("data", "manifest.yaml", exclude=["job/logs"])
+            print.assert_called_once_with("[ADDED]\tinput_file:data/job/new_file")
+
+            assert list(read_yaml("manifest.yaml")) == [
+                "empty_file",
+                "job/new_file",
+                "job/results.tsv",
+            ]
+            assert check_tree("data", "manifest.yaml", exclude=["job/logs"]) == (
+                TreeDiff()
+            )
+            assert not os.path.exists("manifest.yaml.tmp")
+
+    def test_chunked_manifests_report_the_changed_files(self, tmpdir):
+        with sh.pushd(tmpdir):
+            make_tree()
+            write_workflow("data", "manifest.yaml", algorithm="chunks")
+            assert "expected_chunks" in read_yaml("manifest.yaml")["job/results.tsv"]
+
+            with open(os.path.join("data", "job", "results.tsv"), "a") as f:
+                print("more-data", file=f)
+
+            manifest, diff = update_manifest(
+                "data", "manifest.yaml", algorithm="chunks"
+            )
+            assert diff == TreeDiff(changed=["data/job/results.tsv"])
+            assert manifest["job/results.tsv"]["expected_chunks"][0]["length"] == 20
@@ -5,7 +5,8 @@ import pytest
 from textwrap import dedent
 from pytest_mock import mocker
 
-from buddy.validate_dir_existence import run_workflow
+from buddy.stat_cache import StatCache
+from buddy.validate_dir_existence import check_dirs, find_missing_dirs, run_workflow
 
 
 class TestDirExistence(object):
@@ -104,3 +105,44 @@ class TestDirExistence(object):
                 print.assert_called_with(
                     "Don't use tilde `~` in dirnames in `validate_dir_existence.py`"
                 )
+
+
+class TestFindMissingDirs(object):
+    def test_every_missing_dir_is_reported(self, tmpdir, mocker):
+        with sh.pushd(tmpdir):
+            os.makedirs("a/b")
+            open("a_file", "w").close()
+
+            dirs = ["missing", "a/b", "a_file", "a/missing"]
+            assert find_missing_dirs(dirs) == ["missing", "a_file", "a/missing"]
+
+            mocker.patch("builtins.print")
+            with pytest.raises(FileNotFoundError) as e:
+                check_dirs(dirs)
+            assert "missing, a_file, a/missing" in str(e.value)
+            assert print.call_count == 3
+
+    def test_parents_of_existing_dirs_are_not_stated(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.makedirs("a/b/c")
+            stat_cache = StatCache()
+
+            dirs = ["a/b/c", "a/b/", "a", "./a"]
+            assert find_missing_dirs(dirs, stat_cache=stat_cache) == []
+            # only the deepest dir was stat'ed
+            assert len(stat_cache) == 1
+
+    def test_parents_of_missing_dirs_are_stated(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.makedirs("a")
+
+            assert find_missing_dirs(["a/b", "a"]) == ["a/b"]
+            assert find_missing_dirs(["a/b", "a/b/c"]) == ["a/b", "a/b/c"]
+
+    def test_parents_are_not_inferred_through_dot_dot(self, tmpdir):
+        with sh.pushd(tmpdir):
+            os.makedirs("real/sub")
+            os.symlink("real/sub", "link")
+
+            # `link/..` is `real`, so `link/../sub` exists, but `sub` doesn't
+            assert find_missing_dirs(["link/../sub", "sub"]) == ["sub"]
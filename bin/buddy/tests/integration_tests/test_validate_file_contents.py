@@ -1,9 +1,18 @@
+import io
+import json
+import os
 import sh
+import sys
 
 from textwrap import dedent
 from pytest_mock import mocker
 
-from buddy.validate_file_contents import run_workflow
+from buddy.validate_file_contents import (
+    define_command_arg_parser,
+    open_report,
+    run_workflow,
+)
+from buddy.validation_reports import JsonLinesReportWriter
 from tests.integration_tests.data_for_md5sum_tests import empty_md5
 
 
@@ -29,3 +38,154 @@ class TestMd5sumWorkflow(object):
             mocker.patch("builtins.print")
             run_workflow("config.yaml")
             print.assert_not_called()
+
+    def test_failures_are_printed_when_ran_in_parallel(self, tmpdir, mocker):
+        yaml = dedent(
+            """
+            test1:
+                input_file: empty_file
+                expected_md5sum: {md5}
+            test2:
+                input_file: commented_file
+                expected_md5sum: {md5}
+                comment: "#"
+            test3:
+                input_file: commented_file
+                expected_md5sum: {md5}
+            """
+        ).format(md5=empty_md5())
+
+        with sh.pushd(tmpdir):
+            sh.touch("empty_file")
+            with open("commented_file", "w") as f:
+                print("# a comment", file=f)
+            with open("config.yaml", "w") as f:
+                print(yaml, file=f)
+
+            mocker.patch("builtins.print")
+            run_workflow("config.yaml", n_workers=3)
+            report = print.call_args[0][0]
+            assert report.count("[FAILURE]") == 1
+            assert "test_name:test3" in report
+
+    def test_quick_level_only_checks_metadata(self, tmpdir, mocker):
+        yaml = dedent(
+            """
+            right_metadata:
+                input_file: some_file
+                expected_md5sum: not_checked_at_quick_level
+                expected_size: 10
+                expected_mtime: 1500000000
+            wrong_size:
+                input_file: some_file
+                expected_size: 11
+            wrong_mtime:
+                input_file: some_file
+                expected_mtime: 1500000001.5
+            missing_file:
+                input_file: missing_file
+                expected_md5sum: {}
+            """
+        ).format(empty_md5())
+
+        with sh.pushd(tmpdir):
+            with open("some_file", "w") as f:
+                print("some-data", file=f)
+            os.utime("some_file", (1500000000.25, 1500000000.25))
+            with open("config.yaml", "w") as f:
+                print(yaml, file=f)
+
+            mocker.patch("builtins.print")
+            run_workflow("config.yaml", level="quick")
+            report = print.call_args[0][0]
+            assert "test_name:right_metadata" not in report
+            assert "test_name:wrong_size\ttest_type:metadata" in report
+            assert "test_name:wrong_mtime" in report
+            assert "test_name:missing_file" in report
+
+    def test_every_result_is_written_to_the_report(self, tmpdir, mocker):
+        yaml = dedent(
+            """
+            test1:
+                input_file: empty_file
+                expected_md5sum: {md5}
+            test2:
+                input_file: empty_file
+                expected_sha256: not_the_sha256
+            test3:
+                input_file: other_file
+                expected_md5sum: {md5}
+            """
+        ).format(md5=empty_md5())
+
+        with sh.pushd(tmpdir):
+            sh.touch("empty_file")
+            sh.touch("other_file")
+            with open("config.yaml", "w") as f:
+                print(yaml, file=f)
+
+            stream = io.StringIO()
+            mocker.patch("builtins.print")
+            run_workflow(
+                "config.yaml", n_workers=2, report_writer=JsonLinesReportWriter(stream)
+            )
+            results = {
+                result["test_name"]: result
+                for result in map(json.loads, stream.getvalue().splitlines())
+            }
+            assert sorted(results) == ["test1", "test2", "test3"]
+            assert results["test1"]["passed"] and results["test3"]["passed"]
+            assert results["test1"]["digest"] == empty_md5()
+            assert not results["test2"]["passed"]
+            assert results["test2"]["bytes_read"] == 0
+            assert results["test2"]["seconds"] >= 0
+
+    def test_timings_are_summarised_on_stderr(self, tmpdir, capsys):
+        yaml = dedent(
+            """
+            test1:
+                input_file: some_file
+                expected_md5sum: {}
+            """
+        ).format(empty_md5())
+
+        with sh.pushd(tmpdir):
+            with open("some_file", "w") as f:
+                print("some-data", file=f)
+            with open("config.yaml", "w") as f:
+                print(yaml, file=f)
+
+            run_workflow("config.yaml", timings=True)
+            captured = capsys.readouterr()
+            assert captured.out.startswith("[FAILURE]")
+            lines = captured.err.splitlines()
+            assert lines[0].split("\t")[:3] == [
+                "[TIMINGS]",
+                "files_read:1",
+                "bytes_read:10",
+            ]
+            assert lines[1].startswith("[SLOWEST]\ttest_name:test1")
+
+
+class TestOpenReport(object):
+    def test_report_file_is_closed_on_exit(self, tmpdir):
+        with sh.pushd(tmpdir):
+            args = define_command_arg_parser().parse_args(
+                ["tests.yaml", "--report", "report.jsonl"]
+            )
+            with open_report(args) as stream:
+                print("a-line", file=stream)
+            assert stream.closed
+            with open("report.jsonl") as f:
+                assert f.read() == "a-line\n"
+
+    def test_stdout_is_not_closed(self, mocker):
+        mocker.patch("sys.stdout", new_callable=io.StringIO)
+        args = define_command_arg_parser().parse_args(["tests.yaml", "--report", "-"])
+        with open_report(args) as stream:
+            assert stream is sys.stdout
+        assert not sys.stdout.closed
+
+        args = define_command_arg_parser().parse_args(["tests.yaml"])
+        with open_report(args) as stream:
+            assert stream is None
@@ -1,11 +1,27 @@
+import gzip
+import hashlib
+import os
 import pytest
 import sh
+import zlib
 
-from buddy.validation_classes import get_md5sum
+import buddy.validation_classes
+
+from buddy.validation_classes import (
+    HashStats,
+    find_changed_ranges,
+    get_chunk_digests,
+    get_digest,
+    get_digests,
+    get_md5sum,
+    update_chunk_digests,
+    _update_hashes_from_mapped_file,
+)
 from tests.integration_tests.data_for_md5sum_tests import empty_md5
 
 # user
 # .. can compare the md5sum of a file to a reference
+# .. can find which parts of a large table have changed
 
 
 class TestMd5sum(object):
@@ -23,6 +39,15 @@ class TestMd5sum(object):
             assert get_md5sum(f_non_empty) != empty_md5()
         pass
 
+    def test_md5sum_matches_hashlib_for_multi_block_files(self, tmpdir):
+        # the file spans several read-blocks and ends part-way through one
+        contents = bytes(range(256)) * 10000 + b"tail"
+        with sh.pushd(tmpdir):
+            with open("big_file", "wb") as f:
+                f.write(contents)
+
+            assert get_md5sum("big_file") == hashlib.md5(contents).hexdigest()
+
     def test_md5sum_fails_for_file_objects(self, tmpdir):
         # user must provide a file-name, not a file-object
         with sh.pushd(tmpdir):
@@ -46,3 +71,250 @@ class TestMd5sumOnSubsetOfFile(object):
                 print("# comment line", file=f)
 
             assert get_md5sum(f_comment, comment="#") == empty_md5()
+
+    def test_comment_lines_are_dropped_from_the_md5sum(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with open("commented_file", mode="w") as f:
+                print("# header", file=f)
+                print("a\tb", file=f)
+                print("#another comment", file=f)
+                print("c\td # not a comment line", file=f)
+
+            expected = hashlib.md5(b"a\tb\nc\td # not a comment line\n").hexdigest()
+            assert get_md5sum("commented_file", comment="#") == expected
+
+    @pytest.mark.parametrize(
+        "contents,expected",
+        [
+            (b"", b""),
+            (b"#only\n#comments", b""),
+            (b"no-newline-at-end", b"no-newline-at-end"),
+            (b"a\n#b\n#c\nd\n#e", b"a\nd\n"),
+            (b"a#b\n\n#\r\nc\r\n", b"a#b\n\nc\r\n"),
+        ],
+    )
+    def test_comment_lines_at_any_position(self, tmpdir, contents, expected):
+        with sh.pushd(tmpdir):
+            with open("some_file", "wb") as f:
+                f.write(contents)
+
+            assert (
+                get_md5sum("some_file", comment="#")
+                == hashlib.md5(expected).hexdigest()
+            )
+
+    def test_spans_between_comments_are_hashed_in_blocks(self, tmpdir):
+        contents = b"#header\n" + b"some-data\n" * 100 + b"#footer\n" + b"tail\n"
+        with sh.pushd(tmpdir):
+            with open("some_file", "wb") as f:
+                f.write(contents)
+
+            my_hash = hashlib.md5()
+            stats = HashStats()
+            with open("some_file", "rb") as f:
+                _update_hashes_from_mapped_file(
+                    [my_hash], f, b"#", stats, block_size=64
+                )
+            expected = hashlib.md5(b"some-data\n" * 100 + b"tail\n").hexdigest()
+            assert my_hash.hexdigest() == expected
+            assert stats.bytes_read == len(contents)
+
+
+class TestOtherDigests(object):
+    @pytest.mark.parametrize("algorithm", ["md5", "sha256", "blake2b"])
+    def test_hashlib_digests(self, tmpdir, algorithm):
+        contents = b"some-data\n" * 1000
+        with sh.pushd(tmpdir):
+            with open("some_file", "wb") as f:
+                f.write(contents)
+
+            expected = hashlib.new(algorithm, contents).hexdigest()
+            assert get_digest("some_file", algorithm) == expected
+
+    def test_crc32_digest(self, tmpdir):
+        contents = b"some-data\n" * 1000
+        with sh.pushd(tmpdir):
+            with open("some_file", "wb") as f:
+                f.write(contents)
+
+            expected = "{:08x}".format(zlib.crc32(contents))
+            assert get_digest("some_file", "crc32") == expected
+
+
+class TestMultipleDigests(object):
+    def test_single_pass_digests_match_individual_digests(self, tmpdir):
+        with sh.pushd(tmpdir):
+            with open("some_file", "w") as f:
+                print("# header", file=f)
+                print("some-data", file=f)
+
+            for comment in [None, "#"]:
+                digests = get_digests("some_file", ["md5", "sha256"], comment)
+                assert digests == {
+                    "md5": get_digest("some_file", "md5", comment),
+                    "sha256": get_digest("some_file", "sha256", comment),
+                }
+
+
+class TestHashStats(object):
+    def test_bytes_read_from_multi_block_files_are_counted(self, tmpdir):
+        contents = bytes(range(256)) * 10000 + b"tail"
+        with sh.pushd(tmpdir):
+            with open("big_file", "wb") as f:
+                f.write(contents)
+
+            stats = HashStats()
+            get_md5sum("big_file", stats=stats)
+            assert stats.bytes_read == len(contents)
+            assert stats.io_seconds >= 0 and stats.hash_seconds >= 0
+
+            get_md5sum("big_file", stats=stats)
+            assert stats.bytes_read == 2 * len(contents)
+
+    def test_comment_lines_are_read_but_not_hashed(self, tmpdir):
+        contents = b"# header\n" + b"some-data\n" * 100000
+        with sh.pushd(tmpdir):
+            with open("some_file", "wb") as f:
+                f.write(contents)
+
+            stats = HashStats()
+            assert (
+                get_md5sum("some_file", comment="#", stats=stats)
+                == hashlib.md5(contents[len(b"# header\n") :]).hexdigest()
+            )
+            assert stats.bytes_read == len(contents)
+
+
+class TestMd5sumOfGzippedFiles(object):
+    @staticmethod
+    def write_gzipped_file(file_name):
+        contents = b"# header\n" + b"gene\tcount\n" * 10000
+        with gzip.open(file_name, "wb", compresslevel=1) as f:
+            f.write(contents)
+        return contents
+
+    @pytest.mark.parametrize("gunzip", [None, ["gzip", "-dc"]])
+    def test_md5sum_of_decompressed_contents(self, tmpdir, monkeypatch, gunzip):
+        # `gzip -dc` stands in for a multithreaded decompressor
+        monkeypatch.setattr(
+            buddy.validation_classes, "find_parallel_gunzip", lambda: gunzip
+        )
+        with sh.pushd(tmpdir):
+            contents = self.write_gzipped_file("some_file.gz")
+
+            assert get_md5sum("some_file.gz", compression="gzip") == (
+                hashlib.md5(contents).hexdigest()
+            )
+            assert get_md5sum("some_file.gz", comment="#", compression="gzip") == (
+                hashlib.md5(contents[len(b"# header\n") :]).hexdigest()
+            )
+
+    @pytest.mark.parametrize("gunzip", [None, ["gzip", "-dc"]])
+    def test_invalid_gzip_file_raises(self, tmpdir, monkeypatch, gunzip):
+        monkeypatch.setattr(
+            buddy.validation_classes, "find_parallel_gunzip", lambda: gunzip
+        )
+        with sh.pushd(tmpdir):
+            with open("not_gzipped.gz", "w") as f:
+                print("some-data", file=f)
+
+            with pytest.raises(OSError):
+                get_md5sum("not_gzipped.gz", compression="gzip")
+
+    def test_unknown_compression_raises(self, tmpdir):
+        with sh.pushd(tmpdir):
+            sh.touch("some_file")
+            with pytest.raises(ValueError):
+                get_md5sum("some_file", compression="zip")
+
+
+class TestChunkDigests(object):
+    @pytest.fixture(autouse=True)
+    def small_chunks(self, monkeypatch):
+        monkeypatch.setattr(buddy.validation_classes, "CHUNK_MIN_SIZE", 1000)
+        monkeypatch.setattr(buddy.validation_classes, "CHUNK_MAX_SIZE", 8000)
+        monkeypatch.setattr(buddy.validation_classes, "CHUNK_BOUNDARY_MASK", 7)
+
+    @staticmethod
+    def table_rows():
+        return [b"row%d\tvalue%d\n" % (i, i) for i in range(2000)]
+
+    def test_chunks_cover_the_file(self, tmpdir):
+        contents = b"".join(self.table_rows())
+        with sh.pushd(tmpdir):
+            with open("table.tsv", "wb") as f:
+                f.write(contents)
+
+            chunks = get_chunk_digests("table.tsv")
+            assert len(chunks) > 10
+            offset = 0
+            for chunk in chunks:
+                assert chunk["offset"] == offset
+                offset += chunk["length"]
+                assert chunk["digest"] == hashlib.md5(
+                    contents[chunk["offset"] : offset]
+                ).hexdigest()
+                assert contents[offset - 1 : offset] == b"\n"
+            assert offset == len(contents)
+
+    def test_an_inserted_row_only_changes_nearby_chunks(self, tmpdir):
+        rows = self.table_rows()
+        with sh.pushd(tmpdir):
+            with open("table.tsv", "wb") as f:
+                f.write(b"".join(rows))
+            before = get_chunk_digests("table.tsv")
+
+            rows.insert(1000, b"new-row\tnew-value\n")
+            edit_start = len(b"".join(rows[:1000]))
+            with open("table.tsv", "wb") as f:
+                f.write(b"".join(rows))
+            after = get_chunk_digests("table.tsv")
+
+            changed_ranges = find_changed_ranges(before, after)
+            assert len(changed_ranges) == 1
+            start, end = changed_ranges[0]
+            assert start <= edit_start < end
+            assert end - start < len(b"".join(rows)) / 4
+            assert after[-1]["digest"] == before[-1]["digest"]
+
+    def test_chunks_can_be_updated_around_an_edit(self, tmpdir):
+        rows = self.table_rows()
+        with sh.pushd(tmpdir):
+            with open("table.tsv", "wb") as f:
+                f.write(b"".join(rows))
+            before = get_chunk_digests("table.tsv")
+
+            del rows[500:502]
+            rows[1500] = b"edited-row\n"
+            with open("table.tsv", "wb") as f:
+                f.write(b"".join(rows))
+
+            start = len(b"".join(rows[:500]))
+            end = len(b"".join(rows[:1501]))
+            assert update_chunk_digests("table.tsv", before, start, end) == (
+                get_chunk_digests("table.tsv")
+            )
+
+    def test_chunks_can_be_updated_after_an_append(self, tmpdir):
+        rows = self.table_rows()
+        with sh.pushd(tmpdir):
+            with open("table.tsv", "wb") as f:
+                f.write(b"".join(rows))
+            before = get_chunk_digests("table.tsv")
+
+            start = len(b"".join(rows))
+            with open("table.tsv", "ab") as f:
+                f.write(b"appended-row\tappended-value\n" * 3)
+            end = os.path.getsize("table.tsv")
+
+            assert update_chunk_digests("table.tsv", before, start, end) == (
+                get_chunk_digests("table.tsv")
+            )
+
+    def test_removed_chunks_are_reported_as_empty_ranges(self):
+        chunks = [
+            {"offset": 0, "length": 10, "digest": "a"},
+            {"offset": 10, "length": 10, "digest": "b"},
+        ]
+        assert find_changed_ranges(chunks, chunks) == []
+        assert find_changed_ranges(chunks, chunks[:1]) == [[10, 10]]
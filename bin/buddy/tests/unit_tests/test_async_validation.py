@@ -0,0 +1,125 @@
+import pytest
+import threading
+
+import buddy
+
+from buddy.async_validation import AdaptiveLimit, iter_group_results_async
+from buddy.validation_classes import ValidationResult
+from buddy.validation_workflow import ValidationWorkflow
+
+# user
+# .. can validate files on a high-latency file system with many reads in flight
+# .. doesn't have to tune the number of reads in flight
+
+
+def fake_validate_group(group, instrument=False):
+    return [
+        ValidationResult(
+            test_name=name,
+            test_type="md5sum",
+            input_file=name,
+            passed=not name.startswith("bad"),
+            bytes_read=100,
+        )
+        for name in group
+    ]
+
+
+class TestAdaptiveLimit(object):
+    @staticmethod
+    def record_window(limit, mocker, seconds):
+        mocker.patch("time.perf_counter", return_value=seconds)
+        for _ in range(8):
+            limit.record(1000)
+
+    def test_limit_grows_while_throughput_increases(self, mocker):
+        mocker.patch("time.perf_counter", return_value=0.0)
+        limit = AdaptiveLimit(initial=2, maximum=4)
+
+        self.record_window(limit, mocker, seconds=1.0)
+        assert limit.limit == 3
+        self.record_window(limit, mocker, seconds=1.5)
+        assert limit.limit == 4
+        self.record_window(limit, mocker, seconds=1.9)
+        assert limit.limit == 4
+
+    def test_limit_is_cut_when_throughput_falls(self, mocker):
+        mocker.patch("time.perf_counter", return_value=0.0)
+        limit = AdaptiveLimit(initial=4, maximum=8)
+
+        self.record_window(limit, mocker, seconds=1.0)
+        assert limit.limit == 5
+        self.record_window(limit, mocker, seconds=3.0)
+        assert limit.limit == 3
+        self.record_window(limit, mocker, seconds=5.0)
+        assert limit.limit == 3
+
+
+class TestIterGroupResultsAsync(object):
+    def test_every_group_is_validated(self):
+        groups = [["a"], ["b", "c"], ["d"]]
+        results = dict(iter_group_results_async(fake_validate_group, groups, 2))
+        assert sorted(results) == [0, 1, 2]
+        assert [r.test_name for r in results[1]] == ["b", "c"]
+
+    def test_no_more_than_max_in_flight_groups_run_at_once(self):
+        lock = threading.Lock()
+        counts = {"running": 0, "most": 0}
+
+        def slow_validate_group(group, instrument=False):
+            with lock:
+                counts["running"] += 1
+                counts["most"] = max(counts["most"], counts["running"])
+            threading.Event().wait(0.01)
+            with lock:
+                counts["running"] -= 1
+            return fake_validate_group(group)
+
+        groups = [[str(i)] for i in range(20)]
+        list(iter_group_results_async(slow_validate_group, groups, 3, adaptive=False))
+        assert 1 <= counts["most"] <= 3
+
+    def test_errors_are_raised(self):
+        def failing_validate_group(group, instrument=False):
+            raise FileNotFoundError(group[0])
+
+        with pytest.raises(FileNotFoundError):
+            list(iter_group_results_async(failing_validate_group, [["a"]], 2))
+
+    def test_closing_early_stops_new_groups(self):
+        started = []
+
+        def recording_validate_group(group, instrument=False):
+            started.append(group[0])
+            return fake_validate_group(group)
+
+        groups = [[str(i)] for i in range(100)]
+        results = iter_group_results_async(
+            recording_validate_group, groups, 2, adaptive=False
+        )
+        next(results)
+        results.close()
+        assert len(started) < 100
+
+
+class TestAsyncWorkflow(object):
+    def test_async_runner_finds_the_failures(self, monkeypatch):
+        def mock_md5sum(filepath, comment=None):
+            return "b" * 32 if filepath == "bad_file" else "a" * 32
+
+        monkeypatch.setattr(buddy.validation_classes, "get_md5sum", mock_md5sum)
+        yaml_dict = {
+            "test{}".format(i): {
+                "input_file": "bad_file" if i == 3 else "file{}".format(i),
+                "expected_md5sum": "a" * 32,
+            }
+            for i in range(5)
+        }
+        workflow = ValidationWorkflow.from_yaml_dict(yaml_dict)
+
+        failures = workflow.get_failing_validators(n_workers=3, runner="async")
+        assert list(failures) == ["test3"]
+
+    def test_unknown_runner_raises(self):
+        with pytest.raises(ValueError):
+            list(ValidationWorkflow({}).iter_results(runner="sometimes"))
@@ -1,6 +1,8 @@
 from mock import patch, mock_open
 
-from buddy.file_utils import read_yaml
+import pytest
+
+from buddy.file_utils import read_config_lines, read_path_pairs, read_yaml
 from tests.unit_tests.data_for_git_tests import yaml_document, repo_dict1, repo_dict2
 
 
@@ -12,3 +14,24 @@ class TestReadYaml(object):
     @patch("builtins.open", new_callable=mock_open, read_data=yaml_document())
     def test_nonempty_yaml(self, m):
         assert read_yaml("some_file") == {"repo1": repo_dict1(), "repo2": repo_dict2()}
+
+
+class TestReadConfigLines(object):
+    @patch(
+        "builtins.open",
+        new_callable=mock_open,
+        read_data="# a comment\n\n./data\n  ./results  \n",
+    )
+    def test_comments_and_blanks_are_dropped(self, m):
+        assert read_config_lines("some_file") == ["./data", "./results"]
+
+
+class TestReadPathPairs(object):
+    @patch("builtins.open", new_callable=mock_open, read_data="a.txt\t./b.txt\n")
+    def test_pair(self, m):
+        assert read_path_pairs("some_file") == [("a.txt", "./b.txt")]
+
+    @patch("builtins.open", new_callable=mock_open, read_data="a.txt\n")
+    def test_error_if_line_has_one_path(self, m):
+        with pytest.raises(ValueError):
+            read_path_pairs("some_file")
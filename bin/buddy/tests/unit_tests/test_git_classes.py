@@ -45,6 +45,15 @@ class TestGitClone(object):
         repo.clone()
         sh.git.assert_called_once_with("clone", repo.input_path, repo.output_path)
 
+    def test_clone_from_cache(self, mocker):
+        mocker.patch("sh.git")
+        mocker.patch("os.path.exists", return_value=False)
+        cache = mocker.Mock()
+        repo = ExternalRepository(*repo_data1())
+        repo.clone(cache=cache)
+        cache.clone.assert_called_once_with(repo.input_path, repo.output_path)
+        sh.git.assert_not_called()
+
     def test_no_clone_when_local_copy_exists(self, mocker):
         mocker.patch("sh.git")
         mocker.patch("os.path.exists", return_value=True)
@@ -61,6 +70,19 @@ class TestGitCommit(object):
         sh.git.assert_called_once_with("-C", repo.output_path, "checkout", repo.commit)
 
 
+class TestSha1Matches(object):
+    def test_abbreviated_commit_matches_head(self, mocker):
+        mocker.patch("sh.git", return_value="a1b2c3d4e5f6\n")
+        repo = ExternalRepository(*repo_data1())
+        assert repo.sha1_matches()
+        sh.git.assert_called_once_with("-C", repo.output_path, "rev-parse", "HEAD")
+
+    def test_other_commit_doesnt_match(self, mocker):
+        mocker.patch("sh.git", return_value="ffffffffffff\n")
+        repo = ExternalRepository(*repo_data1())
+        assert not repo.sha1_matches()
+
+
 # How do we test that a specific commit of a git repo can be checked out?
 # - Unit tests with mocking:
 #   - patch sh.git; patch os.path.exists
@@ -1,6 +1,7 @@
 import os
+import pytest
 
-from buddy.setup_git_clones import parse_repository_details
+from buddy.setup_git_clones import parse_repository_details, provision_repositories
 from buddy.git_classes import ExternalRepository
 
 from tests.unit_tests.data_for_git_tests import (
@@ -28,6 +29,18 @@ class TestParseRepositoryDetails(object):
             "repo2": ExternalRepository(*repo_data2()),
         }
 
+    def test_shallow_repository(self):
+        repo_yaml = {
+            "repo_name": dict(
+                repo_dict1(), shallow=True, filter="blob:none", sparse=["/R/"]
+            )
+        }
+        assert parse_repository_details(repo_yaml) == {
+            "repo_name": ExternalRepository(
+                *repo_data1(), shallow=True, filter="blob:none", sparse=["/R/"]
+            )
+        }
+
     def test_malformed_repository_data(self):
         pass
 
@@ -48,3 +61,53 @@ class TestLocalRepositoryExists(object):
         monkeypatch.setattr(os.path, "exists", mock_return)
         repo = ExternalRepository(*repo_data1())
         assert not repo.local_exists()
+
+
+class TestProvisionRepositories(object):
+    def test_every_repository_is_cloned_and_checked_out(self, mocker):
+        clone = mocker.patch.object(ExternalRepository, "clone")
+        checkout = mocker.patch.object(ExternalRepository, "checkout")
+        repositories = {
+            "repo1": ExternalRepository(*repo_data1()),
+            "repo2": ExternalRepository(*repo_data2()),
+        }
+        provision_repositories(repositories, n_workers=2)
+        assert clone.call_count == 2
+        assert checkout.call_count == 2
+
+    def test_all_failures_are_reported(self, mocker, capsys):
+        # - both clones fail; both failures are reported and the error for the
+        # first repository is raised
+        def fail(repo, cache=None):
+            raise RuntimeError("can't clone {}".format(repo.input_path))
+
+        mocker.patch.object(
+            ExternalRepository, "clone", autospec=True, side_effect=fail
+        )
+        mocker.patch.object(ExternalRepository, "checkout")
+        repositories = {
+            "repo1": ExternalRepository(*repo_data1()),
+            "repo2": ExternalRepository(*repo_data2()),
+        }
+        with pytest.raises(RuntimeError, match=repo_data1()[0]):
+            provision_repositories(repositories, n_workers=2)
+
+        failures = [
+            line
+            for line in capsys.readouterr().err.splitlines()
+            if line.startswith("[FAILED]")
+        ]
+        assert sorted(line.split("\t")[1] for line in failures) == [
+            "repository:repo1",
+            "repository:repo2",
+        ]
+
+    def test_error_if_outputs_collide(self, mocker):
+        mocker.patch.object(ExternalRepository, "clone")
+        url, commit, output = repo_data1()
+        repositories = {
+            "repo1": ExternalRepository(url, commit, output),
+            "repo2": ExternalRepository(*repo_data2()[:2], output),
+        }
+        with pytest.raises(ValueError):
+            provision_repositories(repositories)
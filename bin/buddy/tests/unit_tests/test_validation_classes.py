@@ -1,6 +1,6 @@
 import buddy.validate_file_contents
 
-from buddy.validation_classes import Md5sumValidator
+from buddy.validation_classes import Md5sumValidator, mtimes_match
 
 # user
 # .. can ensure the md5sum for a file matches a given value
@@ -75,3 +75,28 @@ class TestMd5sumValidatorMethods(object):
         )
 
         assert validator.is_valid()
+
+    def test_cache_is_passed_to_get_md5sum(self, monkeypatch):
+        def mock_return(filepath, comment=None, cache=None):
+            return cache
+
+        monkeypatch.setattr(buddy.validation_classes, "get_md5sum", mock_return)
+
+        validator = Md5sumValidator(
+            test_name="test1",
+            input_file="some_file",
+            expected_md5sum="some_cache",
+            cache="some_cache",
+        )
+
+        assert validator.is_valid()
+
+
+class TestMtimeComparison(object):
+    def test_integer_mtimes_match_within_the_second(self):
+        assert mtimes_match(1500000000.75, 1500000000)
+        assert not mtimes_match(1500000001.0, 1500000000)
+
+    def test_decimal_mtimes_must_match_closely(self):
+        assert mtimes_match(1500000000.123456789, 1500000000.1234568)
+        assert not mtimes_match(1500000000.5, 1500000000.25)
@@ -0,0 +1,153 @@
+import io
+import json
+
+from buddy.validation_classes import ValidationResult
+from buddy.validation_reports import (
+    JsonLinesReportWriter,
+    MultiReportWriter,
+    TimingSummary,
+    TsvReportWriter,
+)
+
+# user
+# .. can follow the progress of a validation run
+# .. can load the results of a validation run into other tools
+# .. can tell whether a validation run is limited by I/O or by hashing
+
+
+def passing_result():
+    return ValidationResult(
+        test_name="test1",
+        test_type="md5sum",
+        input_file="some_file",
+        passed=True,
+        digest="a" * 32,
+        bytes_read=2000000,
+        seconds=0.5,
+        io_seconds=0.375,
+        hash_seconds=0.125,
+    )
+
+
+def failing_metadata_result():
+    return ValidationResult(
+        test_name="test2",
+        test_type="metadata",
+        input_file="missing_file",
+        passed=False,
+        bytes_read=0,
+    )
+
+
+class TestValidationResult(object):
+    def test_throughput_in_megabytes_per_second(self):
+        assert passing_result().throughput == 4.0
+
+    def test_throughput_is_unknown_without_timing(self):
+        assert failing_metadata_result().throughput is None
+
+
+class TestJsonLinesReportWriter(object):
+    def test_one_json_object_per_result(self):
+        stream = io.StringIO()
+        writer = JsonLinesReportWriter(stream)
+        writer.write(passing_result())
+        writer.write(failing_metadata_result())
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0]) == passing_result().to_dict()
+        assert json.loads(lines[1])["passed"] is False
+
+
+class TestTsvReportWriter(object):
+    def test_header_then_one_row_per_result(self):
+        stream = io.StringIO()
+        writer = TsvReportWriter(stream)
+        writer.write(passing_result())
+        writer.write(failing_metadata_result())
+
+        lines = stream.getvalue().splitlines()
+        assert lines[0].split("\t")[:4] == [
+            "test_name",
+            "test_type",
+            "input_file",
+            "passed",
+        ]
+        assert lines[1].split("\t") == [
+            "test1",
+            "md5sum",
+            "some_file",
+            "PASS",
+            "a" * 32,
+            "2000000",
+            "0.5",
+            "4.0",
+            "0.375",
+            "0.125",
+            "NA",
+        ]
+        assert lines[2].split("\t")[3:5] == ["FAIL", "NA"]
+
+    def test_changed_ranges_of_chunk_tests_are_written(self):
+        stream = io.StringIO()
+        writer = TsvReportWriter(stream)
+        writer.write(
+            ValidationResult(
+                test_name="test3",
+                test_type="chunks",
+                input_file="table.tsv",
+                passed=False,
+                changed_ranges=[[10, 22], [40, 40]],
+            )
+        )
+
+        header, row = stream.getvalue().splitlines()
+        fields = dict(zip(header.split("\t"), row.split("\t")))
+        assert fields["changed_ranges"] == "10-22,40-40"
+
+
+class TestMultiReportWriter(object):
+    def test_results_are_passed_to_every_writer(self):
+        streams = [io.StringIO(), io.StringIO()]
+        writer = MultiReportWriter([JsonLinesReportWriter(s) for s in streams])
+        writer.write(passing_result())
+
+        assert [len(s.getvalue().splitlines()) for s in streams] == [1, 1]
+
+
+class TestTimingSummary(object):
+    def test_totals_over_all_results(self):
+        summary = TimingSummary()
+        summary.write(passing_result())
+        summary.write(failing_metadata_result())
+
+        assert summary.bytes_read == 2000000
+        assert summary.io_seconds == 0.375
+        assert summary.hash_seconds == 0.125
+        assert summary.slowest() == [passing_result()]
+
+    def test_summary_has_totals_then_slowest_files(self):
+        summary = TimingSummary()
+        summary.write(passing_result())
+
+        lines = summary.format().splitlines()
+        assert lines[0].split("\t")[:3] == [
+            "[TIMINGS]",
+            "files_read:1",
+            "bytes_read:2000000",
+        ]
+        assert lines[1].split("\t") == [
+            "[SLOWEST]",
+            "test_name:test1",
+            "input_file:some_file",
+            "seconds:0.500",
+            "throughput_mb_per_s:4.000",
+        ]
+
+    def test_throughput_is_unknown_when_nothing_was_read(self):
+        summary = TimingSummary()
+        summary.write(failing_metadata_result())
+
+        assert summary.throughput is None
+        assert "throughput_mb_per_s:NA" in summary.format()
@@ -1,10 +1,25 @@
+import pytest
+
 from mock import patch, mock_open
 
 
 import buddy
 
-from buddy.validation_workflow import ValidationWorkflow
-from buddy.validation_classes import Md5sumValidator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from buddy.validation_workflow import (
+    ValidationWorkflow,
+    choose_executor_class,
+    group_by_read_key,
+)
+from buddy.validation_classes import (
+    Blake2bValidator,
+    ChunkValidator,
+    Crc32Validator,
+    Md5sumValidator,
+    MetadataValidator,
+    Sha256Validator,
+)
 
 # ---- test data
 
@@ -121,6 +136,222 @@ class TestGetFailingValidators(object):
         assert validator_dict == workflow.get_failing_validators()
 
 
+class TestParallelValidation(object):
+    @staticmethod
+    def many_md5sum_validators():
+        return {
+            "test{}".format(i): Md5sumValidator(
+                test_name="test{}".format(i),
+                input_file="file{}".format(i),
+                expected_md5sum="a" * 32,
+            )
+            for i in range(10)
+        }
+
+    def test_failures_are_reported_in_validator_order(self, monkeypatch):
+        # odd-numbered files fail
+        def mock_md5sum(filepath, comment=None):
+            return "b" * 32 if int(filepath[4:]) % 2 else "a" * 32
+
+        monkeypatch.setattr(buddy.validation_classes, "get_md5sum", mock_md5sum)
+
+        validator_dict = self.many_md5sum_validators()
+        workflow = ValidationWorkflow(validator_dict)
+        sequential = workflow.get_failing_validators()
+        parallel = workflow.get_failing_validators(n_workers=4)
+        assert list(parallel.keys()) == ["test1", "test3", "test5", "test7", "test9"]
+        assert list(parallel.keys()) == list(sequential.keys())
+        assert workflow.format_failure_report(
+            n_workers=4
+        ) == workflow.format_failure_report(n_workers=1)
+
+    def test_threads_are_used_for_io_bound_validators(self):
+        validators = self.many_md5sum_validators().values()
+        assert choose_executor_class(validators) is ThreadPoolExecutor
+
+    def test_processes_are_used_for_comment_filtering_validators(self):
+        validators = list(self.many_md5sum_validators().values())
+        validators[0].comment = "#"
+        assert choose_executor_class(validators) is ProcessPoolExecutor
+
+
+class TestFailFastValidation(object):
+    def test_sequential_fail_fast_stops_after_first_failure(self, mocker):
+        mocker.patch("buddy.validation_classes.os.stat")
+        mock_md5sum = mocker.patch(
+            "buddy.validation_classes.get_md5sum", return_value="b" * 32
+        )
+
+        workflow = ValidationWorkflow(TestParallelValidation.many_md5sum_validators())
+        failures = workflow.get_failing_validators(fail_fast=True)
+        assert list(failures.keys()) == ["test0"]
+        assert mock_md5sum.call_count == 1
+
+    def test_parallel_fail_fast_reports_a_failure(self, mocker):
+        mocker.patch("buddy.validation_classes.os.stat")
+        mocker.patch("buddy.validation_classes.get_md5sum", return_value="b" * 32)
+
+        workflow = ValidationWorkflow(TestParallelValidation.many_md5sum_validators())
+        failures = workflow.get_failing_validators(n_workers=2, fail_fast=True)
+        assert 1 <= len(failures) <= 10
+
+    def test_prefilter_fails_missing_files_without_hashing(self, mocker):
+        mocker.patch(
+            "buddy.validation_classes.os.stat", side_effect=FileNotFoundError()
+        )
+        mock_md5sum = mocker.patch(
+            "buddy.validation_classes.get_md5sum", return_value="a" * 32
+        )
+
+        workflow = ValidationWorkflow(single_md5sum_validator())
+        assert workflow.get_failing_validators(prefilter=True) == (
+            single_md5sum_validator()
+        )
+        mock_md5sum.assert_not_called()
+
+    def test_prefilter_fails_files_of_unexpected_size(self, mocker):
+        mocker.patch(
+            "buddy.validation_classes.os.stat", return_value=mocker.Mock(st_size=10)
+        )
+        mock_md5sum = mocker.patch(
+            "buddy.validation_classes.get_md5sum", return_value="a" * 32
+        )
+        validators = {
+            "right_size": Md5sumValidator(
+                test_name="right_size",
+                input_file="file1",
+                expected_md5sum="a" * 32,
+                expected_size=10,
+            ),
+            "wrong_size": Md5sumValidator(
+                test_name="wrong_size",
+                input_file="file2",
+                expected_md5sum="a" * 32,
+                expected_size=11,
+            ),
+        }
+
+        workflow = ValidationWorkflow(validators)
+        failures = workflow.get_failing_validators(prefilter=True)
+        assert list(failures.keys()) == ["wrong_size"]
+        mock_md5sum.assert_called_once_with("file1", None)
+
+
+class TestMetadataValidation(object):
+    def test_each_file_is_stat_ed_once(self, mocker):
+        mock_stat = mocker.patch(
+            "os.stat", return_value=mocker.Mock(st_size=10, st_mtime=0.0)
+        )
+        mock_md5sum = mocker.patch("buddy.validation_classes.get_md5sum")
+        validators = TestSinglePassValidation.md5_and_sha256_validators()
+
+        workflow = ValidationWorkflow(validators)
+        assert workflow.get_failing_validators(level="quick") == {}
+        assert mock_stat.call_count == 2
+        mock_md5sum.assert_not_called()
+
+    def test_full_level_fails_files_of_unexpected_metadata(self, mocker):
+        mocker.patch(
+            "buddy.validation_classes.os.stat",
+            return_value=mocker.Mock(st_size=10, st_mtime=100.0),
+        )
+        mock_md5sum = mocker.patch(
+            "buddy.validation_classes.get_md5sum", return_value="a" * 32
+        )
+        validators = {
+            "right_metadata": Md5sumValidator(
+                test_name="right_metadata",
+                input_file="file1",
+                expected_md5sum="a" * 32,
+                expected_size=10,
+                expected_mtime=100.0,
+            ),
+            "wrong_metadata": Md5sumValidator(
+                test_name="wrong_metadata",
+                input_file="file2",
+                expected_md5sum="a" * 32,
+                expected_size=11,
+                expected_mtime=200.0,
+            ),
+        }
+
+        workflow = ValidationWorkflow(validators)
+        outcomes = {result.test_name: result for result in workflow.iter_results()}
+        assert outcomes["right_metadata"].passed
+        assert not outcomes["wrong_metadata"].passed
+        # without `prefilter`, the digest is still computed and reported
+        assert outcomes["wrong_metadata"].digest == "a" * 32
+        assert mock_md5sum.call_count == 2
+
+    def test_unknown_level_raises(self):
+        with pytest.raises(ValueError):
+            ValidationWorkflow({}).run_validators(level="medium")
+
+    def test_metadata_only_tests_can_be_parsed(self):
+        yaml_dict = {"test1": {"input_file": "some_file", "expected_size": 10}}
+        validators = ValidationWorkflow.parse_validator_details(yaml_dict)
+        assert validators == {
+            "test1": MetadataValidator(
+                test_name="test1", input_file="some_file", expected_size=10
+            )
+        }
+
+
+class TestSinglePassValidation(object):
+    @staticmethod
+    def md5_and_sha256_validators():
+        return {
+            "md5_test": Md5sumValidator(
+                test_name="md5_test", input_file="some_file", expected_md5sum="a" * 32
+            ),
+            "other_file_test": Md5sumValidator(
+                test_name="other_file_test",
+                input_file="other_file",
+                expected_md5sum="a" * 32,
+            ),
+            "sha_test": Sha256Validator(
+                test_name="sha_test",
+                input_file="./some_file",
+                expected_sha256="b" * 64,
+            ),
+        }
+
+    def test_validators_are_grouped_by_input_file(self):
+        assert group_by_read_key(self.md5_and_sha256_validators()) == [
+            ["md5_test", "sha_test"],
+            ["other_file_test"],
+        ]
+
+    def test_files_are_read_once_for_all_of_their_digests(self, mocker):
+        def mock_digests(filepath, algorithms, comment=None):
+            return {"md5": "a" * 32, "sha256": "c" * 64}
+
+        mocker.patch("buddy.validation_workflow.get_digests", side_effect=mock_digests)
+        mocker.patch("buddy.validation_classes.get_md5sum", return_value="a" * 32)
+
+        workflow = ValidationWorkflow(self.md5_and_sha256_validators())
+        assert list(workflow.get_failing_validators().keys()) == ["sha_test"]
+        buddy.validation_workflow.get_digests.assert_called_once_with(
+            "some_file", ["md5", "sha256"], None
+        )
+
+    def test_a_shared_read_is_attributed_to_the_first_result(self, mocker):
+        def mock_digests(filepath, algorithms, comment=None, stats=None):
+            stats.add(bytes_read=100, io_seconds=0.5, hash_seconds=0.25)
+            return {"md5": "a" * 32, "sha256": "b" * 64}
+
+        mocker.patch("buddy.validation_workflow.get_digests", side_effect=mock_digests)
+        mocker.patch("buddy.validation_classes.get_md5sum", return_value="a" * 32)
+
+        workflow = ValidationWorkflow(self.md5_and_sha256_validators())
+        results = {r.test_name: r for r in workflow.iter_results(instrument=True)}
+        assert results["md5_test"].bytes_read == 100
+        assert results["md5_test"].io_seconds == 0.5
+        assert results["md5_test"].hash_seconds == 0.25
+        assert results["sha_test"].bytes_read == 0
+        assert results["sha_test"].seconds == 0.0
+
+
 class TestValidationReportFormatting(object):
     def test_all_passing_means_no_report(self, monkeypatch):
         # returns a string
@@ -152,6 +383,32 @@ class TestValidationReportFormatting(object):
         )
         assert report == workflow.format_failure_report()
 
+    def test_changed_ranges_are_reported_for_chunk_tests(self, mocker):
+        expected_chunks = [
+            {"offset": 0, "length": 10, "digest": "a" * 32},
+            {"offset": 10, "length": 10, "digest": "b" * 32},
+        ]
+        observed_chunks = [
+            {"offset": 0, "length": 10, "digest": "a" * 32},
+            {"offset": 10, "length": 12, "digest": "c" * 32},
+        ]
+        mocker.patch(
+            "buddy.validation_classes.get_chunk_digests", return_value=observed_chunks
+        )
+
+        workflow = ValidationWorkflow.from_yaml_dict(
+            {"my_test": {"input_file": "some_file", "expected_chunks": expected_chunks}}
+        )
+        assert workflow.format_failure_report() == "\t".join(
+            [
+                "[FAILURE]",
+                "test_name:my_test",
+                "test_type:chunks",
+                "input_file:some_file",
+                "changed_ranges:10-22",
+            ]
+        )
+
 
 class TestParseValidatorDetails(object):
     def test_md5sum_validators_can_be_parsed(self):
@@ -183,3 +440,82 @@ class TestParseValidatorDetails(object):
 
         assert all(map(lambda x: isinstance(x, Md5sumValidator), validators.values()))
         assert validators == expected_validators
+
+    def test_other_digest_validators_can_be_parsed(self):
+        yaml_dict = {
+            "test1": {"input_file": "some_file", "expected_sha256": "a" * 64},
+            "test2": {"input_file": "some_file", "expected_blake2b": "b" * 128},
+            "test3": {"input_file": "some_file", "expected_crc32": "c" * 8},
+        }
+
+        expected_validators = {
+            "test1": Sha256Validator(
+                test_name="test1", input_file="some_file", expected_sha256="a" * 64
+            ),
+            "test2": Blake2bValidator(
+                test_name="test2", input_file="some_file", expected_blake2b="b" * 128
+            ),
+            "test3": Crc32Validator(
+                test_name="test3", input_file="some_file", expected_crc32="c" * 8
+            ),
+        }
+        validators = ValidationWorkflow.parse_validator_details(yaml_dict)
+
+        assert validators == expected_validators
+        assert validators["test1"].test_type == "sha256sum"
+
+    def test_validators_of_different_types_are_not_equal(self):
+        md5_validator = Md5sumValidator(
+            test_name="test1", input_file="some_file", expected_md5sum="a" * 32
+        )
+        sha_validator = Sha256Validator(
+            test_name="test1", input_file="some_file", expected_sha256="a" * 32
+        )
+        assert md5_validator != sha_validator
+
+    def test_exactly_one_expected_digest_is_required(self):
+        with pytest.raises(ValueError):
+            ValidationWorkflow.parse_validator_details(
+                {"test1": {"input_file": "some_file"}}
+            )
+        with pytest.raises(ValueError):
+            ValidationWorkflow.parse_validator_details(
+                {
+                    "test1": {
+                        "input_file": "some_file",
+                        "expected_md5sum": "a" * 32,
+                        "expected_sha256": "a" * 64,
+                    }
+                }
+            )
+
+    def test_unavailable_algorithms_are_reported(self, monkeypatch):
+        monkeypatch.delitem(buddy.validation_classes.HASH_CONSTRUCTORS, "xxh64", False)
+        with pytest.raises(ValueError):
+            ValidationWorkflow.parse_validator_details(
+                {"test1": {"input_file": "some_file", "expected_xxh64": "a" * 16}}
+            )
+
+    def test_compression_is_parsed(self):
+        yaml_dict = {
+            "test1": {
+                "input_file": "some_file.gz",
+                "expected_md5sum": "a" * 32,
+                "compression": "gzip",
+            }
+        }
+        validators = ValidationWorkflow.parse_validator_details(yaml_dict)
+        assert validators["test1"].compression == "gzip"
+        assert validators["test1"] != Md5sumValidator(
+            test_name="test1", input_file="some_file.gz", expected_md5sum="a" * 32
+        )
+
+    def test_chunk_validators_can_be_parsed(self):
+        chunks = [{"offset": 0, "length": 10, "digest": "a" * 32}]
+        validators = ValidationWorkflow.parse_validator_details(
+            {"test1": {"input_file": "some_file", "expected_chunks": chunks}}
+        )
+        assert validators["test1"] == ChunkValidator(
+            test_name="test1", input_file="some_file", expected_chunks=chunks
+        )
+        assert not validators["test1"].is_io_bound
@@ -4,16 +4,39 @@
 This script calls the code for various aspects of the current project:
 
 - `sidekick setup ...` : set-up the file-structure / packages for the current
-  project.
+  project (`--dry-run` prints the planned changes to the file-structure; a
+  project that is already set up is skipped unless `--force` is given).
 
 - `sidekick validate --yaml ...` : check that results files or input data files
   are consistent with the expectations (eg, they haven't been corrupted during
   storage / transfer or altered by changes to the analysis code).
+
+- `sidekick manifest write|check|update <root> <manifest> ...` : write a
+  validation yaml for every file in a directory tree; report the files in the
+  tree that were added / removed / changed since the manifest was written; or
+  update the manifest, re-hashing only the new / modified files.
 """
 
 import argparse
 import os
 import subprocess
+import sys
+
+
+def import_setup_project():
+    """
+    Import the `buddy.setup_project` module from this project's copy of
+    `buddy` (which may not have been installed yet).
+
+    :return: The module, or None if it can't be imported.
+    """
+    bin_dir = os.path.dirname(os.path.realpath(__file__))
+    sys.path.insert(0, os.path.join(bin_dir, "buddy"))
+    try:
+        from buddy import setup_project
+    except ImportError:
+        return None
+    return setup_project
 
 
 def setup(args):
@@ -24,7 +47,26 @@ def setup(args):
     - Defines the file structure
     - Builds and installs any required packages
     - Then does this recursively for any subprojects
+
+    If the project (and each of its subprojects) is already set up, nothing is
+    run. With `--dry-run`, the planned changes to the file structure are
+    printed instead.
     """
+    setup_project = import_setup_project()
+    if args.dry_run:
+        if setup_project is None:
+            sys.exit("sidekick: `buddy.setup_project` can't be imported")
+        setup_project.run_workflow(setup_project.DEFAULT_CONFIG_DIR, dry_run=True)
+        return
+
+    if (
+        not args.force
+        and setup_project is not None
+        and setup_project.is_setup_current()
+    ):
+        print("sidekick: the project is already set up", file=sys.stderr)
+        return
+
     try:
         subprocess.run(["./scripts/setup.sh"], check=True)
     except:
@@ -42,7 +84,18 @@ def validate(args):
     validation_script = os.path.join(
         "bin", "buddy", "buddy", "validate_file_contents.py"
     )
-    subprocess.run(["python", validation_script] + args.yaml)
+    subprocess.run(["python", validation_script] + args.yaml + args.options)
+
+
+def manifest(args):
+    """
+    Run the manifest script for a directory tree in this project.
+    """
+    manifest_script = os.path.join("bin", "buddy", "buddy", "tree_manifest.py")
+    subprocess.run(
+        ["python", manifest_script, args.mode, args.root, args.manifest]
+        + args.options
+    )
 
 
 # ---- parsers
@@ -55,6 +108,15 @@ def add_setup_subparser(subparsers):
 
     setup_parser = subparsers.add_parser("setup")
     setup_parser.set_defaults(func=setup)
+    setup_parser.add_argument(
+        "--dry-run", action="store_true",
+        help="print the links / dirs / copies / clones / touched files that\n"
+        "setup would make, without making them"
+    )
+    setup_parser.add_argument(
+        "--force", action="store_true",
+        help="run the setup scripts even if the project is already set up"
+    )
 
 
 import textwrap
@@ -74,6 +136,21 @@ def add_validation_subparser(subparsers):
                 test_name_X:
                     input_file: compare_the_md5sum_for_this_file
                     expected_md5sum: against_this_hashcode
+
+            `expected_sha256`, `expected_blake2b`, `expected_crc32`,
+            `expected_crc32c` or `expected_xxh64` can be used in place of
+            `expected_md5sum`. Add `comment: "#"` to ignore comment lines,
+            and `compression: gzip` to hash the decompressed contents of a
+            `.gz` file. `expected_size` (bytes) and `expected_mtime` (seconds
+            since the epoch) are checked with a single `stat()`; use
+            `--level quick` to run only those checks. `expected_chunks` (as
+            written by `sidekick manifest write ... --algorithm chunks`)
+            compares content-defined chunks and reports the changed byte
+            ranges of a file.
+
+            Any options that follow the yaml file are passed on to
+            `validate_file_contents.py`, eg, `--workers 4`, or
+            `--runner async --workers 32` for files on a network file system.
             """),
         formatter_class=argparse.RawTextHelpFormatter)
     validation_parser.set_defaults(func=validate)
@@ -81,6 +158,51 @@ def add_validation_subparser(subparsers):
         "yaml", type=str, nargs=1,
         help="yaml file containing the validation tests"
     )
+    validation_parser.add_argument(
+        "options", nargs=argparse.REMAINDER,
+        help="options for `validate_file_contents.py` (eg, `--workers 4`)"
+    )
+
+
+def add_manifest_subparser(subparsers):
+    """
+    Add a parser for `./sidekick manifest` arguments.
+    """
+    manifest_parser = subparsers.add_parser(
+        "manifest",
+        description=\
+            textwrap.dedent("""\
+            Write a manifest of every file in a directory tree: a yaml file of
+            validation tests (as for `sidekick validate`) that records the
+            digest, size and mtime of each file.
+
+            Or check a directory tree against its manifest, reporting any
+            files that were added, removed or changed.
+
+            Or update a manifest: only the new files and those whose size or
+            mtime have changed are hashed; the digests of the other files
+            are carried forward from the old manifest.
+
+            Any options that follow the manifest file are passed on to
+            `tree_manifest.py`, eg, `--exclude "*.log" --workers 8`.
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    manifest_parser.set_defaults(func=manifest)
+    manifest_parser.add_argument(
+        "mode", choices=["write", "check", "update"],
+        help="write a new manifest, check the tree against a manifest, or\n"
+        "update a manifest (re-hashing only new / modified files)"
+    )
+    manifest_parser.add_argument(
+        "root", help="root of the directory tree"
+    )
+    manifest_parser.add_argument(
+        "manifest", help="yaml file containing the manifest"
+    )
+    manifest_parser.add_argument(
+        "options", nargs=argparse.REMAINDER,
+        help="options for `tree_manifest.py` (eg, `--workers 4`)"
+    )
 
 
 def define_parser():
@@ -94,6 +216,7 @@ def define_parser():
 
     add_setup_subparser(subparsers)
     add_validation_subparser(subparsers)
+    add_manifest_subparser(subparsers)
 
     return parser
 
@@ -6,10 +6,17 @@ set -o pipefail
 ###############################################################################
 # 2017-08-29
 #
-# Script for recursively calling ./scripts/setup.sh for each subjob of the
+# Script for recursively calling ./sidekick setup for each subjob of the
 # current job.
 #
-# TODO: generalise this so that it can run for any job
+# The whole tree of subjobs (the subjobs of the current job, their subjobs,
+# and so on) is set up by `buddy/setup_subjobs.py`: each subjob is set up after
+# its parent, up to SIDEKICK_SUBJOB_WORKERS (default: 4) subjobs are set up at
+# once, and the output of each subjob's setup is written to
+# ./temp/setup_logs/<subjob_name>.log
+#
+# The setup of each subjob is ran with SIDEKICK_SKIP_SUBJOBS=1, so that it
+# doesn't set up its own subjobs (these are already part of the tree)
 #
 ###############################################################################
 
@@ -25,6 +32,12 @@ die_and_moan()
 # - ensuring that SUBJOBS_FILE only contains comments or blank lines
 # Note that 'not having a subjob' is not a failure case
 
+if [[ "${SIDEKICK_SKIP_SUBJOBS:-0}" == "1" ]];
+then
+  echo "${0}: Subjobs are set up by the setup of the parent job" >&2
+  exit
+fi
+
 if [[ -z "${SUBJOBS_FILE}" ]] || [[ ! -f "${SUBJOBS_FILE}" ]];
 then
   echo "${0}: No subjobs defined" >&2
@@ -35,39 +48,14 @@ fi
 # For every non-comment / non-blank line in the SUBJOBS_FILE, assume that a
 # subjob in ./subjobs/<subjob_name> exists and run it's setup-script
 
-while read -r LINE;
-do
-  # Ignore blanks and
-  # .. ignore lines if they start with '#' (ie, comment lines)
-  if [[ -z "${LINE}" ]] || [[ "${LINE:0:1}" == "#" ]];
-  then
-    continue
-  fi
-
-  # Define path to subjob and check that subjob is defined
-  SUBJOB_PATH="./subjobs/${LINE}"
-  if [[ ! -d "${SUBJOB_PATH}" ]];
-  then
-    die_and_moan \
-    "${0}: Subjob ${SUBJOB_PATH} should be defined before calling \
-     \n setup_subjobs.sh with ${LINE} in ${SUBJOBS_FILE}"
-  fi
+SUBJOB_SCRIPT="${BUDDY_PY}/buddy/setup_subjobs.py"
 
-  if [[ ! -f "${SUBJOB_PATH}/scripts/setup.sh" ]];
-  then
-    die_and_moan \
-    "${0}: Subjob ${SUBJOB_PATH} should have a scripts/setup.sh defined"
-  fi
-
-  # Change dir into the subjob,
-  #   run the setup scripts for the subjob,
-  #   then move back into the original directory.
-
-  # Since (...)-wrapping the code runs it in a subshell, we don't need to cd
-  #   back into the original directory.
-
-  (cd "${SUBJOB_PATH}" && ./sidekick setup)
+if [[ ! -f "${SUBJOB_SCRIPT}" ]];
+then
+  die_and_moan \
+  "${0}: subjob setup script: '${SUBJOB_SCRIPT}' is not available"
+fi
 
-done < "${SUBJOBS_FILE}"
+python3 "${SUBJOB_SCRIPT}" --workers "${SIDEKICK_SUBJOB_WORKERS:-4}"
 
 ###############################################################################
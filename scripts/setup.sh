@@ -185,3 +185,11 @@ else
 fi
 
 ###############################################################################
+# - Record that the project has been completely set up
+# - `./sidekick setup` skips all of the above while this stamp is newer than
+#   the setup config / scripts, ./lib (the R package sources) and ./bin/buddy,
+#   and there is nothing left to set up (see `buddy/setup_project.py`)
+
+touch "./.sidekick/setup_complete"
+
+###############################################################################